@@ -0,0 +1,140 @@
+"""Detecção de duplicidades e anomalias nas unidades.
+
+- Unidades próximas: pares a até dist_m metros, por junção espacial em grade
+  (células do tamanho da distância, comparando só células vizinhas), em
+  O(n log n) em vez de comparar todos os pares.
+- Coordenadas idênticas: unidades diferentes com o mesmo ponto.
+- Valores atípicos de área/profundidade dentro de cada tipo de Ocorrências,
+  por escore robusto (mediana e desvio absoluto mediano).
+"""
+import numpy as np
+import pandas as pd
+
+DIST_PADRAO_M = 30.0
+ESCORE_MAX = 3.5
+MIN_GRUPO = 5
+COLS_ATIPICOS = ["Atual Área (ha).1", "Atual Profun."]
+
+TIPO_PROXIMAS = "Unidades próximas"
+TIPO_IDENTICAS = "Coordenadas idênticas"
+TIPO_ATIPICO = "Valor atípico"
+
+COLUNAS = ["Tipo", "_pos", "_pos_rel", "CÓDIGO", "Relacionado", "Distância (m)", "Campo", "Valor", "Detalhe"]
+
+_M_POR_GRAU_LAT = 110_574.0
+_M_POR_GRAU_LON = 111_320.0
+
+def _metros(lat: np.ndarray, lon: np.ndarray):
+    """Projeção equiretangular local (suficiente para distâncias curtas)."""
+    cos0 = np.cos(np.radians(np.nanmean(lat))) if len(lat) else 1.0
+    return lon * _M_POR_GRAU_LON * cos0, lat * _M_POR_GRAU_LAT
+
+def near_pairs(lat: np.ndarray, lon: np.ndarray, dist_m: float):
+    """Pares (i, j, distância) com i < j a até dist_m metros.
+
+    Cada ponto vai para uma célula de lado dist_m; basta comparar a célula com
+    metade das vizinhas (as outras já aparecem pelo lado oposto). A busca das
+    células usa os códigos ordenados e searchsorted.
+    """
+    pos = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    vazio = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+    if len(pos) < 2 or dist_m <= 0:
+        return vazio
+    x, y = _metros(lat[pos], lon[pos])
+    cx = np.floor((x - x.min()) / dist_m).astype(np.int64)
+    cy = np.floor((y - y.min()) / dist_m).astype(np.int64)
+    largura = int(cy.max()) + 3
+    codigo = cx * largura + cy
+
+    ordem = np.argsort(codigo, kind="stable")
+    codigo_ord = codigo[ordem]
+
+    ii, jj = [], []
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        alvo = codigo + dx * largura + dy
+        ini = np.searchsorted(codigo_ord, alvo, side="left")
+        fim = np.searchsorted(codigo_ord, alvo, side="right")
+        qtd = fim - ini
+        if not qtd.any():
+            continue
+        a = np.repeat(np.arange(len(codigo)), qtd)
+        offsets = np.arange(qtd.sum()) - np.repeat(np.cumsum(qtd) - qtd, qtd)
+        b = ordem[np.repeat(ini, qtd) + offsets]
+        if dx == 0 and dy == 0:
+            manter = a < b
+            a, b = a[manter], b[manter]
+        ii.append(a)
+        jj.append(b)
+    if not ii:
+        return vazio
+    a = np.concatenate(ii)
+    b = np.concatenate(jj)
+    d = np.hypot(x[a] - x[b], y[a] - y[b])
+    perto = d <= dist_m
+    a, b, d = pos[a[perto]], pos[b[perto]], d[perto]
+    troca = a > b
+    a[troca], b[troca] = b[troca], a[troca]
+    return a, b, d
+
+def robust_outliers(valores: np.ndarray, grupos: np.ndarray, escore_max: float = ESCORE_MAX,
+                    min_grupo: int = MIN_GRUPO):
+    """Posições atípicas por grupo e seus escores robustos."""
+    s = pd.Series(valores, dtype=float)
+    g = pd.Series(grupos)
+    mediana = s.groupby(g, observed=True).transform("median")
+    mad = (s - mediana).abs().groupby(g, observed=True).transform("median")
+    tamanho = s.groupby(g, observed=True).transform("count")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        escore = ((s - mediana).abs() / (1.4826 * mad)).to_numpy(dtype=float)
+    ok = (tamanho.to_numpy(dtype=float) >= min_grupo) & (mad.to_numpy(dtype=float) > 0)
+    atipico = np.flatnonzero(ok & (escore > escore_max))
+    return atipico, escore[atipico], mediana.to_numpy(dtype=float)[atipico]
+
+def detect_anomalies(df: pd.DataFrame, dist_m: float = DIST_PADRAO_M) -> pd.DataFrame:
+    """Lista de alertas (uma linha por par ou por valor atípico)."""
+    partes = []
+    codigos = (
+        df["CÓDIGO"].to_numpy(dtype=object) if "CÓDIGO" in df.columns
+        else np.full(len(df), None, dtype=object)
+    )
+
+    if "_lat_wgs84" in df.columns and "_lon_wgs84" in df.columns:
+        lat = df["_lat_wgs84"].to_numpy(dtype=float)
+        lon = df["_lon_wgs84"].to_numpy(dtype=float)
+        a, b, d = near_pairs(lat, lon, dist_m)
+        identica = (lat[a] == lat[b]) & (lon[a] == lon[b])
+        partes.append(pd.DataFrame({
+            "Tipo": np.where(identica, TIPO_IDENTICAS, TIPO_PROXIMAS),
+            "_pos": a,
+            "_pos_rel": b,
+            "CÓDIGO": codigos[a],
+            "Relacionado": codigos[b],
+            "Distância (m)": d.round(1),
+            "Campo": None,
+            "Valor": np.nan,
+            "Detalhe": np.where(identica, "mesmo ponto", f"até {dist_m:g} m"),
+        }))
+
+    if "Ocorrências" in df.columns:
+        grupos = df["Ocorrências"].to_numpy(dtype=object)
+        for col in COLS_ATIPICOS:
+            if col not in df.columns:
+                continue
+            valores = df[col].to_numpy(dtype=float, na_value=np.nan)
+            pos, escore, mediana = robust_outliers(valores, grupos)
+            partes.append(pd.DataFrame({
+                "Tipo": TIPO_ATIPICO,
+                "_pos": pos,
+                "_pos_rel": -1,
+                "CÓDIGO": codigos[pos],
+                "Relacionado": grupos[pos],
+                "Distância (m)": np.nan,
+                "Campo": col,
+                "Valor": valores[pos],
+                "Detalhe": [f"mediana {m:.2f} • escore {e:.1f}" for m, e in zip(mediana, escore)],
+            }))
+
+    partes = [p for p in partes if len(p)]
+    if not partes:
+        return pd.DataFrame(columns=COLUNAS)
+    return pd.concat(partes, ignore_index=True)[COLUNAS]
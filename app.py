@@ -1,24 +1,52 @@
 import os
 import json
 import math
-import re
+import threading
+import time
 from datetime import datetime
+from functools import partial
+from urllib.parse import quote
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
-from zoneinfo import ZoneInfo
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 import folium
 from folium import LayerControl
-from folium.plugins import HeatMap
 from streamlit_folium import st_folium
 
 import altair as alt
 import streamlit.components.v1 as components
 from urllib.error import HTTPError
+from branca.colormap import StepColormap
 from branca.element import Template, MacroElement
 
+from pipeline import TZ, GEO_OK, DELTA_LABELS, SOURCE_COLUMNS, code_text
+from anomalies import DIST_PADRAO_M, TIPO_ATIPICO, detect_anomalies
+from charts import (
+    ChartSpecCache, configure, occurrence_chart, occurrence_counts,
+    occurrence_year_chart, occurrence_year_counts,
+)
+from dataset_store import DatasetStore
+from export import FORMATOS, export_filtered
+from filters import FilterResultCache, FilterState
+from map_cache import MAPA_CACHE_DIR, MapArtifactCache, MapOptions, artifact_key
+from metrics import BUCKETS_BYTES, REGISTRY, start_exporter
+from hexbins import (
+    HEX_METRICAS, HEX_RESOLUCAO_PADRAO, HEX_RESOLUCOES,
+    aggregate_hex, build_hex_grid, hex_geojson,
+)
+from ranking import divergence_scores, metric_scales, score_breakdown, top_k
+from photos import (
+    PhotoStatusCache, drive_image_urls, has_photos, photo_file_ids,
+    photo_ids, photo_links, photo_report, validate_links_sync,
+)
+from snapshots import divergence_over_time, list_snapshots, read_as_of, unit_history, write_snapshot
+from sources import source_from_config
+from unit_index import UnitIndex
+
 # =============================
 # Config geral
 # =============================
@@ -28,7 +56,49 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-TZ = ZoneInfo("America/Fortaleza")
+inicio_rerun = time.perf_counter()
+
+# =============================
+# Métricas (formato Prometheus, exportadas conforme VIVEIROS_METRICAS)
+# =============================
+RERUNS = REGISTRY.counter("viveiros_reruns_total", "Execuções completas do script do painel.")
+RERUN_SECONDS = REGISTRY.histogram("viveiros_rerun_seconds", "Duração de uma execução do script.")
+SESSIONS_ACTIVE = REGISTRY.gauge(
+    "viveiros_sessions_active", "Sessões com alguma execução nos últimos minutos."
+)
+MAP_SECONDS = REGISTRY.histogram("viveiros_map_render_seconds", "Duração da renderização do mapa.")
+MAP_PAYLOAD_BYTES = REGISTRY.histogram(
+    "viveiros_map_payload_bytes", "Tamanho do HTML dos mapas pré-renderizados.", buckets=BUCKETS_BYTES
+)
+DATASET_AGE = REGISTRY.gauge("viveiros_dataset_age_seconds", "Idade da versão publicada.")
+SESSAO_ATIVA_S = 300
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_exporter():
+    return start_exporter()
+
+@st.cache_resource(show_spinner=False)
+def get_session_tracker():
+    """Último rerun de cada sessão, para o medidor de sessões ativas."""
+    vistas = {}
+    lock = threading.Lock()
+
+    def ativas():
+        limite = time.time() - SESSAO_ATIVA_S
+        with lock:
+            for sid in [s for s, t in vistas.items() if t < limite]:
+                del vistas[sid]
+            return len(vistas)
+
+    SESSIONS_ACTIVE.set_function(ativas)
+    return vistas, lock
+
+metricas_destino = start_metrics_exporter()
+_sessoes, _sessoes_lock = get_session_tracker()
+_ctx = get_script_run_ctx()
+if _ctx is not None:
+    with _sessoes_lock:
+        _sessoes[_ctx.session_id] = time.time()
 
 # =============================
 # Estilos Modernizados
@@ -170,60 +240,255 @@ footer {visibility: hidden;}
 # =============================
 # Funções auxiliares
 # =============================
-def load_from_gsheet_csv(sheet_id: str, gid: str = "0", sep: str = ","):
-    url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={gid}"
-    try:
-        df = pd.read_csv(url, sep=sep)
-    except HTTPError as e:
-        st.error(f"Erro HTTP ao acessar o Google Sheets: {e}")
-        raise
-    except Exception as e:
-        st.error(f"Erro ao ler o CSV do Google Sheets: {e}")
-        raise
-    return df
+# O dataset publicado é compartilhado entre sessões: as seções trabalham com
+# posições (sel) e só materializam as colunas que realmente exibem.
+def rows_view(df: pd.DataFrame, sel: np.ndarray, cols=None) -> pd.DataFrame:
+    """Linhas nas posições sel, apenas com as colunas pedidas (as que existirem)."""
+    if cols is None:
+        cols = list(df.columns)
+    cols = [c for c in dict.fromkeys(cols) if c in df.columns]
+    if len(sel) == len(df):
+        return df[cols]
+    return df.iloc[sel, [df.columns.get_loc(c) for c in cols]]
+
+def col_values(df: pd.DataFrame, col: str, sel: np.ndarray) -> np.ndarray:
+    """Valores de uma coluna nas posições sel, como array (sem cópia do frame)."""
+    return df[col].to_numpy()[sel]
+
+def as_text(v, default: str = "") -> str:
+    """Texto da célula, tratando None/NaN/NA como ausente."""
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return default
+    return str(v)
+
+# =============================
+# Índice espacial e viewport do mapa
+# =============================
+MAPA_CENTRO_PADRAO = (-5.0, -39.5)
+MAPA_ZOOM_PADRAO = 8
+MAPA_ALTURA_PX = 500
+MAPA_LARGURA_PX_ESTIMADA = 800
+VIEWPORT_MARGEM = 0.25
 
-def gdrive_extract_id(url: str):
-    if not isinstance(url, str):
+def spatial_index(lat: np.ndarray, lon: np.ndarray):
+    """Índice espacial: posições com coordenada válida ordenadas por latitude.
+
+    A consulta por retângulo faz busca binária na latitude e só então testa a
+    longitude dos candidatos, sem percorrer a tabela inteira.
+    """
+    valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    order = valid[np.argsort(lat[valid], kind="stable")]
+    return order, lat[order]
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_spatial_index(version: str, _lat: np.ndarray, _lon: np.ndarray):
+    """spatial_index por versão dos dados."""
+    return spatial_index(_lat, _lon)
+
+def query_spatial_index(index, lon: np.ndarray, bounds: dict):
+    """Retorna as posições (no frame completo) dentro de bounds."""
+    order, lat_sorted = index
+    i0 = np.searchsorted(lat_sorted, bounds["south"], side="left")
+    i1 = np.searchsorted(lat_sorted, bounds["north"], side="right")
+    cand = order[i0:i1]
+    lon_cand = lon[cand]
+    return cand[(lon_cand >= bounds["west"]) & (lon_cand <= bounds["east"])]
+
+def bounds_from_st_folium(raw):
+    """Converte o dicionário de bounds do st_folium em south/west/north/east."""
+    if not raw:
         return None
-    url = url.strip()
-    m = re.search(r"/d/([a-zA-Z0-9_-]{10,})", url)
-    if m:
-        return m.group(1)
-    m = re.search(r"[?&]id=([a-zA-Z0-9_-]{10,})", url)
-    if m:
-        return m.group(1)
-    return None
-
-def drive_image_urls(file_id: str):
-    thumb = f"https://drive.google.com/thumbnail?id={file_id}&sz=w450"
-    big = f"https://drive.google.com/thumbnail?id={file_id}&sz=w2048"
-    return thumb, big
-
-def to_number(v):
-    if v is None or (isinstance(v, float) and math.isnan(v)):
-        return np.nan
-    s = str(v).strip()
-    if s == "":
-        return np.nan
-    if "," in s and s.count(",") == 1 and s.count(".") <= 1:
-        s = s.replace(".", "").replace(",", ".")
-    else:
-        s = s.replace(",", ".")
     try:
-        return float(s)
-    except Exception:
-        try:
-            return float(s.replace(" ", ""))
-        except Exception:
-            return np.nan
-
-def to_float(v):
-    if v is None:
+        sw = raw["_southWest"]
+        ne = raw["_northEast"]
+        b = {
+            "south": float(sw["lat"]),
+            "west": float(sw["lng"]),
+            "north": float(ne["lat"]),
+            "east": float(ne["lng"]),
+        }
+    except (KeyError, TypeError, ValueError):
         return None
-    try:
-        return float(str(v).replace(",", "."))
-    except Exception:
+    if not all(math.isfinite(v) for v in b.values()) or b["south"] >= b["north"]:
         return None
+    return b
+
+def approx_bounds(center, zoom: int, width_px: int = MAPA_LARGURA_PX_ESTIMADA,
+                  height_px: int = MAPA_ALTURA_PX):
+    """Estimativa dos bounds da janela antes do primeiro retorno do mapa."""
+    deg_por_px = 360.0 / (256 * 2 ** zoom)
+    dlat = height_px * deg_por_px / 2
+    dlon = width_px * deg_por_px / 2
+    return {
+        "south": center[0] - dlat,
+        "west": center[1] - dlon,
+        "north": center[0] + dlat,
+        "east": center[1] + dlon,
+    }
+
+def pad_bounds(bounds: dict, frac: float = VIEWPORT_MARGEM):
+    dlat = (bounds["north"] - bounds["south"]) * frac
+    dlon = (bounds["east"] - bounds["west"]) * frac
+    return {
+        "south": bounds["south"] - dlat,
+        "west": bounds["west"] - dlon,
+        "north": bounds["north"] + dlat,
+        "east": bounds["east"] + dlon,
+    }
+
+# Agrupamento hierárquico por zoom (grade em pixels Web Mercator: cada
+# célula de um nível contém exatamente 2x2 células do nível seguinte).
+CLUSTER_ZOOM_MIN = 4
+CLUSTER_ZOOM_MAX = 12
+CLUSTER_CELL_PX = 64
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_anomalies(version: str, dist_m: float, _df: pd.DataFrame) -> pd.DataFrame:
+    """Duplicidades e valores atípicos do dataset inteiro, por versão."""
+    return detect_anomalies(_df, dist_m)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_metric_scales(version: str, _df: pd.DataFrame) -> dict:
+    """Escalas típicas das métricas do ranking de divergências, por versão."""
+    return metric_scales(_df)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_hex_grid(version: str, _lat: np.ndarray, _lon: np.ndarray) -> dict:
+    """Hexágono de cada unidade em todas as resoluções, por versão."""
+    return build_hex_grid(_lat, _lon)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def cached_hex_summary(version: str, filtros: FilterState, resolucao: str, _grade: dict,
+                       _df: pd.DataFrame, _sel: np.ndarray, _sel_alerta: np.ndarray) -> pd.DataFrame:
+    """Estatísticas por hexágono de um filtro (as posições vêm do cache de filtros)."""
+    return aggregate_hex(_grade, resolucao, _df, _sel, _sel_alerta)
+
+def cluster_hierarchy(version: str, lat: np.ndarray, lon: np.ndarray,
+                      ocorr: pd.Series, viveiros: np.ndarray):
+    """Monta os agrupamentos de todos os níveis de zoom de uma versão dos dados.
+
+    Para cada nível guarda a célula de cada linha (-1 sem coordenada) e os
+    agregados do conjunto completo; trocar de zoom vira só uma consulta.
+    """
+    n = len(lat)
+    valid = np.isfinite(lat) & np.isfinite(lon)
+
+    cat = pd.Categorical(ocorr.where(ocorr.notna(), None).astype("object"))
+    categorias = [str(c) for c in cat.categories] + ["(sem ocorrência)"]
+    cat_code = cat.codes.astype(np.int64)
+    cat_code[cat_code < 0] = len(categorias) - 1
+
+    viv = np.nan_to_num(np.asarray(viveiros, dtype=float), nan=0.0)
+
+    x = (lon[valid] + 180.0) / 360.0
+    siny = np.clip(np.sin(np.radians(lat[valid])), -0.9999, 0.9999)
+    y = 0.5 - np.log((1 + siny) / (1 - siny)) / (4 * np.pi)
+
+    hier = {
+        "version": version,
+        "categorias": categorias,
+        "cat_code": cat_code,
+        "viveiros": viv,
+        "lat": lat,
+        "lon": lon,
+        "cell": {},
+        "ncells": {},
+        "full": {},
+    }
+    pos_validas = np.flatnonzero(valid)
+    for z in range(CLUSTER_ZOOM_MIN, CLUSTER_ZOOM_MAX + 1):
+        escala = (2 ** z) * 256 / CLUSTER_CELL_PX
+        kx = np.floor(x * escala).astype(np.int64)
+        ky = np.floor(y * escala).astype(np.int64)
+        _, inv = np.unique((kx << 32) | ky, return_inverse=True)
+        cell = np.full(n, -1, dtype=np.int64)
+        cell[pos_validas] = inv.ravel()
+        hier["cell"][z] = cell
+        hier["ncells"][z] = int(inv.max()) + 1 if len(inv) else 0
+        hier["full"][z] = _aggregate_cells(hier, z, pos_validas)
+    return hier
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_cluster_hierarchy(version: str, _lat: np.ndarray, _lon: np.ndarray,
+                            _ocorr: pd.Series, _viveiros: np.ndarray):
+    """cluster_hierarchy uma vez por versão dos dados."""
+    return cluster_hierarchy(version, _lat, _lon, _ocorr, _viveiros)
+
+def _aggregate_cells(hier, zoom: int, positions: np.ndarray):
+    """Agrega as linhas em positions nas células do nível zoom (só bincount)."""
+    ncells = hier["ncells"][zoom]
+    ncat = len(hier["categorias"])
+    inv = hier["cell"][zoom][positions]
+    ok = inv >= 0
+    inv, positions = inv[ok], positions[ok]
+
+    cont = np.bincount(inv, minlength=ncells)
+    keep = np.flatnonzero(cont)
+    cont_k = cont[keep]
+    por_cat = np.bincount(
+        inv * ncat + hier["cat_code"][positions], minlength=ncells * ncat
+    ).reshape(ncells, ncat)[keep]
+    unidade = np.full(ncells, -1, dtype=np.int64)
+    unidade[inv] = positions
+
+    return {
+        "lat": np.bincount(inv, weights=hier["lat"][positions], minlength=ncells)[keep] / cont_k,
+        "lon": np.bincount(inv, weights=hier["lon"][positions], minlength=ncells)[keep] / cont_k,
+        "count": cont_k,
+        "por_ocorrencia": por_cat,
+        "viveiros": np.bincount(inv, weights=hier["viveiros"][positions], minlength=ncells)[keep],
+        "unidade": unidade[keep],
+    }
+
+def cluster_level(hier, zoom: int, positions: np.ndarray = None):
+    """Agrupamentos do nível mais próximo de zoom para as posições filtradas.
+
+    Sem filtro (positions None) devolve o nível pré-calculado.
+    """
+    z = int(min(max(zoom, CLUSTER_ZOOM_MIN), CLUSTER_ZOOM_MAX))
+    if positions is None:
+        return hier["full"][z]
+    return _aggregate_cells(hier, z, np.asarray(positions, dtype=np.int64))
+
+def cluster_marker(lat, lon, count, por_ocorrencia, viveiros, categorias, cores):
+    """Marcador de agrupamento: tamanho pela contagem, cor pela ocorrência dominante."""
+    dominante = categorias[int(np.argmax(por_ocorrencia))]
+    cor = cores.get(dominante, "#1e3799")
+    size = int(28 + 8 * min(math.log10(max(count, 1)), 3))
+    linhas = [f"<b>{int(count)} unidades</b>"]
+    for nome, qtd in zip(categorias, por_ocorrencia):
+        if qtd:
+            linhas.append(f"{nome}: {int(qtd)}")
+    linhas.append(f"Atual Viveiros Total: {viveiros:,.0f}".replace(",", "."))
+    return folium.Marker(
+        location=[float(lat), float(lon)],
+        icon=folium.DivIcon(
+            icon_size=(size, size),
+            icon_anchor=(size // 2, size // 2),
+            html=(
+                f'<div style="width:{size}px;height:{size}px;border-radius:50%;'
+                f'background:{cor};opacity:0.85;color:white;font-weight:700;'
+                'font-size:12px;display:flex;align-items:center;justify-content:center;'
+                'border:2px solid white;box-shadow:0 2px 6px rgba(0,0,0,0.3);">'
+                f'{int(count)}</div>'
+            ),
+        ),
+        tooltip=folium.Tooltip("<br>".join(linhas)),
+    )
+
+def current_map_view(state_key: str):
+    """Último centro/zoom/bounds devolvidos pelo st_folium nesta sessão."""
+    state = st.session_state.get(state_key) or {}
+    zoom = state.get("zoom")
+    bounds = bounds_from_st_folium(state.get("bounds"))
+    if not isinstance(zoom, (int, float)) or bounds is None:
+        return None
+    center = state.get("center") or {}
+    try:
+        c = (float(center["lat"]), float(center["lng"]))
+    except (KeyError, TypeError, ValueError):
+        c = ((bounds["south"] + bounds["north"]) / 2, (bounds["west"] + bounds["east"]) / 2)
+    return {"center": c, "zoom": int(zoom), "bounds": bounds}
 
 # Galeria no modelo antigo, com auto_open
 def render_lightgallery_images(items: list, height_px=420, auto_open: bool = False):
@@ -295,25 +560,25 @@ def render_lightgallery_images(items: list, height_px=420, auto_open: bool = Fal
     """
     components.html(html, height=height_px, scrolling=True)
 
+POPUP_CAMPOS = [
+    ("CÓDIGO", "🔢"),
+    ("Nome", "👤"),
+    ("Ocorrências", "⚠️"),
+    ("Nº Viveiros total", "🐟"),
+    ("Atual Viveiros Total", "✅"),
+    ("Nº Viveiros cheio", "💧"),
+    ("Atual Viveiros cheio", "💧"),
+    ("Área (ha).1", "📐"),
+    ("Atual Área (ha).1", "📐"),
+    ("Prof. Média  (m)", "📏"),
+    ("Atual Profun.", "📏"),
+]
+
 def make_popup_html(row):
-    safe = lambda v: "-" if v in [None, "", np.nan] else str(v)
-
-    campos = [
-        ("CÓDIGO", "🔢"),
-        ("Nome", "👤"),
-        ("Ocorrências", "⚠️"),
-        ("Nº Viveiros total", "🐟"),
-        ("Atual Viveiros Total", "✅"),
-        ("Nº Viveiros cheio", "💧"),
-        ("Atual Viveiros cheio", "💧"),
-        ("Área (ha).1", "📐"),
-        ("Atual Área (ha).1", "📐"),
-        ("Prof. Média  (m)", "📏"),
-        ("Atual Profun.", "📏"),
-    ]
+    safe = lambda v: as_text(v) or "-"
 
     linhas = []
-    for col, icon in campos:
+    for col, icon in POPUP_CAMPOS:
         if col not in row:
             continue
         val = row[col]
@@ -357,6 +622,369 @@ def make_popup_html(row):
     """
     return html
 
+# =============================
+# Montagem do mapa
+# =============================
+class MapSources:
+    """Entradas do mapa calculadas sobre a versão inteira dos dados.
+
+    Na sessão vêm dos st.cache_data (compartilhados entre as sessões). As
+    threads de fundo não têm ScriptRunContext: com streamlit=False as funções
+    puras são chamadas direto e o resultado fica guardado no objeto, que vale
+    por uma rodada de pré-renderização.
+    """
+
+    def __init__(self, df: pd.DataFrame, version: str, streamlit: bool = True):
+        self.df = df
+        self.version = version
+        self.streamlit = streamlit
+        self._guardado = {}
+
+    def _memo(self, chave, calcular):
+        if chave not in self._guardado:
+            self._guardado[chave] = calcular()
+        return self._guardado[chave]
+
+    def _coords(self):
+        return (
+            self.df["_lat_wgs84"].to_numpy(dtype=float),
+            self.df["_lon_wgs84"].to_numpy(dtype=float),
+        )
+
+    def metric_scales(self) -> dict:
+        if self.streamlit:
+            return cached_metric_scales(self.version, self.df)
+        return self._memo("escalas", lambda: metric_scales(self.df))
+
+    def anomalies(self, dist_m: float) -> pd.DataFrame:
+        if self.streamlit:
+            return cached_anomalies(self.version, float(dist_m), self.df)
+        return self._memo(("anomalias", float(dist_m)), lambda: detect_anomalies(self.df, float(dist_m)))
+
+    def hex_grid(self) -> dict:
+        if self.streamlit:
+            return cached_hex_grid(self.version, *self._coords())
+        return self._memo("hex", lambda: build_hex_grid(*self._coords()))
+
+    def hex_summary(self, filtros: FilterState, resolucao: str, grade: dict,
+                    sel: np.ndarray, sel_alerta: np.ndarray) -> pd.DataFrame:
+        if self.streamlit:
+            return cached_hex_summary(self.version, filtros, resolucao, grade, self.df, sel, sel_alerta)
+        return aggregate_hex(grade, resolucao, self.df, sel, sel_alerta)
+
+    def spatial_index(self):
+        if self.streamlit:
+            return build_spatial_index(self.version, *self._coords())
+        return self._memo("indice", lambda: spatial_index(*self._coords()))
+
+    def cluster_hierarchy(self):
+        df = self.df
+        args = (
+            *self._coords(),
+            df["Ocorrências"] if "Ocorrências" in df.columns else pd.Series([None] * len(df)),
+            pd.to_numeric(df["Atual Viveiros Total"], errors="coerce").to_numpy(dtype=float)
+            if "Atual Viveiros Total" in df.columns else np.zeros(len(df)),
+        )
+        if self.streamlit:
+            return build_cluster_hierarchy(self.version, *args)
+        return self._memo("agrupamentos", lambda: cluster_hierarchy(self.version, *args))
+
+def visible_anomalies(fontes: MapSources, sel: np.ndarray, dist_m: float) -> pd.DataFrame:
+    """Anomalias da versão que envolvem alguma unidade de sel.
+
+    São calculadas uma vez por versão sobre o dataset inteiro; aqui só se
+    escolhe o que aparece com o filtro atual.
+    """
+    df = fontes.df
+    anomalias = fontes.anomalies(dist_m)
+    if len(anomalias):
+        na_sel = np.zeros(len(df), dtype=bool)
+        na_sel[sel] = True
+        pos_rel = anomalias["_pos_rel"].to_numpy()
+        anomalias = anomalias[
+            na_sel[anomalias["_pos"].to_numpy()] | ((pos_rel >= 0) & na_sel[np.maximum(pos_rel, 0)])
+        ]
+    return anomalias
+
+def map_hex_summary(fontes: MapSources, filtros: FilterState, sel: np.ndarray,
+                    sel_alerta: np.ndarray, resolucao: str):
+    """Grade da versão e resumo por hexágono do filtro (None sem coordenadas)."""
+    if "_lat_wgs84" not in fontes.df.columns or "_lon_wgs84" not in fontes.df.columns:
+        return None, None
+    grade = fontes.hex_grid()
+    return grade, fontes.hex_summary(filtros, resolucao, grade, sel, sel_alerta)
+
+def build_unit_map(fontes: MapSources, filtros: FilterState, sel: np.ndarray,
+                   sel_alerta: np.ndarray, opcoes: MapOptions, view=None):
+    """Monta o mapa folium das unidades de sel.
+
+    Não desenha nada na tela e só usa o Streamlit pelos caches de fontes: com
+    MapSources(streamlit=False) roda na thread que pré-renderiza os mapas
+    (view None = centro e zoom padrão). Devolve o mapa e um dicionário com o
+    resumo dos agrupamentos, as anomalias exibidas e o resumo por hexágono.
+    """
+    df = fontes.df
+    acompanha_view = opcoes.modo_viewport or opcoes.agrupar_zoom
+    info = {"agrupamentos": None, "anomalias": None, "hex_resumo": None}
+
+    fmap = folium.Map(
+        location=list(view["center"]) if view else list(MAPA_CENTRO_PADRAO),
+        zoom_start=view["zoom"] if view else MAPA_ZOOM_PADRAO,
+        control_scale=True,
+        tiles=None
+    )
+
+    folium.TileLayer("CartoDB Positron", name="CartoDB Positron").add_to(fmap)
+    folium.TileLayer("OpenStreetMap", name="OpenStreetMap").add_to(fmap)
+    folium.TileLayer(
+        tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        name="Imagem de Satélite",
+        attr="Tiles © Esri"
+    ).add_to(fmap)
+
+    fg_pontos = folium.FeatureGroup(name="Unidades de Viveiros", show=True)
+    pts = []
+
+    lat_col = "_lat_wgs84" if "_lat_wgs84" in df.columns else None
+    lon_col = "_lon_wgs84" if "_lon_wgs84" in df.columns else None
+
+    ocorr_vals = sorted(
+        {as_text(o) for o in pd.unique(col_values(df, "Ocorrências", sel))} - {""}
+    ) if "Ocorrências" in df.columns else []
+    palette = [
+        "#0984e3", "#00b894", "#e17055", "#6c5ce7",
+        "#d63031", "#fdcb6e", "#2d3436", "#ff7675",
+        "#00cec9", "#6c5ce7"
+    ]
+    ocorr_colors = {o: palette[i % len(palette)] for i, o in enumerate(ocorr_vals)}
+
+    # Modo viewport: só as unidades dentro da janela (com margem) viram
+    # marcadores; o restante é resumido em agrupamentos no servidor.
+    # Com agrupamento por zoom, em zoom afastado todas as unidades filtradas
+    # são desenhadas pelo nível pré-calculado da hierarquia.
+    sel_mapa = sel
+    if acompanha_view and lat_col and lon_col:
+        lat_all = df[lat_col].to_numpy(dtype=float)
+        lon_all = df[lon_col].to_numpy(dtype=float)
+
+        view_zoom = view["zoom"] if view else MAPA_ZOOM_PADRAO
+        view_bounds = view["bounds"] if view else approx_bounds(MAPA_CENTRO_PADRAO, view_zoom)
+
+        pos_filtrado = sel
+        dentro = np.ones(len(pos_filtrado), dtype=bool)
+        if opcoes.modo_viewport:
+            no_viewport = np.zeros(len(df), dtype=bool)
+            no_viewport[query_spatial_index(fontes.spatial_index(), lon_all, pad_bounds(view_bounds))] = True
+            dentro = no_viewport[pos_filtrado]
+
+        hier = fontes.cluster_hierarchy()
+
+        agrupar = opcoes.agrupar_zoom and view_zoom <= CLUSTER_ZOOM_MAX
+        pos_cluster = pos_filtrado if agrupar else pos_filtrado[~dentro]
+        clusters = cluster_level(
+            hier, view_zoom, None if len(pos_cluster) == len(df) else pos_cluster
+        )
+
+        desenhar = np.ones(len(clusters["count"]), dtype=bool)
+        if agrupar:
+            # agrupamentos de uma unidade só, dentro da janela, viram marcador normal
+            sozinho = clusters["count"] == 1
+            detalhe = dentro & np.isin(pos_filtrado, clusters["unidade"][sozinho])
+            desenhar = ~(sozinho & np.isin(clusters["unidade"], pos_filtrado[detalhe]))
+        else:
+            detalhe = dentro
+        sel_mapa = sel[detalhe]
+
+        if desenhar.any():
+            fg_clusters = folium.FeatureGroup(name="Agrupamentos de unidades", show=True)
+            for i in np.flatnonzero(desenhar):
+                cluster_marker(
+                    clusters["lat"][i],
+                    clusters["lon"][i],
+                    clusters["count"][i],
+                    clusters["por_ocorrencia"][i],
+                    clusters["viveiros"][i],
+                    hier["categorias"],
+                    ocorr_colors,
+                ).add_to(fg_clusters)
+            fg_clusters.add_to(fmap)
+
+        info["agrupamentos"] = (
+            f"🫧 {len(sel_mapa)} unidades individuais • "
+            f"{int(clusters['count'][desenhar].sum())} em {int(desenhar.sum())} agrupamentos "
+            f"(zoom {view_zoom})"
+        )
+
+    cols_mapa = [lat_col, lon_col, "Nome", "CÓDIGO", "Ocorrências"] + [c for c, _ in POPUP_CAMPOS]
+    for _, row in rows_view(df, sel_mapa, cols_mapa).iterrows():
+        if not lat_col or not lon_col:
+            continue
+
+        lat = row.get(lat_col)
+        lon = row.get(lon_col)
+        if math.isnan(lat) or math.isnan(lon):
+            continue
+
+        ocorr = as_text(row.get("Ocorrências"))
+        color = ocorr_colors.get(ocorr, "#0984e3")
+
+        popup_html = make_popup_html(row)
+        popup = folium.Popup(popup_html, max_width=380)
+
+        tooltip_text = as_text(row.get("Nome"), "Unidade")
+        cod = as_text(row.get("CÓDIGO"))
+        if cod:
+            tooltip_text = f"{cod} • {tooltip_text}"
+        if ocorr:
+            tooltip_text += f" • {ocorr}"
+
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=8,
+            color=color,
+            fill=True,
+            fill_color=color,
+            fill_opacity=0.9,
+            popup=popup,
+            tooltip=tooltip_text,
+            weight=2
+        ).add_to(fg_pontos)
+
+        pts.append((lat, lon))
+
+    fg_pontos.add_to(fmap)
+
+    anomalias = visible_anomalies(fontes, sel, opcoes.dist_anomalia)
+    info["anomalias"] = anomalias
+    if len(anomalias) and lat_col and lon_col:
+        fg_anom = folium.FeatureGroup(name="Anomalias (duplicidades e atípicos)", show=True)
+        lat_all = df[lat_col].to_numpy(dtype=float)
+        lon_all = df[lon_col].to_numpy(dtype=float)
+        for p, q, tipo, cod, rel, dist, campo, valor, detalhe in zip(
+            anomalias["_pos"], anomalias["_pos_rel"], anomalias["Tipo"],
+            anomalias["CÓDIGO"], anomalias["Relacionado"], anomalias["Distância (m)"],
+            anomalias["Campo"], anomalias["Valor"], anomalias["Detalhe"],
+        ):
+            if not (np.isfinite(lat_all[p]) and np.isfinite(lon_all[p])):
+                continue
+            tooltip_anom = f"{tipo}: {as_text(cod)}"
+            if tipo == TIPO_ATIPICO:
+                tooltip_anom += f" • {campo} = {valor:.2f} ({detalhe})"
+            else:
+                tooltip_anom += f" ↔ {as_text(rel)} ({dist:.1f} m)"
+                folium.PolyLine(
+                    [[lat_all[p], lon_all[p]], [lat_all[q], lon_all[q]]],
+                    color="#d63031",
+                    weight=3,
+                    dash_array="4 4",
+                    tooltip=tooltip_anom,
+                ).add_to(fg_anom)
+            folium.CircleMarker(
+                location=[lat_all[p], lon_all[p]],
+                radius=12,
+                color="#d63031" if tipo != TIPO_ATIPICO else "#e17055",
+                fill=False,
+                weight=3,
+                tooltip=tooltip_anom,
+            ).add_to(fg_anom)
+        fg_anom.add_to(fmap)
+
+    # Visão regional: hexágonos com contagem, totais e taxa de divergência
+    hex_grade, hex_resumo = map_hex_summary(fontes, filtros, sel, sel_alerta, opcoes.hex_resolucao)
+    info["hex_resumo"] = hex_resumo
+    if hex_resumo is not None and len(hex_resumo):
+        hex_geo, hex_limites, hex_cores = hex_geojson(
+            hex_resumo, hex_grade, opcoes.hex_resolucao, opcoes.hex_metrica
+        )
+        fg_hex = folium.FeatureGroup(name=f"Hexágonos — {opcoes.hex_metrica}", show=False)
+        folium.GeoJson(
+            hex_geo,
+            style_function=lambda f: {
+                "fillColor": f["properties"]["_cor"],
+                "color": "#3c6382",
+                "weight": 1,
+                "fillOpacity": 0.65,
+            },
+            tooltip=folium.GeoJsonTooltip(
+                fields=["Unidades", "Viveiros (atual)", "Área (ha) atual",
+                        "Divergentes", "Taxa de divergência"],
+            ),
+        ).add_to(fg_hex)
+        fg_hex.add_to(fmap)
+        StepColormap(
+            hex_cores,
+            index=list(hex_limites),
+            vmin=float(hex_limites[0]),
+            vmax=float(hex_limites[-1]),
+            caption=f"Hexágonos — {opcoes.hex_metrica}",
+        ).add_to(fmap)
+
+    if pts and not acompanha_view:
+        fmap.fit_bounds([
+            [min(p[0] for p in pts), min(p[1] for p in pts)],
+            [max(p[0] for p in pts), max(p[1] for p in pts)],
+        ])
+
+    if ocorr_colors:
+        legend_items_html = ""
+        for o, color in ocorr_colors.items():
+            legend_items_html += f"""
+            <div style="display:flex;align-items:center;margin-bottom:4px;">
+              <span style="display:inline-block;width:14px;height:14px;border-radius:50%;background:{color};margin-right:6px;border:2px solid white;box-shadow:0 1px 3px rgba(0,0,0,0.3);"></span>{o}
+            </div>
+            """
+    else:
+        legend_items_html = """
+        <div style="display:flex;align-items:center;margin-bottom:4px;">
+          <span style="display:inline-block;width:14px;height:14px;border-radius:50%;background:#0984e3;margin-right:6px;border:2px solid white;box-shadow:0 1px 3px rgba(0,0,0,0.3);"></span>Unidade cadastrada
+        </div>
+        """
+
+    legend_html = """
+    {% macro html(this, kwargs) %}
+    <div id="legend-viveiros" style="
+        position: fixed;
+        bottom: 40px;
+        left: 10px;
+        z-index: 9999;
+        background: rgba(255,255,255,0.95);
+        padding: 12px 16px;
+        border: 1px solid #ddd;
+        border-radius: 16px;
+        font-size: 12px;
+        box-shadow: 0 4px 20px rgba(0,0,0,0.15);
+        backdrop-filter: blur(10px);
+        font-family: 'Segoe UI', system-ui, sans-serif;
+    ">
+      <div id="legend-viveiros-header" style="font-weight:700; margin-bottom:6px; color:#2d3436; font-size:13px; cursor:pointer;"
+           onclick="
+             var body = document.getElementById('legend-viveiros-body');
+             if (body.style.display === 'none') {
+                 body.style.display = 'block';
+                 this.innerHTML = 'Ocorrências ▾';
+             } else {
+                 body.style.display = 'none';
+                 this.innerHTML = 'Ocorrências ▸';
+             }
+           ">
+        Ocorrências ▾
+      </div>
+      <div id="legend-viveiros-body" style="margin-top:4px;">
+    """ + legend_items_html + """
+        <div style="font-size:11px;color:#636e72;margin-top:4px;">
+          Cores por categoria de ocorrência.
+        </div>
+      </div>
+    </div>
+    {% endmacro %}
+    """
+    legend = MacroElement()
+    legend._template = Template(legend_html)
+    fmap.get_root().add_child(legend)
+
+    LayerControl(collapsed=True).add_to(fmap)
+    return fmap, info
+
 # =============================
 # Header Modernizado
 # =============================
@@ -368,117 +996,275 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # =============================
-# Barra de status e informações
+# Carrega dados (versão publicada pelo worker em segundo plano)
 # =============================
-col_info1, col_info2, col_info3 = st.columns([2,1,1])
+FILTRO_CACHE_MB = float(os.environ.get("VIVEIROS_FILTRO_CACHE_MB", "64"))
 
-with col_info1:
-    st.caption(
-        f"🕐 Última atualização: {datetime.now(TZ).strftime('%d/%m/%Y %H:%M')} "
-        f"(Horário de Fortaleza)"
+@st.cache_resource(show_spinner=False)
+def get_filter_cache():
+    return FilterResultCache(max_bytes=int(FILTRO_CACHE_MB * 1024**2))
+
+REFRESH_INTERVAL_S = float(os.environ.get("VIVEIROS_REFRESH_S", "300"))
+# linhas por bloco na ingestão em blocos (0 = lê a planilha inteira de uma vez)
+CHUNK_ROWS = int(os.environ.get("VIVEIROS_CHUNK_ROWS", "0"))
+
+FOTOS_TTL_S = float(os.environ.get("VIVEIROS_FOTOS_TTL_S", str(6 * 3600)))
+
+# mapas pré-renderizados em disco (0 desliga)
+MAPA_CACHE_MB = float(os.environ.get("VIVEIROS_MAPA_CACHE_MB", "256"))
+# filtros mais usados renderizados a cada versão nova, além do padrão
+MAPA_PRERENDER = int(os.environ.get("VIVEIROS_MAPA_PRERENDER", "3"))
+
+@st.cache_resource(show_spinner=False)
+def get_map_artifact_cache():
+    if MAPA_CACHE_MB <= 0:
+        return None
+    return MapArtifactCache(MAPA_CACHE_DIR, max_bytes=int(MAPA_CACHE_MB * 1024**2))
+
+def render_map_artifact(fontes: MapSources, filtros_cache: FilterResultCache,
+                        filtros: FilterState, opcoes: MapOptions) -> str:
+    """HTML completo do mapa de um filtro, na vista inicial."""
+    resultado = filtros_cache.get_or_compute(fontes.version, filtros, fontes.df, fontes.metric_scales())
+    fmap, _ = build_unit_map(fontes, filtros, resultado.sel, resultado.sel_alerta, opcoes)
+    html = fmap.get_root().render()
+    # o tamanho é medido aqui, no HTML que já vai para o disco
+    MAP_PAYLOAD_BYTES.observe(len(html.encode("utf-8")))
+    return html
+
+def prerender_maps(mapas: MapArtifactCache, filtros_cache: FilterResultCache, versao, estados):
+    """Renderiza em disco, numa thread à parte, os mapas que faltam da versão.
+
+    Os caches são recebidos prontos: a thread (e a do DatasetStore, que chama
+    esta função a cada versão nova) não tem ScriptRunContext.
+    """
+    fontes = MapSources(versao.df, versao.version, streamlit=False)
+    mapas.build_async(versao.version, estados, partial(render_map_artifact, fontes, filtros_cache))
+
+def default_map_states(mapas: MapArtifactCache, df: pd.DataFrame) -> list:
+    """Filtro inicial da tela (todas as ocorrências marcadas) e os mais usados."""
+    ocorrencias = df["Ocorrências"].dropna().unique() if "Ocorrências" in df.columns else None
+    padrao = (FilterState.normalized(ocorrencias=ocorrencias), MapOptions())
+    return [padrao] + mapas.most_used(MAPA_PRERENDER)
+
+@st.cache_resource(show_spinner=False)
+def get_chart_cache():
+    return ChartSpecCache()
+
+@st.cache_resource(show_spinner=False)
+def get_photo_cache():
+    return PhotoStatusCache(ttl_s=FOTOS_TTL_S)
+
+def start_photo_validation(df: pd.DataFrame, cache: PhotoStatusCache):
+    """Valida os links de foto da versão em uma thread à parte."""
+    threading.Thread(
+        target=validate_links_sync,
+        args=(photo_file_ids(df), cache),
+        name="viveiros-fotos",
+        daemon=True,
+    ).start()
+
+@st.cache_resource(show_spinner=False)
+def get_data_source():
+    # escolhida por VIVEIROS_FONTE (Google Sheets, CSV, Parquet ou SQLite)
+    return source_from_config()
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_store():
+    fonte = get_data_source()
+    if CHUNK_ROWS > 0:
+        # ingestão em blocos: pico de memória limitado pelo tamanho do bloco
+        store = DatasetStore(
+            lambda: fonte.iter_chunks(columns=SOURCE_COLUMNS, chunk_rows=CHUNK_ROWS),
+            interval_s=REFRESH_INTERVAL_S,
+            chunked=True,
+        )
+    else:
+        store = DatasetStore(
+            lambda: fonte.load(columns=SOURCE_COLUMNS),
+            interval_s=REFRESH_INTERVAL_S,
+        )
+    # cada versão nova também vai para o histórico em Parquet
+    store.subscribe(lambda v: write_snapshot(v.df, v.version, v.fetched_at))
+    # e tem os links de foto verificados sem bloquear a atualização
+    fotos = get_photo_cache()
+    store.subscribe(lambda v: start_photo_validation(v.df, fotos))
+    # e os mapas da vista inicial renderizados em disco
+    mapas = get_map_artifact_cache()
+    if mapas is not None:
+        filtros_cache = get_filter_cache()
+        store.subscribe(lambda v: prerender_maps(mapas, filtros_cache, v, default_map_states(mapas, v.df)))
+    store.start()
+    DATASET_AGE.set_function(
+        lambda: (datetime.now(TZ) - store.current().fetched_at).total_seconds()
+        if store.current() is not None else float("nan")
     )
+    return store
 
-with col_info2:
-    st.caption("📊 Dados sincronizados via Google Sheets")
+# As consultas ao histórico são refeitas só quando surge um snapshot novo
+@st.cache_data(show_spinner=False, max_entries=4)
+def cached_divergence_over_time(ultimo_snapshot: str):
+    return divergence_over_time()
 
-with col_info3:
-    if st.button("🔄 Atualizar Dados"):
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_read_as_of(dia, columns: tuple, ultimo_snapshot: str):
+    return read_as_of(dia, list(columns))
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_unit_history(codigo: str, columns: tuple, ultimo_snapshot: str):
+    try:
+        return unit_history(codigo, list(columns))
+    except pa.ArrowException:
+        # snapshots com esquemas incompatíveis: o detalhe sai sem o histórico
+        return pd.DataFrame(columns=["_fetched_at", "_version", *columns])
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_unit_index(version: str, _df: pd.DataFrame) -> UnitIndex:
+    """CÓDIGO → posições e arquivo do Drive → unidades, por versão."""
+    return UnitIndex.build(_df)
+
+def unit_link(codigo) -> str:
+    """Link relativo que abre o detalhe da unidade (?unidade=CÓDIGO)."""
+    return f"?unidade={quote(code_text(codigo))}"
+
+HISTORICO_COLS = [
+    "Atual Viveiros Total", "Atual Viveiros cheio", "Atual Área (ha).1",
+    "Atual Profun.", "Ocorrências", "Tipo Divergência",
+]
+
+def render_unit_detail(df: pd.DataFrame, version: str, codigo: str, index: UnitIndex):
+    """Detalhe de uma unidade: dados do popup, divergência, fotos e histórico."""
+    posicoes = index.positions(codigo)
+    if len(posicoes):
+        codigo = code_text(df["CÓDIGO"].iloc[int(posicoes[0])]) or codigo
+    st.markdown(f"### 🔎 Unidade {codigo}")
+    if st.button("✖ Fechar detalhe da unidade"):
+        del st.query_params["unidade"]
         st.rerun()
 
-# =============================
-# Carrega dados
-# =============================
-SHEET_ID = "1pMMSJUPCpWmG2weFcEhI5T0hQNY5VVDNjjUxB5i0GoI"
-GID = "2073960790"
-SEP = ","
+    if not len(posicoes):
+        st.warning(f"Unidade {codigo} não encontrada na versão {version} da planilha.")
+        return
+    p = int(posicoes[0])
+    if len(posicoes) > 1:
+        st.caption(f"⚠️ {len(posicoes)} linhas da planilha têm este código; exibindo a primeira.")
+    st.caption(f"🔗 Link desta unidade: `{unit_link(codigo)}`")
+
+    col_d1, col_d2 = st.columns([1, 1.2])
+    with col_d1:
+        st.markdown(make_popup_html(df.iloc[p]), unsafe_allow_html=True)
+
+    with col_d2:
+        tipo = as_text(df["Tipo Divergência"].iloc[p]) if "Tipo Divergência" in df.columns else ""
+        # sem divergência o tipo vem "Zero" do prepare_dataset: decide _divergente
+        divergente = "_divergente" in df.columns and bool(df["_divergente"].iloc[p])
+        escalas = cached_metric_scales(version, df)
+        if divergente:
+            pontuacao = float(divergence_scores(df, np.array([p]), escalas)[0])
+            st.markdown(f"**Divergência:** {tipo} • pontuação {pontuacao:.3f}")
+        else:
+            st.markdown("**Divergência:** nenhuma")
+        detalhe_df = score_breakdown(df, p, escalas)
+        if not detalhe_df.empty:
+            detalhe_df["Métrica"] = detalhe_df["Métrica"].map(DELTA_LABELS)
+            st.dataframe(
+                detalhe_df[["Métrica", "Original", "Atual", "Δ", "Contribuição"]],
+                use_container_width=True,
+                hide_index=True,
+            )
 
-try:
-    df = load_from_gsheet_csv(SHEET_ID, GID, sep=SEP)
-except Exception:
-    st.error("❌ Erro ao carregar dados da planilha. Verifique a conexão.")
-    st.stop()
+        link = photo_links(df, [p])[0]
+        fid = photo_ids(df, [p])[0]
+        if fid:
+            thumb, big = drive_image_urls(fid)
+            render_lightgallery_images(
+                [{"thumb": thumb, "src": big, "caption": codigo}],
+                height_px=260,
+            )
+            situacao = get_photo_cache().get(fid)
+            if situacao:
+                st.caption(f"📷 Situação da foto: {situacao}")
+            outras = index.units_for_file(fid)
+            outras = outras[outras != p]
+            if len(outras):
+                st.caption(
+                    "📷 A mesma foto aparece em: "
+                    + ", ".join(f"[{code_text(c)}]({unit_link(c)})" for c in df["CÓDIGO"].to_numpy()[outras][:10])
+                )
+        elif isinstance(link, str) and link.strip():
+            render_lightgallery_images([{"thumb": link, "src": link, "caption": codigo}], height_px=260)
+        else:
+            st.info("📷 Unidade sem link de foto.")
+
+    snapshots_disponiveis = list_snapshots()
+    if snapshots_disponiveis:
+        cols_hist = tuple(c for c in HISTORICO_COLS if c in df.columns)
+        historico = cached_unit_history(codigo, cols_hist, str(snapshots_disponiveis[-1]))
+        if len(historico) > 1:
+            st.markdown("**Valores nas versões anteriores**")
+            st.dataframe(
+                historico.rename(columns={"_fetched_at": "Obtida em", "_version": "Versão"}),
+                use_container_width=True,
+                hide_index=True,
+                height=200,
+            )
+    st.markdown("---")
 
-if df.empty:
-    st.info("📋 Planilha sem dados disponíveis.")
-    st.stop()
+store = get_dataset_store()
+
+if store.current() is None:
+    # primeira sessão do processo: não há versão publicada ainda
+    try:
+        with st.spinner("Carregando dados da planilha..."):
+            store.ensure_loaded()
+    except HTTPError as e:
+        st.error(f"Erro HTTP ao acessar {get_data_source().describe()}: {e}")
+    except Exception as e:
+        st.error(f"Erro ao ler os dados de {get_data_source().describe()}: {e}")
 
-# Substitui NaN por None
-df = df.replace({np.nan: None})
+dataset = store.current()
+if dataset is None:
+    st.error("❌ Erro ao carregar dados da planilha. Verifique a conexão.")
+    st.stop()
 
 # =============================
-# Tratamento global de números vindos do CSV
+# Barra de status e informações
 # =============================
-numeric_cols_csv = [
-    "Nº Viveiros total",
-    "Atual Viveiros Total",
-    "Nº Viveiros cheio",
-    "Atual Viveiros cheio",
-    "Área (ha).1",
-    "Atual Área (ha).1",
-    "Prof. Média  (m)",
-    "Atual Profun.",
-    "Lati",
-    "Long",
-]
+col_info1, col_info2, col_info3 = st.columns([2,1,1])
 
-for col in numeric_cols_csv:
-    if col in df.columns:
-        df[col] = df[col].apply(to_number)
+with col_info1:
+    verificado = store.checked_at or dataset.fetched_at
+    idade_min = int((datetime.now(TZ) - verificado).total_seconds() // 60)
+    st.caption(
+        f"🕐 Dados da planilha de {verificado.strftime('%d/%m/%Y %H:%M')} "
+        f"(há {idade_min} min, Horário de Fortaleza) • versão {dataset.version}"
+    )
 
-# =============================
-# Preparação de datas para filtros
-# =============================
+with col_info2:
+    st.caption(f"📊 Dados sincronizados via {get_data_source().describe()}")
 
-def parse_data_filtro(v):
-    """Converte string tipo 2025/11/04 11:22:03.951+00 em datetime no fuso de Fortaleza."""
-    if v is None or (isinstance(v, float) and math.isnan(v)):
-        return pd.NaT
-    s = str(v).strip()
-    if s == "" or s.lower() in ("nan", "nat", "none"):
-        return pd.NaT
+with col_info3:
+    if st.button("🔄 Atualizar Dados"):
+        with st.spinner("Atualizando dados..."):
+            store.request_refresh()
+        st.rerun()
 
-    # normaliza separador
-    s = s.replace("/", "-")
+if store.last_error is not None:
+    st.warning(
+        f"⚠️ A última atualização falhou ({store.last_error}). "
+        "Exibindo a versão anterior dos dados."
+    )
 
-    # garante timezone no formato +HH:MM (se vier só +00, vira +00:00)
-    m = re.search(r"\+\d{2}(:\d{2})?$", s)
-    if m:
-        tz_part = m.group(0)
-        if ":" not in tz_part:
-            s = s.replace(tz_part, tz_part + ":00")
+df = dataset.df
+dataset_version = dataset.version
 
-    try:
-        dt = datetime.strptime(s, "%Y-%m-%d %H:%M:%S.%f%z")
-        return dt.astimezone(TZ)
-    except Exception:
-        pass
+if df.empty:
+    st.info("📋 Planilha sem dados disponíveis.")
+    st.stop()
 
-    try:
-        dt = pd.to_datetime(s, errors="coerce", utc=True)
-        if pd.isna(dt):
-            return pd.NaT
-        if dt.tzinfo is None:
-            dt = dt.tz_localize("UTC")
-        return dt.tz_convert(TZ)
-    except Exception:
-        return pd.NaT
-
-# Usa diretamente a coluna "Data"
-if "Data" in df.columns:
-    df["_Data_dt"] = df["Data"].apply(parse_data_filtro)
-    df["Ano_filtro"] = df["_Data_dt"].dt.year
-    df["Mes_filtro_num"] = df["_Data_dt"].dt.month
-
-    meses_map = {
-        1: "Jan", 2: "Fev", 3: "Mar", 4: "Abr",
-        5: "Mai", 6: "Jun", 7: "Jul", 8: "Ago",
-        9: "Set", 10: "Out", 11: "Nov", 12: "Dez",
-    }
-    df["Mes_filtro"] = df["Mes_filtro_num"].map(meses_map)
-else:
-    df["_Data_dt"] = pd.NaT
-    df["Ano_filtro"] = None
-    df["Mes_filtro"] = None
+# Detalhe de uma unidade por link compartilhado (?unidade=CÓDIGO)
+unidade_url = st.query_params.get("unidade")
+if unidade_url:
+    render_unit_detail(df, dataset_version, unidade_url, get_unit_index(dataset_version, df))
 
 
 # =============================
@@ -501,18 +1287,23 @@ if "Mes_filtro" in df.columns:
 
 ocorr_opts = sorted([o for o in df.get("Ocorrências", pd.Series()).dropna().unique().tolist()])
 
+# Filtros vindos da URL valem como ponto de partida da sessão
+if "_filtros_url" not in st.session_state:
+    st.session_state["_filtros_url"] = FilterState.from_query_params(st.query_params)
+filtros_url = st.session_state["_filtros_url"]
+
 with st.expander("Filtros avançados", expanded=True):
     col_f1, col_f2, col_f3 = st.columns([1.2, 1.2, 1.6])
 
     # Ano (Data Filtro) – com botão para ativar
     with col_f1:
         if anos_lista:
-            use_filter_ano = st.toggle("📅 Filtrar Ano", value=False)
+            use_filter_ano = st.toggle("📅 Filtrar Ano", value=bool(filtros_url.anos))
             if use_filter_ano:
                 ano_sel = st.multiselect(
                     "Ano (Data Filtro)",
                     options=anos_lista,
-                    default=anos_lista
+                    default=[a for a in anos_lista if a in filtros_url.anos] or anos_lista
                 )
             else:
                 ano_sel = []
@@ -523,12 +1314,12 @@ with st.expander("Filtros avançados", expanded=True):
     # Mês (Data Filtro) – com botão para ativar
     with col_f2:
         if meses_lista:
-            use_filter_mes = st.toggle("🗓️ Filtrar Mês", value=False)
+            use_filter_mes = st.toggle("🗓️ Filtrar Mês", value=bool(filtros_url.meses))
             if use_filter_mes:
                 mes_sel = st.multiselect(
                     "Mês (Data Filtro)",
                     options=meses_lista,
-                    default=meses_lista
+                    default=[m for m in meses_lista if m in filtros_url.meses] or meses_lista
                 )
             else:
                 mes_sel = []
@@ -540,6 +1331,7 @@ with st.expander("Filtros avançados", expanded=True):
     with col_f3:
         search_text = st.text_input(
             "🔎 Buscar por CÓDIGO ou Nome",
+            value=filtros_url.busca,
             placeholder="Digite parte do código ou do nome"
         )
 
@@ -549,91 +1341,80 @@ with st.expander("Filtros avançados", expanded=True):
         ocorr_sel = st.multiselect(
             "⚠️ Filtrar Ocorrências",
             options=ocorr_opts,
-            default=ocorr_opts if ocorr_opts else None
+            default=[o for o in ocorr_opts if o in filtros_url.ocorrencias] or ocorr_opts or None
         )
 
     with col_f5:
-        pass
+        modo_viewport = st.toggle(
+            "🧭 Carregar só a área visível do mapa",
+            value=False,
+            help="Desenha apenas as unidades dentro da área visível (com margem) "
+                 "e resume o restante em agrupamentos."
+        )
+        agrupar_zoom = st.toggle(
+            "🫧 Agrupar unidades conforme o zoom",
+            value=True,
+            help="Em zoom afastado, mostra agrupamentos pré-calculados em vez de "
+                 "um marcador por unidade."
+        )
+        dist_anomalia = st.number_input(
+            "📏 Distância para possíveis duplicidades (m)",
+            min_value=1.0,
+            max_value=1000.0,
+            value=DIST_PADRAO_M,
+            step=5.0,
+            help="Unidades mais próximas que isso entram na camada de anomalias."
+        )
+        col_hex_res, col_hex_met = st.columns(2)
+        with col_hex_res:
+            hex_resolucao = st.selectbox(
+                "⬡ Resolução dos hexágonos",
+                list(HEX_RESOLUCOES),
+                index=list(HEX_RESOLUCOES).index(HEX_RESOLUCAO_PADRAO),
+            )
+        with col_hex_met:
+            hex_metrica = st.selectbox("🎨 Cor dos hexágonos", HEX_METRICAS)
 
 # =============================
 # Aplicação dos filtros
 # =============================
-fdf = df.copy()
-
-# Ano: só filtra se o toggle estiver ligado e houver seleção
-if use_filter_ano and anos_lista and ano_sel:
-    fdf = fdf[fdf["Ano_filtro"].isin(ano_sel)]
-
-# Mês: só filtra se o toggle estiver ligado e houver seleção
-if use_filter_mes and meses_lista and mes_sel:
-    fdf = fdf[fdf["Mes_filtro"].isin(mes_sel)]
-
-# Ocorrências
-if ocorr_sel and "Ocorrências" in fdf.columns:
-    fdf = fdf[fdf["Ocorrências"].isin(ocorr_sel)]
-
-# Busca por texto
-if search_text:
-    txt = search_text.strip().lower()
-    mask = pd.Series([False] * len(fdf))
-    if "CÓDIGO" in fdf.columns:
-        mask = mask | fdf["CÓDIGO"].astype(str).str.lower().str.contains(txt, na=False)
-    if "Nome" in fdf.columns:
-        mask = mask | fdf["Nome"].astype(str).str.lower().str.contains(txt, na=False)
-    fdf = fdf[mask]
+# O dataset é compartilhado entre as sessões e nunca é alterado aqui: os
+# filtros produzem apenas as posições selecionadas (sel). O resultado de cada
+# combinação (posições, KPIs e divergências) fica no cache LRU do processo.
+filtros = FilterState.normalized(
+    anos=ano_sel if use_filter_ano and anos_lista else None,
+    meses=mes_sel if use_filter_mes and meses_lista else None,
+    ocorrencias=ocorr_sel,
+    busca=search_text,
+)
+escalas = cached_metric_scales(dataset_version, df)
+resultado = get_filter_cache().get_or_compute(dataset_version, filtros, df, escalas)
+sel = resultado.sel
+
+# URL compartilhável: Ocorrências com todas as opções marcadas é o padrão
+params_url = filtros.to_query_params()
+if set(filtros.ocorrencias) == {str(o) for o in ocorr_opts}:
+    params_url.pop("ocorr", None)
+if unidade_url:
+    params_url["unidade"] = unidade_url
+if params_url != st.query_params.to_dict():
+    st.query_params.from_dict(params_url)
 
 # =============================
 # Cálculo de alertas de divergência
 # =============================
-for col in [
-    "Nº Viveiros total",
-    "Atual Viveiros Total",
-    "Nº Viveiros cheio",
-    "Atual Viveiros cheio",
-    "Área (ha).1",
-    "Atual Área (ha).1",
-    "Prof. Média  (m)",
-    "Atual Profun.",
-]:
-    if col in fdf.columns:
-        fdf[col] = pd.to_numeric(fdf[col], errors="coerce")
-        fdf[col + "_num"] = fdf[col]
-
-diff_cols = []
-
-if {"Nº Viveiros total_num", "Atual Viveiros Total_num"}.issubset(fdf.columns):
-    fdf["diff_viv_total"] = fdf["Atual Viveiros Total_num"] - fdf["Nº Viveiros total_num"]
-    diff_cols.append("diff_viv_total")
-
-if {"Nº Viveiros cheio_num", "Atual Viveiros cheio_num"}.issubset(fdf.columns):
-    fdf["diff_viv_cheio"] = fdf["Atual Viveiros cheio_num"] - fdf["Nº Viveiros cheio_num"]
-    diff_cols.append("diff_viv_cheio")
-
-if {"Área (ha).1_num", "Atual Área (ha).1_num"}.issubset(fdf.columns):
-    fdf["diff_area"] = fdf["Atual Área (ha).1_num"] - fdf["Área (ha).1_num"]
-    diff_cols.append("diff_area")
-
-if {"Prof. Média  (m)_num", "Atual Profun._num"}.issubset(fdf.columns):
-    fdf["diff_prof"] = fdf["Atual Profun._num"] - fdf["Prof. Média  (m)_num"]
-    diff_cols.append("diff_prof")
-
-div_mask = pd.Series([False] * len(fdf))
-for c in diff_cols:
-    div_mask = div_mask | (fdf[c].fillna(0) != 0)
-
-alertas_df = fdf[div_mask].copy()
+# diferenças e tipo de divergência já vêm calculados no dataset preparado
+sel_alerta = resultado.sel_alerta
 
 # =============================
 # KPIs
 # =============================
 st.markdown("### 📈 Indicadores Principais")
 
-base_df = fdf.copy()
-
-total_unidades = len(base_df)
-total_viveiros_total = base_df.get("Atual Viveiros Total_num", pd.Series(dtype=float)).fillna(0).sum()
-total_viveiros_cheio = base_df.get("Atual Viveiros cheio_num", pd.Series(dtype=float)).fillna(0).sum()
-total_area = base_df.get("Atual Área (ha).1_num", pd.Series(dtype=float)).fillna(0).sum()
+total_unidades = resultado.kpis["unidades"]
+total_viveiros_total = resultado.kpis["viveiros_total"]
+total_viveiros_cheio = resultado.kpis["viveiros_cheio"]
+total_area = resultado.kpis["area"]
 
 k1, k2, k3, k4 = st.columns(4)
 
@@ -696,55 +1477,52 @@ with k4:
 # =============================
 st.markdown("### 🚨 Alertas de divergência entre dados previstos e atuais")
 
-if alertas_df.empty:
+if len(sel_alerta) == 0:
     st.success("Nenhuma divergência relevante encontrada entre os valores originais e os valores atuais.")
 else:
     st.warning(
-        f"Foram encontradas {len(alertas_df)} unidades com diferença entre dados originais e dados atuais. "
+        f"Foram encontradas {len(sel_alerta)} unidades com diferença entre dados originais e dados atuais. "
         "Revise estas unidades com atenção."
     )
 
-    def classifica_linha(row):
-        pos = False
-        neg = False
-        for c in diff_cols:
-            v = row.get(c)
-            if pd.isna(v):
-                continue
-            if v > 0:
-                pos = True
-            if v < 0:
-                neg = True
-        if pos and not neg:
-            return "Positiva"
-        if neg and not pos:
-            return "Negativa"
-        if pos and neg:
-            return "Mista"
-        return "Zero"
-
-    alertas_df = alertas_df.copy()
-    if diff_cols:
-        alertas_df["Tipo Divergência"] = alertas_df.apply(classifica_linha, axis=1)
-
     filtro_tipo = st.radio(
         "Filtrar divergências",
         ["Todas", "Positiva", "Negativa", "Mista"],
         horizontal=True
     )
 
-    df_exibir = alertas_df.copy()
+    sel_exibir = sel_alerta
+    scores_exibir = resultado.scores
     if filtro_tipo != "Todas":
-        df_exibir = df_exibir[df_exibir["Tipo Divergência"] == filtro_tipo]
-
-    if "diff_viv_total" in df_exibir.columns:
-        df_exibir["Δ Viveiros Total"] = df_exibir["diff_viv_total"]
-    if "diff_viv_cheio" in df_exibir.columns:
-        df_exibir["Δ Viveiros Cheio"] = df_exibir["diff_viv_cheio"]
-    if "diff_area" in df_exibir.columns:
-        df_exibir["Δ Área (ha)"] = df_exibir["diff_area"]
-    if "diff_prof" in df_exibir.columns:
-        df_exibir["Δ Profundidade (m)"] = df_exibir["diff_prof"]
+        mask_tipo = df["Tipo Divergência"].to_numpy()[sel_alerta] == filtro_tipo
+        sel_exibir = sel_alerta[mask_tipo]
+        scores_exibir = scores_exibir[mask_tipo]
+
+    # Ranking: por padrão só as K piores, pela pontuação de ranking.py
+    col_k, col_todas = st.columns([1, 2])
+    with col_k:
+        k_top = st.number_input(
+            "Quantidade de piores divergências",
+            min_value=1,
+            max_value=1000,
+            value=20,
+            step=5,
+        )
+    with col_todas:
+        mostrar_todas = st.toggle(
+            "Mostrar todas as unidades divergentes",
+            value=False,
+            help="Lista todas as unidades do filtro, ordenadas pela pontuação."
+        )
+    n_tipo = len(sel_exibir)  # divergências do tipo escolhido, antes do corte
+    ordem = top_k(scores_exibir, n_tipo if mostrar_todas else int(k_top))
+    sel_exibir = sel_exibir[ordem]
+    scores_exibir = scores_exibir[ordem]
+    if not mostrar_todas and len(ordem) < n_tipo:
+        st.caption(
+            f"Exibindo as {len(ordem)} divergências mais graves "
+            "(variação relativa e absoluta de viveiros, área e profundidade)."
+        )
 
     cols_alerta = [
         "CÓDIGO",
@@ -763,16 +1541,11 @@ else:
         "Δ Profundidade (m)",
         "Tipo Divergência",
     ]
-    cols_exist_alerta = [c for c in cols_alerta if c in df_exibir.columns]
-
-    subset_diff = [
-        c for c in [
-            "Δ Viveiros Total",
-            "Δ Viveiros Cheio",
-            "Δ Área (ha)",
-            "Δ Profundidade (m)"
-        ] if c in df_exibir.columns
-    ]
+    # colunas Δ são as diff_* do dataset, apenas renomeadas na exibição
+    delta_fonte = {delta: diff for diff, delta in DELTA_LABELS.items()}
+    cols_exist_alerta = [c for c in cols_alerta if delta_fonte.get(c, c) in df.columns]
+
+    subset_diff = [c for c in DELTA_LABELS.values() if c in cols_exist_alerta]
 
     numeric_cols_all = [
         "Nº Viveiros total",
@@ -790,11 +1563,13 @@ else:
     ]
     numeric_cols = [c for c in numeric_cols_all if c in cols_exist_alerta]
 
-    df_view = df_exibir[cols_exist_alerta].copy()
-    for col in numeric_cols:
-        df_view[col] = pd.to_numeric(df_view[col], errors="coerce")
+    df_view = rows_view(
+        df, sel_exibir, [delta_fonte.get(c, c) for c in cols_exist_alerta]
+    ).rename(columns=DELTA_LABELS)
+    df_view.insert(0, "Pontuação", scores_exibir)
 
     fmt = {c: "{:.2f}" for c in numeric_cols}
+    fmt["Pontuação"] = "{:.3f}"
     styler = df_view.style.format(fmt)
 
     bloco_viv_total = {"Nº Viveiros total", "Atual Viveiros Total", "Δ Viveiros Total"}
@@ -830,11 +1605,38 @@ else:
     if subset_diff:
         styler = styler.applymap(cor_diferenca, subset=subset_diff)
 
-    st.dataframe(
-        styler,
-        use_container_width=True,
-        height=300
-    )
+    # o Styler tem limite de células; listas muito longas saem sem cores
+    if df_view.size > pd.get_option("styler.render.max_elements"):
+        st.dataframe(df_view, use_container_width=True, height=300)
+    else:
+        st.dataframe(
+            styler,
+            use_container_width=True,
+            height=300
+        )
+
+    if len(sel_exibir) and "CÓDIGO" in df.columns:
+        codigos_exibir = df["CÓDIGO"].to_numpy()[sel_exibir]
+        detalhe = st.selectbox(
+            "🔎 Detalhar pontuação da unidade",
+            range(len(sel_exibir)),
+            format_func=lambda i: f"{codigos_exibir[i]} — {scores_exibir[i]:.3f}",
+        )
+        detalhe_df = score_breakdown(df, int(sel_exibir[detalhe]), escalas)
+        detalhe_df["Métrica"] = detalhe_df["Métrica"].map(DELTA_LABELS)
+        st.markdown(
+            f"[🔗 Abrir detalhe da unidade {code_text(codigos_exibir[detalhe])}]"
+            f"({unit_link(codigos_exibir[detalhe])})"
+        )
+        st.dataframe(
+            detalhe_df.style.format({
+                "Original": "{:.2f}", "Atual": "{:.2f}", "Δ": "{:.2f}",
+                "Variação relativa": "{:.0%}", "Variação absoluta (escala)": "{:.0%}",
+                "Peso": "{:.1f}", "Contribuição": "{:.3f}",
+            }),
+            use_container_width=True,
+            hide_index=True,
+        )
 
 # =============================
 # Layout Mapa + Fotos
@@ -850,184 +1652,124 @@ with col_map:
     st.markdown("#### Mapa Interativo das Unidades")
 
     with st.container():
-        fmap = folium.Map(
-            location=[-5.0, -39.5],
-            zoom_start=8,
-            control_scale=True,
-            tiles=None
+        map_key = "mapa_unidades"
+        opcoes_mapa = MapOptions(
+            modo_viewport=modo_viewport,
+            agrupar_zoom=agrupar_zoom,
+            dist_anomalia=float(dist_anomalia),
+            hex_resolucao=hex_resolucao,
+            hex_metrica=hex_metrica,
         )
-
-        folium.TileLayer("CartoDB Positron", name="CartoDB Positron").add_to(fmap)
-        folium.TileLayer("OpenStreetMap", name="OpenStreetMap").add_to(fmap)
-        folium.TileLayer(
-            tiles="https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
-            name="Imagem de Satélite",
-            attr="Tiles © Esri"
-        ).add_to(fmap)
-
-        fg_pontos = folium.FeatureGroup(name="Unidades de Viveiros", show=True)
-        pts = []
-
-        lat_col = "Lati" if "Lati" in fdf.columns else None
-        lon_col = "Long" if "Long" in fdf.columns else None
-
-        ocorr_vals = sorted(
-            [str(o) for o in fdf.get("Ocorrências", pd.Series()).dropna().unique().tolist()]
-        )
-        palette = [
-            "#0984e3", "#00b894", "#e17055", "#6c5ce7",
-            "#d63031", "#fdcb6e", "#2d3436", "#ff7675",
-            "#00cec9", "#6c5ce7"
-        ]
-        ocorr_colors = {o: palette[i % len(palette)] for i, o in enumerate(ocorr_vals)}
-
-        for _, row in fdf.iterrows():
-            if not lat_col or not lon_col:
-                continue
-
-            lat = to_float(row.get(lat_col))
-            lon = to_float(row.get(lon_col))
-            if lat is None or lon is None or math.isnan(lat) or math.isnan(lon):
-                continue
-
-            ocorr = str(row.get("Ocorrências", "") or "")
-            color = ocorr_colors.get(ocorr, "#0984e3")
-
-            popup_html = make_popup_html(row)
-            popup = folium.Popup(popup_html, max_width=380)
-
-            tooltip_text = str(row.get("Nome", "Unidade"))
-            cod = row.get("CÓDIGO")
-            if cod:
-                tooltip_text = f"{cod} • {tooltip_text}"
-            if ocorr:
-                tooltip_text += f" • {ocorr}"
-
-            folium.CircleMarker(
-                location=[lat, lon],
-                radius=8,
-                color=color,
-                fill=True,
-                fill_color=color,
-                fill_opacity=0.9,
-                popup=popup,
-                tooltip=tooltip_text,
-                weight=2
-            ).add_to(fg_pontos)
-
-            pts.append((lat, lon))
-
-        fg_pontos.add_to(fmap)
-
-        if "Atual Viveiros Total_num" in fdf.columns and lat_col and lon_col:
-            heat_rows = []
-            for _, row in fdf.iterrows():
-                lat_raw = row.get(lat_col)
-                lon_raw = row.get(lon_col)
-                value = row.get("Atual Viveiros Total_num")
-
-                lat = to_float(lat_raw)
-                lon = to_float(lon_raw)
-
-                invalid_coord = (
-                    lat is None or lon is None or
-                    (isinstance(lat, float) and math.isnan(lat)) or
-                    (isinstance(lon, float) and math.isnan(lon))
-                )
-
-                if invalid_coord or pd.isna(value) or value <= 0:
-                    continue
-
-                heat_rows.append([float(lat), float(lon), float(value)])
-
-            if heat_rows:
-                fg_heat = folium.FeatureGroup(name="Mapa de calor (viveiros)", show=False)
-                HeatMap(
-                    heat_rows,
-                    radius=25,
-                    blur=20,
-                    max_zoom=12
-                ).add_to(fg_heat)
-                fg_heat.add_to(fmap)
-
-        if pts:
-            fmap.fit_bounds([
-                [min(p[0] for p in pts), min(p[1] for p in pts)],
-                [max(p[0] for p in pts), max(p[1] for p in pts)],
-            ])
-
-        if ocorr_colors:
-            legend_items_html = ""
-            for o, color in ocorr_colors.items():
-                legend_items_html += f"""
-                <div style="display:flex;align-items:center;margin-bottom:4px;">
-                  <span style="display:inline-block;width:14px;height:14px;border-radius:50%;background:{color};margin-right:6px;border:2px solid white;box-shadow:0 1px 3px rgba(0,0,0,0.3);"></span>{o}
-                </div>
-                """
+        acompanha_view = modo_viewport or agrupar_zoom
+        view = current_map_view(map_key) if acompanha_view else None
+
+        # Primeira exibição do mapa na sessão: o HTML pré-renderizado em disco,
+        # quando existe. Do rerun seguinte em diante entra o mapa interativo,
+        # que devolve cliques e zoom ao servidor.
+        fontes_mapa = MapSources(df, dataset_version)
+        mapas = get_map_artifact_cache()
+        mapa_pronto = None
+        if mapas is not None:
+            mapas.record_use(filtros, opcoes_mapa)
+            if not st.session_state.get("_mapa_interativo"):
+                st.session_state["_mapa_interativo"] = True
+                mapa_pronto = mapas.get(artifact_key(dataset_version, filtros, opcoes_mapa))
+                if mapa_pronto is None:
+                    # a próxima sessão nova com este filtro já encontra o arquivo
+                    prerender_maps(mapas, get_filter_cache(), dataset, [(filtros, opcoes_mapa)])
+
+        if mapa_pronto is not None:
+            with MAP_SECONDS.time():
+                components.html(mapa_pronto, height=MAPA_ALTURA_PX)
+            anomalias = visible_anomalies(fontes_mapa, sel, dist_anomalia)
+            _, hex_resumo = map_hex_summary(fontes_mapa, filtros, sel, sel_alerta, hex_resolucao)
+            st.caption(
+                "⚡ Mapa pré-renderizado. Para ver na galeria as fotos da unidade "
+                "clicada, ative o mapa interativo."
+            )
+            st.button("🖱️ Ativar mapa interativo")
         else:
-            legend_items_html = """
-            <div style="display:flex;align-items:center;margin-bottom:4px;">
-              <span style="display:inline-block;width:14px;height:14px;border-radius:50%;background:#0984e3;margin-right:6px;border:2px solid white;box-shadow:0 1px 3px rgba(0,0,0,0.3);"></span>Unidade cadastrada
-            </div>
-            """
-
-        legend_html = """
-        {% macro html(this, kwargs) %}
-        <div id="legend-viveiros" style="
-            position: fixed;
-            bottom: 40px;
-            left: 10px;
-            z-index: 9999;
-            background: rgba(255,255,255,0.95);
-            padding: 12px 16px;
-            border: 1px solid #ddd;
-            border-radius: 16px;
-            font-size: 12px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.15);
-            backdrop-filter: blur(10px);
-            font-family: 'Segoe UI', system-ui, sans-serif;
-        ">
-          <div id="legend-viveiros-header" style="font-weight:700; margin-bottom:6px; color:#2d3436; font-size:13px; cursor:pointer;"
-               onclick="
-                 var body = document.getElementById('legend-viveiros-body');
-                 if (body.style.display === 'none') {
-                     body.style.display = 'block';
-                     this.innerHTML = 'Ocorrências ▾';
-                 } else {
-                     body.style.display = 'none';
-                     this.innerHTML = 'Ocorrências ▸';
-                 }
-               ">
-            Ocorrências ▾
-          </div>
-          <div id="legend-viveiros-body" style="margin-top:4px;">
-        """ + legend_items_html + """
-            <div style="font-size:11px;color:#636e72;margin-top:4px;">
-              Cores por categoria de ocorrência.
-            </div>
-          </div>
-        </div>
-        {% endmacro %}
-        """
-        legend = MacroElement()
-        legend._template = Template(legend_html)
-        fmap.get_root().add_child(legend)
-
-        LayerControl(collapsed=True).add_to(fmap)
+            fmap, info_mapa = build_unit_map(fontes_mapa, filtros, sel, sel_alerta, opcoes_mapa, view)
+            anomalias, hex_resumo = info_mapa["anomalias"], info_mapa["hex_resumo"]
+            if info_mapa["agrupamentos"]:
+                st.caption(info_mapa["agrupamentos"])
+
+            with MAP_SECONDS.time():
+                if acompanha_view:
+                    map_data = st_folium(
+                        fmap,
+                        key=map_key,
+                        height=MAPA_ALTURA_PX,
+                        use_container_width=True,
+                        center=view["center"] if view else None,
+                        zoom=view["zoom"] if view else None,
+                    )
+                else:
+                    map_data = st_folium(fmap, height=MAPA_ALTURA_PX, use_container_width=True)
+
+        if "_geo_status" in df.columns:
+            sel_geo = sel[col_values(df, "_geo_status", sel) != GEO_OK]
+            cols_geo = [
+                c for c in ["CÓDIGO", "Nome", "Lati", "Long", "_lat_wgs84", "_lon_wgs84", "_geo_status"]
+                if c in df.columns
+            ]
+            geo_problemas = rows_view(df, sel_geo, cols_geo)
+            if not geo_problemas.empty:
+                with st.expander(f"📍 Coordenadas corrigidas ou descartadas ({len(geo_problemas)})"):
+                    st.caption(
+                        " • ".join(
+                            f"{k}: {v}" for k, v in geo_problemas["_geo_status"].value_counts().items() if v
+                        )
+                    )
+                    st.dataframe(
+                        geo_problemas.rename(columns={
+                            "_lat_wgs84": "Lat (WGS84)",
+                            "_lon_wgs84": "Long (WGS84)",
+                            "_geo_status": "Situação",
+                        }),
+                        use_container_width=True,
+                        height=200
+                    )
+
+        if len(anomalias):
+            with st.expander(f"🧬 Possíveis duplicidades e anomalias ({len(anomalias)})"):
+                st.caption(
+                    " • ".join(f"{k}: {v}" for k, v in anomalias["Tipo"].value_counts().items())
+                )
+                st.dataframe(
+                    anomalias.drop(columns=["_pos", "_pos_rel"]),
+                    use_container_width=True,
+                    height=200
+                )
 
-        map_data = st_folium(fmap, height=500, use_container_width=True)
+        if hex_resumo is not None and len(hex_resumo):
+            with st.expander(f"⬡ Resumo por hexágono — {hex_resolucao} ({len(hex_resumo)} células)"):
+                st.dataframe(
+                    hex_resumo.drop(columns=["_q", "_r"]).sort_values(hex_metrica, ascending=False),
+                    use_container_width=True,
+                    height=260,
+                    hide_index=True,
+                    column_config={
+                        "Latitude": st.column_config.NumberColumn(format="%.4f"),
+                        "Longitude": st.column_config.NumberColumn(format="%.4f"),
+                        "Viveiros (atual)": st.column_config.NumberColumn(format="%.0f"),
+                        "Viveiros cheios (atual)": st.column_config.NumberColumn(format="%.0f"),
+                        "Área (ha) atual": st.column_config.NumberColumn(format="%.2f"),
+                        "Taxa de divergência": st.column_config.NumberColumn(format="percent"),
+                    },
+                )
 
 with col_fotos:
     st.markdown("#### 📸 Galeria de Fotos")
 
     with st.container():
-        foto_col = "Link Foto" if "Link Foto" in fdf.columns else None
+        tem_fotos = has_photos(df)
 
-        fdf_gallery = fdf.copy()
+        sel_gallery = sel
         clicked = False
 
-        lat_col = "Lati" if "Lati" in fdf.columns else None
-        lon_col = "Long" if "Long" in fdf.columns else None
+        lat_col = "_lat_wgs84" if "_lat_wgs84" in df.columns else None
+        lon_col = "_lon_wgs84" if "_lon_wgs84" in df.columns else None
 
         if map_data and 'last_object_clicked' in map_data and lat_col and lon_col:
             click_info = map_data.get("last_object_clicked") or map_data.get("last_clicked")
@@ -1036,36 +1778,42 @@ with col_fotos:
                 click_lat = click_info["lat"]
                 click_lon = click_info["lng"]
 
-                tmp = fdf.copy()
-                tmp["_lat"] = tmp[lat_col].apply(to_float)
-                tmp["_lon"] = tmp[lon_col].apply(to_float)
-                tmp = tmp.dropna(subset=["_lat", "_lon"])
+                click_lat_arr = col_values(df, lat_col, sel)
+                click_lon_arr = col_values(df, lon_col, sel)
+                dist2 = (click_lat_arr - click_lat) ** 2 + (click_lon_arr - click_lon) ** 2
+                dist2[~np.isfinite(dist2)] = np.inf
 
-                if not tmp.empty:
-                    tmp["dist2"] = (tmp["_lat"] - click_lat) ** 2 + (tmp["_lon"] - click_lon) ** 2
-                    tmp = tmp.sort_values("dist2")
-                    fdf_gallery = tmp.head(1)
+                if len(dist2) and np.isfinite(dist2).any():
+                    sel_gallery = sel[[int(np.argmin(dist2))]]
 
-        if not foto_col:
+        if not tem_fotos:
             st.info("📷 Coluna de fotos não encontrada na planilha.")
         else:
             items = []
             vistos = set()
+            photo_cache = get_photo_cache()
+            puladas = 0
 
-            for _, row in fdf_gallery.iterrows():
-                link = row.get(foto_col)
+            galeria = zip(
+                rows_view(df, sel_gallery, ["Nome", "CÓDIGO"]).iterrows(),
+                photo_links(df, sel_gallery),
+                photo_ids(df, sel_gallery),
+            )
+            for (_, row), link, fid in galeria:
                 if not isinstance(link, str) or not link.strip():
                     continue
                 if link in vistos:
                     continue
                 vistos.add(link)
 
-                nome = row.get("Nome", "")
-                cod = row.get("CÓDIGO", "")
+                nome = as_text(row.get("Nome"))
+                cod = as_text(row.get("CÓDIGO"))
                 caption_parts = [str(cod) if cod else None, str(nome) if nome else None]
                 caption = " • ".join([p for p in caption_parts if p])
 
-                fid = gdrive_extract_id(link)
+                if fid and photo_cache.is_bad(fid):
+                    puladas += 1
+                    continue
                 if fid:
                     thumb, big = drive_image_urls(fid)
                     items.append({"thumb": thumb, "src": big, "caption": caption})
@@ -1084,6 +1832,17 @@ with col_fotos:
 
             render_lightgallery_images(items, height_px=460, auto_open=auto_open)
 
+            if puladas:
+                st.caption(f"📷 {puladas} foto(s) com link quebrado ou sem permissão foram omitidas")
+
+            fotos_ruins = photo_report(df, sel, photo_cache)
+            if not fotos_ruins.empty:
+                with st.expander(f"📷 Unidades com fotos ausentes ou quebradas ({len(fotos_ruins)})"):
+                    st.caption(
+                        " • ".join(f"{k}: {v}" for k, v in fotos_ruins["Situação"].value_counts().items())
+                    )
+                    st.dataframe(fotos_ruins, use_container_width=True, height=200)
+
 # =============================
 # Gráficos de Ocorrências
 # =============================
@@ -1092,66 +1851,36 @@ st.markdown('<div class="section-title">📊 Análise de Ocorrências</div>', un
 
 col_g1, col_g2 = st.columns(2)
 
+# Especificações montadas uma vez por (versão, filtro) a partir das contagens
+def grafico_ocorrencias():
+    contagens = occurrence_counts(df, sel)
+    return configure(occurrence_chart(contagens)) if len(contagens) else None
+
+def grafico_ocorrencias_ano():
+    contagens = occurrence_year_counts(df, sel)
+    return configure(occurrence_year_chart(contagens)) if len(contagens) else None
+
 with col_g1:
-    if "Ocorrências" in fdf.columns:
-        tmp = (
-            fdf[["Ocorrências"]]
-            .dropna()
-            .groupby("Ocorrências")
-            .size()
-            .reset_index(name="contagem")
+    if "Ocorrências" in df.columns:
+        grafico = get_chart_cache().get_or_build(
+            (dataset_version, filtros, "ocorrencias"), grafico_ocorrencias
         )
-        if tmp.empty:
+        if grafico is None:
             st.info("📊 Sem dados de Ocorrências para os filtros atuais")
         else:
-            chart = (
-                alt.Chart(tmp)
-                .mark_bar(cornerRadius=8)
-                .encode(
-                    x=alt.X("Ocorrências:N", title="", sort="-y", axis=alt.Axis(labelAngle=0)),
-                    y=alt.Y("contagem:Q", title="Quantidade de unidades"),
-                    color=alt.Color("Ocorrências:N", legend=None),
-                    tooltip=[
-                        alt.Tooltip("Ocorrências:N", title="Ocorrência"),
-                        alt.Tooltip("contagem:Q", title="Unidades")
-                    ]
-                )
-                .properties(height=300, title="Distribuição por tipo de ocorrência")
-                .configure_title(fontSize=16, font="Segoe UI", anchor="middle")
-            )
-            st.altair_chart(chart, use_container_width=True)
+            st.vega_lite_chart(grafico.spec, use_container_width=True)
     else:
         st.info("📋 Coluna Ocorrências não encontrada.")
 
 with col_g2:
-    if "Ano_filtro" in fdf.columns and "Ocorrências" in fdf.columns:
-        tmp = (
-            fdf[["Ano_filtro", "Ocorrências"]]
-            .dropna()
-            .groupby(["Ano_filtro", "Ocorrências"])
-            .size()
-            .reset_index(name="contagem")
+    if "Ano_filtro" in df.columns and "Ocorrências" in df.columns:
+        grafico = get_chart_cache().get_or_build(
+            (dataset_version, filtros, "ocorrencias_ano"), grafico_ocorrencias_ano
         )
-        if tmp.empty:
+        if grafico is None:
             st.info("📊 Sem dados de Ocorrências por ano para os filtros atuais")
         else:
-            chart = (
-                alt.Chart(tmp)
-                .mark_bar(cornerRadius=4)
-                .encode(
-                    x=alt.X("Ano_filtro:O", title="Ano"),
-                    y=alt.Y("contagem:Q", title="Unidades"),
-                    color=alt.Color("Ocorrências:N", title="Ocorrência"),
-                    tooltip=[
-                        alt.Tooltip("Ano_filtro:O", title="Ano"),
-                        alt.Tooltip("Ocorrências:N", title="Ocorrência"),
-                        alt.Tooltip("contagem:Q", title="Unidades")
-                    ]
-                )
-                .properties(height=300, title="Ocorrências por ano")
-                .configure_title(fontSize=16, font="Segoe UI", anchor="middle")
-            )
-            st.altair_chart(chart, use_container_width=True)
+            st.vega_lite_chart(grafico.spec, use_container_width=True)
     else:
         st.info("📋 Dados de ano ou de Ocorrências não disponíveis para este gráfico.")
 
@@ -1170,8 +1899,8 @@ cols_tabela = [
     "Data Filtro"
 ]
 
-cols_existentes = [c for c in cols_tabela if c in fdf.columns]
-tabela = fdf[cols_existentes].copy()
+cols_existentes = [c for c in cols_tabela if c in df.columns]
+tabela = rows_view(df, sel, cols_existentes)
 
 st.dataframe(
     tabela,
@@ -1179,6 +1908,156 @@ st.dataframe(
     height=450
 )
 
+# Exportação: o arquivo só é gerado (em blocos) quando o botão é clicado
+col_exp1, col_exp2 = st.columns([1, 3])
+with col_exp1:
+    formato_export = st.selectbox("💾 Formato", list(FORMATOS), index=0)
+with col_exp2:
+    ext_export, mime_export = FORMATOS[formato_export]
+    st.download_button(
+        f"⬇️ Exportar {len(sel)} unidades filtradas ({formato_export})",
+        data=partial(export_filtered, df, sel, formato_export),
+        file_name=f"viveiros_{datetime.now(TZ):%Y%m%d_%H%M}.{ext_export}",
+        mime=mime_export,
+        on_click="ignore",
+        disabled=len(sel) == 0,
+    )
+
+# =============================
+# Mudanças desde a última atualização
+# =============================
+st.markdown("---")
+st.markdown('<div class="section-title">🆕 Mudanças desde a última atualização</div>', unsafe_allow_html=True)
+
+mudancas = dataset.changes
+if mudancas is None:
+    st.info("🆕 Ainda não há versão anterior nesta execução para comparar.")
+else:
+    st.caption(f"Comparando a versão {dataset.version} com a versão {mudancas.previous_version}")
+    col_m1, col_m2, col_m3 = st.columns(3)
+    col_m1.metric("Unidades novas", len(mudancas.novos))
+    col_m2.metric("Unidades removidas", len(mudancas.removidos))
+    col_m3.metric("Unidades modificadas", len(mudancas.modificados))
+
+    if mudancas.total == 0:
+        st.success("✅ Nenhuma unidade mudou entre as duas versões.")
+    else:
+        if len(mudancas.deltas):
+            st.dataframe(
+                mudancas.deltas.assign(
+                    Antes=mudancas.deltas["Antes"].map(lambda v: as_text(v) or "-"),
+                    Depois=mudancas.deltas["Depois"].map(lambda v: as_text(v) or "-"),
+                ),
+                use_container_width=True,
+                height=250
+            )
+        if mudancas.novos or mudancas.removidos:
+            with st.expander("Códigos novos e removidos"):
+                st.write("**Novos:** " + (", ".join(map(str, mudancas.novos)) or "-"))
+                st.write("**Removidos:** " + (", ".join(map(str, mudancas.removidos)) or "-"))
+
+# =============================
+# Histórico de versões
+# =============================
+st.markdown("---")
+st.markdown('<div class="section-title">🕰️ Histórico da Planilha</div>', unsafe_allow_html=True)
+
+snapshots_disponiveis = list_snapshots()
+if not snapshots_disponiveis:
+    st.info("🕰️ Nenhuma versão anterior registrada ainda.")
+else:
+    ultimo_snapshot = str(snapshots_disponiveis[-1])
+    col_h1, col_h2 = st.columns(2)
+
+    with col_h1:
+        evolucao = cached_divergence_over_time(ultimo_snapshot)
+        if evolucao.empty:
+            st.info("📊 Sem versões no período.")
+        else:
+            chart = (
+                alt.Chart(evolucao)
+                .mark_line(point=True)
+                .encode(
+                    x=alt.X("_fetched_at:T", title="Versão obtida em"),
+                    y=alt.Y("divergencias:Q", title="Unidades com divergência"),
+                    tooltip=[
+                        alt.Tooltip("_fetched_at:T", title="Obtida em", format="%d/%m/%Y %H:%M"),
+                        alt.Tooltip("_version:N", title="Versão"),
+                        alt.Tooltip("divergencias:Q", title="Divergências"),
+                        alt.Tooltip("unidades:Q", title="Unidades"),
+                    ]
+                )
+                .properties(height=300, title="Divergências ao longo do tempo")
+                .configure_title(fontSize=16, font="Segoe UI", anchor="middle")
+            )
+            st.altair_chart(chart, use_container_width=True)
+
+    with col_h2:
+        dia_hist = st.date_input(
+            "📅 Estado da planilha em",
+            value=datetime.now(TZ).date(),
+            format="DD/MM/YYYY"
+        )
+        estado = cached_read_as_of(
+            dia_hist, tuple(cols_existentes + ["_version", "_fetched_at"]), ultimo_snapshot
+        )
+        if estado.empty:
+            st.info("Nenhuma versão registrada até esta data.")
+        else:
+            st.caption(
+                f"Versão {estado['_version'].iloc[0]} obtida em "
+                f"{estado['_fetched_at'].iloc[0].strftime('%d/%m/%Y %H:%M')} • {len(estado)} unidades"
+            )
+            st.dataframe(
+                estado.drop(columns=["_version", "_fetched_at"]),
+                use_container_width=True,
+                height=250
+            )
+
+# =============================
+# Diagnóstico de memória
+# =============================
+if dataset.memory is not None:
+    with st.expander("🧮 Diagnóstico de memória do dataset"):
+        antes = int(dataset.memory["Bytes antes"].sum())
+        depois = int(dataset.memory["Bytes depois"].sum())
+        resumo = f"{len(df)} linhas • "
+        if dataset.raw_bytes:
+            resumo += (
+                f"planilha como lida (texto): {dataset.raw_bytes / 1024**2:,.2f} MB → "
+                f"compactada: {depois / 1024**2:,.2f} MB "
+                f"(**{dataset.raw_bytes / max(depois, 1):.1f}x menor**) • "
+            )
+        medido_agora = dataset.memory_from in (None, dataset.version)
+        if medido_agora:
+            resumo += (
+                f"já com números e datas convertidos: {antes / 1024**2:,.2f} MB "
+                f"({antes / max(depois, 1):.1f}x)"
+            )
+        else:
+            resumo += (
+                f"já com números e datas convertidos: {antes / 1024**2:,.2f} MB "
+                f"na última preparação completa ({dataset.memory_rows} linhas)"
+            )
+        st.caption(resumo)
+        st.caption(
+            "As colunas \"Bytes antes\" medem o dataset preparado com tipos genéricos "
+            "(object/float64); o link da foto já aparece separado em ID do Drive e outros links."
+            + ("" if medido_agora else
+               f" Esta versão foi atualizada só nas linhas que mudaram: \"Bytes antes\" é da "
+               f"versão {dataset.memory_from} e \"Bytes depois\", da versão atual.")
+        )
+        st.dataframe(dataset.memory, use_container_width=True, height=300)
+        cache_stats = get_filter_cache().stats()
+        st.caption(
+            f"Cache de filtros: {cache_stats['entradas']} combinações • "
+            f"{cache_stats['bytes'] / 1024:,.1f} KB de {FILTRO_CACHE_MB:g} MB • "
+            f"{cache_stats['acertos']} acertos / {cache_stats['faltas']} faltas "
+            f"({cache_stats['taxa_acerto']:.0%})"
+        )
+        if metricas_destino:
+            st.caption(f"📈 Métricas Prometheus: {metricas_destino}")
+
 # =============================
 # Footer
 # =============================
@@ -1193,3 +2072,6 @@ st.markdown("""
     </div>
 </div>
 """, unsafe_allow_html=True)
+
+RERUNS.inc()
+RERUN_SECONDS.observe(time.perf_counter() - inicio_rerun)
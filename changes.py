@@ -0,0 +1,137 @@
+"""Detecção de mudanças entre versões consecutivas da planilha.
+
+Cada linha recebe um hash do seu conteúdo, indexado por CÓDIGO (mais a ordem
+de ocorrência, para códigos repetidos). Comparar duas versões é uma junção
+por hash em O(n): linhas novas, removidas, modificadas e as que podem ser
+reaproveitadas sem novo processamento.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from photos import FOTO_COL, has_photos, photo_links
+from pipeline import code_text, code_texts, version_from_hashes
+
+KEY_COL = "CÓDIGO"
+_SEM_CODIGO = "\x00sem-codigo-"
+
+@dataclass(frozen=True)
+class ChangeSet:
+    previous_version: str
+    novos: list
+    removidos: list
+    modificados: list
+    deltas: pd.DataFrame
+
+    @property
+    def total(self) -> int:
+        return len(self.novos) + len(self.removidos) + len(self.modificados)
+
+def _row_keys(raw: pd.DataFrame, key: str) -> np.ndarray:
+    # mesmo texto de código que unit_index e snapshots (101, não "101.0")
+    if key in raw.columns:
+        # cópia: _hash_index preenche as linhas sem código no próprio array
+        return np.array(code_texts(raw[key]).astype(object).where(lambda s: s.notna(), None), dtype=object)
+    return np.full(len(raw), None, dtype=object)
+
+def _hash_index(h: np.ndarray, chaves: np.ndarray, key: str) -> pd.Series:
+    # linha sem código nunca casa com outra versão
+    sem = pd.isna(chaves)
+    chaves[sem] = [f"{_SEM_CODIGO}{i}" for i in np.flatnonzero(sem)]
+    ordem = pd.Series(chaves).groupby(chaves).cumcount().to_numpy()
+    idx = pd.MultiIndex.from_arrays([chaves, ordem], names=[key, "_ordem"])
+    return pd.Series(h, index=idx)
+
+def row_hashes(raw: pd.DataFrame, key: str = KEY_COL) -> pd.Series:
+    """Hash de cada linha do CSV bruto, indexado por (CÓDIGO, ordem)."""
+    h = pd.util.hash_pandas_object(raw, index=False).to_numpy()
+    return _hash_index(h, _row_keys(raw, key), key)
+
+class RowHasher:
+    """Hashes por linha e versão acumulados bloco a bloco (ingestão em blocos)."""
+
+    def __init__(self, key: str = KEY_COL):
+        self.key = key
+        self.columns = None
+        self._h = []
+        self._chaves = []
+
+    def update(self, raw: pd.DataFrame):
+        if self.columns is None:
+            self.columns = tuple(raw.columns)
+        self._h.append(pd.util.hash_pandas_object(raw, index=False).to_numpy())
+        self._chaves.append(_row_keys(raw, self.key))
+
+    def version(self) -> str:
+        return version_from_hashes(self.columns or (), self._h)
+
+    def row_hashes(self) -> pd.Series:
+        if not self._h:
+            return _hash_index(np.empty(0, dtype=np.uint64), np.empty(0, dtype=object), self.key)
+        return _hash_index(np.concatenate(self._h), np.concatenate(self._chaves), self.key)
+
+def match_rows(old: pd.Series, new: pd.Series):
+    """Junta os hashes das duas versões.
+
+    Retorna posições: (iguais_new, iguais_old, modificados_new,
+    modificados_old, novos_new, removidos_old).
+    """
+    pos_old = old.index.get_indexer(new.index)
+    existe = pos_old >= 0
+    igual = existe & (old.to_numpy()[np.where(existe, pos_old, 0)] == new.to_numpy())
+    mod = existe & ~igual
+    removidos = np.flatnonzero(~old.index.isin(new.index))
+    return (
+        np.flatnonzero(igual), pos_old[igual],
+        np.flatnonzero(mod), pos_old[mod],
+        np.flatnonzero(~existe), removidos,
+    )
+
+def _codigos(hashes: pd.Series, pos: np.ndarray) -> list:
+    chaves = hashes.index.get_level_values(0).to_numpy()[pos]
+    return [c for c in chaves if not str(c).startswith(_SEM_CODIGO)]
+
+def field_deltas(old_df: pd.DataFrame, new_df: pd.DataFrame, old_pos: np.ndarray,
+                 new_pos: np.ndarray, columns, key: str = KEY_COL) -> pd.DataFrame:
+    """Campos alterados nas linhas modificadas: CÓDIGO, Campo, Antes, Depois."""
+    partes = []
+    def tem(df, c):
+        return c in df.columns or (c == FOTO_COL and has_photos(df))
+
+    def valores(df, c, pos):
+        # o link da foto não fica no dataset preparado: é remontado do ID
+        return df[c].to_numpy(dtype=object)[pos] if c in df.columns else photo_links(df, pos)
+
+    cols = [c for c in columns if c != key and tem(old_df, c) and tem(new_df, c)]
+    codigos = (
+        np.array([code_text(v) for v in new_df[key].to_numpy(dtype=object)[new_pos]], dtype=object)
+        if key in new_df.columns else np.full(len(new_pos), None, dtype=object)
+    )
+    for col in cols:
+        antes = valores(old_df, col, old_pos)
+        depois = valores(new_df, col, new_pos)
+        vazio_a = pd.isna(antes)
+        vazio_d = pd.isna(depois)
+        mudou = np.flatnonzero((vazio_a != vazio_d) | (~vazio_a & ~vazio_d & (antes != depois)))
+        if len(mudou):
+            partes.append(pd.DataFrame({
+                key: codigos[mudou],
+                "Campo": col,
+                "Antes": antes[mudou],
+                "Depois": depois[mudou],
+            }))
+    if not partes:
+        return pd.DataFrame(columns=[key, "Campo", "Antes", "Depois"])
+    return pd.concat(partes, ignore_index=True)
+
+def build_changeset(previous_version: str, old_hashes: pd.Series, new_hashes: pd.Series,
+                    old_df: pd.DataFrame, new_df: pd.DataFrame, columns, match=None) -> ChangeSet:
+    _, _, mod_new, mod_old, novos, removidos = match or match_rows(old_hashes, new_hashes)
+    return ChangeSet(
+        previous_version=previous_version,
+        novos=_codigos(new_hashes, novos),
+        removidos=_codigos(old_hashes, removidos),
+        modificados=_codigos(new_hashes, mod_new),
+        deltas=field_deltas(old_df, new_df, mod_old, mod_new, columns),
+    )
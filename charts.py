@@ -0,0 +1,145 @@
+"""Gráficos de ocorrências do painel e dos relatórios.
+
+Os gráficos são montados só a partir das contagens agregadas (algumas
+dezenas de linhas), nunca das unidades. No painel, a especificação Vega-Lite
+de cada (versão, filtro, gráfico) é gerada uma vez e guardada em um cache LRU
+junto com o JSON: reruns com o mesmo filtro não passam de novo pelo Altair
+(montagem, validação do esquema e conversão dos dados) e mandam ao Streamlit
+uma especificação idêntica, com os dados já em Arrow.
+"""
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from metrics import REGISTRY
+
+CHART_REQUESTS = REGISTRY.counter(
+    "viveiros_chart_cache_requests_total", "Consultas ao cache de gráficos, por resultado.", ["resultado"]
+)
+
+# =============================
+# Contagens
+# =============================
+def occurrence_counts(df: pd.DataFrame, sel: np.ndarray) -> pd.DataFrame:
+    """Unidades de sel por Ocorrências."""
+    return (
+        df["Ocorrências"].iloc[sel]
+        .dropna()
+        .to_frame()
+        .groupby("Ocorrências", observed=True)
+        .size()
+        .reset_index(name="contagem")
+    )
+
+def occurrence_year_counts(df: pd.DataFrame, sel: np.ndarray) -> pd.DataFrame:
+    """Unidades de sel por ano e Ocorrências."""
+    return (
+        df[["Ano_filtro", "Ocorrências"]].iloc[sel]
+        .dropna()
+        .groupby(["Ano_filtro", "Ocorrências"], observed=True)
+        .size()
+        .reset_index(name="contagem")
+    )
+
+# =============================
+# Gráficos
+# =============================
+def occurrence_chart(contagens: pd.DataFrame) -> alt.Chart:
+    return (
+        alt.Chart(contagens)
+        .mark_bar(cornerRadius=8)
+        .encode(
+            x=alt.X("Ocorrências:N", title="", sort="-y", axis=alt.Axis(labelAngle=0)),
+            y=alt.Y("contagem:Q", title="Quantidade de unidades"),
+            color=alt.Color("Ocorrências:N", legend=None),
+            tooltip=[
+                alt.Tooltip("Ocorrências:N", title="Ocorrência"),
+                alt.Tooltip("contagem:Q", title="Unidades")
+            ]
+        )
+        .properties(height=300, title="Distribuição por tipo de ocorrência")
+    )
+
+def occurrence_year_chart(contagens: pd.DataFrame) -> alt.Chart:
+    return (
+        alt.Chart(contagens)
+        .mark_bar(cornerRadius=4)
+        .encode(
+            x=alt.X("Ano_filtro:O", title="Ano"),
+            y=alt.Y("contagem:Q", title="Unidades"),
+            color=alt.Color("Ocorrências:N", title="Ocorrência"),
+            tooltip=[
+                alt.Tooltip("Ano_filtro:O", title="Ano"),
+                alt.Tooltip("Ocorrências:N", title="Ocorrência"),
+                alt.Tooltip("contagem:Q", title="Unidades")
+            ]
+        )
+        .properties(height=300, title="Ocorrências por ano")
+    )
+
+def configure(chart):
+    return chart.configure_title(fontSize=16, font="Segoe UI", anchor="middle")
+
+# =============================
+# Especificações em cache
+# =============================
+def _arrow_bytes(valores: list) -> bytes:
+    tabela = pa.Table.from_pandas(pd.DataFrame(valores), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tabela.schema) as writer:
+        writer.write_table(tabela)
+    return sink.getvalue().to_pybytes()
+
+@dataclass(frozen=True)
+class ChartSpec:
+    spec: dict  # para st.vega_lite_chart (datasets já em Arrow)
+    json: str   # especificação completa, com os dados embutidos
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.json) + sum(
+            len(v) for v in self.spec.get("datasets", {}).values() if isinstance(v, bytes)
+        )
+
+def build_spec(chart) -> ChartSpec:
+    completo = chart.to_dict()
+    # o tema padrão do Altair fixa o tamanho da vista; no Streamlit quem
+    # decide é a largura do container
+    config = completo.get("config")
+    if isinstance(config, dict):
+        config.pop("view", None)
+    texto = json.dumps(completo, ensure_ascii=False, sort_keys=True)
+    spec = json.loads(texto)
+    spec["datasets"] = {nome: _arrow_bytes(v) for nome, v in spec.get("datasets", {}).items()}
+    return ChartSpec(spec=spec, json=texto)
+
+class ChartSpecCache:
+    """LRU de ChartSpec por chave (versão, filtro, gráfico)."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, chave, construir) -> ChartSpec:
+        """construir() devolve o gráfico Altair, ou None quando não há dados."""
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                CHART_REQUESTS.inc(resultado="acerto")
+                return self._itens[chave]
+        CHART_REQUESTS.inc(resultado="falta")
+
+        chart = construir()
+        res = build_spec(chart) if chart is not None else None
+        with self._lock:
+            self._itens[chave] = res
+            while len(self._itens) > self.max_entries:
+                self._itens.popitem(last=False)
+        return res
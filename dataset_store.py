@@ -0,0 +1,273 @@
+"""Versões publicadas dos dados, atualizadas em segundo plano.
+
+Um único DatasetStore por processo baixa a planilha periodicamente, prepara os
+dados fora do caminho das requisições e publica uma nova DatasetVersion
+imutável. As sessões apenas leem a versão atual, sem esperar pela rede.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from changes import RowHasher, build_changeset, match_rows, row_hashes
+from metrics import REGISTRY
+from pipeline import (
+    TZ, compact_dataset, compute_dataset_version, memory_report, prepare_chunks,
+    prepare_dataset, prepare_incremental, refresh_memory_report,
+)
+
+log = logging.getLogger(__name__)
+
+FETCHES = REGISTRY.counter("viveiros_fetch_total", "Leituras da planilha, por resultado.", ["resultado"])
+FETCH_SECONDS = REGISTRY.histogram(
+    "viveiros_fetch_seconds", "Duração da leitura da planilha (fora do modo em blocos)."
+)
+PREPARE_SECONDS = REGISTRY.histogram(
+    "viveiros_prepare_seconds",
+    "Duração do preparo de uma versão (modo blocos inclui a leitura).",
+    ["modo"],
+)
+ROWS_PARSED = REGISTRY.counter("viveiros_rows_parsed_total", "Linhas lidas da planilha.")
+VERSIONS = REGISTRY.counter("viveiros_versions_published_total", "Versões novas publicadas.")
+DATASET_ROWS = REGISTRY.gauge("viveiros_dataset_rows", "Linhas da versão publicada.")
+VERSION_TIMESTAMP = REGISTRY.gauge(
+    "viveiros_dataset_version_timestamp_seconds", "Quando a versão publicada foi obtida (epoch)."
+)
+
+def _deep_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+@dataclass(frozen=True)
+class DatasetVersion:
+    version: str
+    df: pd.DataFrame
+    fetched_at: datetime
+    memory: pd.DataFrame = None
+    # versão e linhas em que o lado "antes" (tipos genéricos) do relatório foi
+    # medido; nas versões incrementais só o lado compactado é medido de novo
+    memory_from: str = None
+    memory_rows: int = None
+    raw_bytes: int = None  # planilha como foi lida (texto), para comparar com a compactada
+    row_hash: pd.Series = None
+    source_columns: tuple = ()
+    changes: object = None  # ChangeSet em relação à versão anterior
+
+class DatasetStore:
+    def __init__(self, loader, interval_s: float = 300.0, chunked: bool = False):
+        """loader: função sem argumentos que devolve o CSV bruto.
+
+        Com chunked=True, loader devolve um iterável de blocos do CSV, que são
+        preparados um a um (ver pipeline.prepare_chunks).
+        """
+        self._loader = loader
+        self.interval_s = interval_s
+        self.chunked = chunked
+        self._current = None
+        self._refresh_lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._checks = 0
+        self._thread = None
+        self._subscribers = []
+        # callbacks em ordem de publicação, fora do lock e da requisição
+        self._notifier = ThreadPoolExecutor(max_workers=1, thread_name_prefix="viveiros-versao")
+        self.checked_at = None
+        self.last_error = None
+
+    def current(self):
+        """Última versão publicada (ou None antes da primeira carga)."""
+        return self._current
+
+    def ensure_loaded(self):
+        """Carrega a primeira versão, se ainda não houver; sessões que chegam
+        juntas esperam a mesma carga em vez de baixar a planilha cada uma."""
+        with self._refresh_lock:
+            if self._current is None:
+                self.refresh()
+            return self._current
+
+    def subscribe(self, callback):
+        """Registra callback(version) chamado a cada nova versão publicada.
+
+        Os callbacks rodam numa thread própria, um de cada vez e na ordem das
+        versões: quem espera a carga (ensure_loaded) não espera por eles.
+        """
+        self._subscribers.append(callback)
+
+    def _notify(self, versao):
+        for callback in self._subscribers:
+            try:
+                callback(versao)
+            except Exception:
+                log.exception("Falha ao processar a versão %s", versao.version)
+
+    def refresh(self):
+        """Baixa e, se o conteúdo mudou, prepara e publica uma nova versão."""
+        with self._refresh_lock:
+            try:
+                anterior = self._current
+                atual = self._load_chunked(anterior) if self.chunked else self._load(anterior)
+                with self._cond:
+                    self._current = atual
+                    self.checked_at = datetime.now(TZ)
+                self.last_error = None
+                FETCHES.inc(resultado="ok")
+            except Exception as e:
+                self.last_error = e
+                FETCHES.inc(resultado="erro")
+                raise
+            finally:
+                with self._cond:
+                    self._checks += 1
+                    self._cond.notify_all()
+
+            if atual is not anterior:
+                VERSIONS.inc()
+                DATASET_ROWS.set(len(atual.df))
+                VERSION_TIMESTAMP.set(atual.fetched_at.timestamp())
+                self._notifier.submit(self._notify, atual)
+            return atual
+
+    def _load(self, anterior):
+        with FETCH_SECONDS.time():
+            raw = self._loader()
+        ROWS_PARSED.inc(len(raw))
+        version = compute_dataset_version(raw)
+        if anterior is not None and anterior.version == version:
+            return anterior
+        return self._build_version(raw, version, anterior)
+
+    def _load_chunked(self, anterior):
+        colunas = ()
+        reaproveita = False
+        reuse = None
+        if anterior is not None:
+            # 1ª leitura: só os hashes dos blocos; sem mudança nada é preparado
+            hasher = RowHasher()
+            for raw in self._loader():
+                hasher.update(raw)
+                ROWS_PARSED.inc(len(raw))
+                del raw
+            if hasher.version() == anterior.version:
+                return anterior
+            colunas = hasher.columns or ()
+            reaproveita = anterior.row_hash is not None and anterior.source_columns == colunas
+
+        # 2ª leitura (ou a única, na primeira carga): preparo bloco a bloco,
+        # reaproveitando as linhas iguais às da versão anterior
+        if reaproveita:
+            lidas = hasher.row_hashes()
+            par = match_rows(anterior.row_hash, lidas)
+            candidatas = np.full(len(lidas), -1, dtype=np.int64)
+            candidatas[par[0]] = par[1]
+            reuse = (anterior.df, anterior.row_hash.to_numpy(), candidatas, colunas)
+        # a versão publicada é a do conteúdo efetivamente preparado
+        lido = RowHasher()
+        lidos = []
+
+        def on_chunk(raw):
+            lido.update(raw)
+            lidos.append(_deep_bytes(raw))
+            ROWS_PARSED.inc(len(raw))
+
+        with PREPARE_SECONDS.time(modo="blocos-incremental" if reaproveita else "blocos"):
+            df, memoria = prepare_chunks(self._loader(), on_chunk=on_chunk, reuse=reuse)
+        version = lido.version()
+        if anterior is not None and anterior.version == version:
+            return anterior
+        hashes = lido.row_hashes()
+        mudancas = None
+        if reaproveita and lido.columns == colunas:
+            mudancas = build_changeset(
+                anterior.version, anterior.row_hash, hashes, anterior.df, df, colunas
+            )
+            log.info(
+                "Versão %s (blocos): %d linhas, %d novas, %d modificadas, %d removidas",
+                version, len(df), len(mudancas.novos), len(mudancas.modificados), len(mudancas.removidos),
+            )
+        base = (version, len(df))
+        if memoria is None:
+            # linhas reaproveitadas não passam pelos tipos genéricos
+            memoria = refresh_memory_report(anterior.memory, df)
+            base = (anterior.memory_from, anterior.memory_rows)
+        return DatasetVersion(
+            version=version,
+            df=df,
+            fetched_at=datetime.now(TZ),
+            memory=memoria,
+            memory_from=base[0],
+            memory_rows=base[1],
+            raw_bytes=sum(lidos),
+            row_hash=hashes,
+            source_columns=lido.columns or (),
+            changes=mudancas,
+        )
+
+    def _build_version(self, raw, version, anterior):
+        hashes = row_hashes(raw)
+        colunas = tuple(raw.columns)
+        if anterior is None or anterior.row_hash is None or anterior.source_columns != colunas:
+            ini = time.perf_counter()
+            preparado = prepare_dataset(raw, compact=False)
+            df = compact_dataset(preparado)
+            PREPARE_SECONDS.observe(time.perf_counter() - ini, modo="completo")
+            memoria = memory_report(preparado, df)
+            base = (version, len(df))
+            del preparado
+            mudancas = None
+        else:
+            # só as linhas novas/modificadas passam de novo pelo preparo; o lado
+            # "antes" do relatório de memória é o da última preparação completa
+            par = match_rows(anterior.row_hash, hashes)
+            with PREPARE_SECONDS.time(modo="incremental"):
+                df = prepare_incremental(anterior.df, raw, par[0], par[1])
+            memoria = refresh_memory_report(anterior.memory, df)
+            base = (anterior.memory_from, anterior.memory_rows)
+            mudancas = build_changeset(
+                anterior.version, anterior.row_hash, hashes, anterior.df, df, colunas, match=par
+            )
+            log.info(
+                "Versão %s: %d linhas reaproveitadas, %d novas, %d modificadas, %d removidas",
+                version, len(par[0]), len(par[4]), len(par[2]), len(par[5]),
+            )
+        return DatasetVersion(
+            version=version,
+            df=df,
+            fetched_at=datetime.now(TZ),
+            memory=memoria,
+            memory_from=base[0],
+            memory_rows=base[1],
+            raw_bytes=_deep_bytes(raw),
+            row_hash=hashes,
+            source_columns=colunas,
+            changes=mudancas,
+        )
+
+    def request_refresh(self, timeout: float = 30.0) -> bool:
+        """Acorda o worker e espera a próxima verificação terminar."""
+        with self._cond:
+            alvo = self._checks + 1
+            self._wake.set()
+            return self._cond.wait_for(lambda: self._checks >= alvo, timeout=timeout)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="viveiros-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                log.exception("Falha ao atualizar os dados da planilha")
@@ -0,0 +1,180 @@
+"""Exportação das unidades filtradas em CSV, Parquet, GeoJSON e XLSX.
+
+As linhas saem do dataset compartilhado em blocos de CHUNK_ROWS posições,
+direto para um arquivo temporário (em memória até SPOOL_MAX_BYTES, depois em
+disco): nenhum formato monta um DataFrame com o recorte filtrado inteiro. O
+arquivo pronto é entregue em bytes, que é o que o st.download_button guarda.
+"""
+import io
+import json
+import math
+import tempfile
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+from photos import FOTO_COL, has_photos, photo_links
+
+CHUNK_ROWS = 5000
+SPOOL_MAX_BYTES = 4 * 1024**2
+
+# colunas exportadas (na ordem) e nomes de saída das auxiliares
+EXPORT_COLS = [
+    "CÓDIGO", "Nome", "Ocorrências",
+    "Nº Viveiros total", "Atual Viveiros Total", "diff_viv_total",
+    "Nº Viveiros cheio", "Atual Viveiros cheio", "diff_viv_cheio",
+    "Área (ha).1", "Atual Área (ha).1", "diff_area",
+    "Prof. Média  (m)", "Atual Profun.", "diff_prof",
+    "Tipo Divergência",
+    "Data Filtro", "Ano_filtro", "Mes_filtro",
+    "_lat_wgs84", "_lon_wgs84", "_geo_status",
+    "Link Foto",
+]
+EXPORT_NAMES = {
+    "_lat_wgs84": "Latitude",
+    "_lon_wgs84": "Longitude",
+    "_geo_status": "Situação da coordenada",
+    "Ano_filtro": "Ano",
+    "Mes_filtro": "Mês",
+}
+
+FORMATOS = {
+    "CSV": ("csv", "text/csv"),
+    "XLSX": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "GeoJSON": ("geojson", "application/geo+json"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+def export_columns(df: pd.DataFrame):
+    return [c for c in EXPORT_COLS if c in df.columns or (c == FOTO_COL and has_photos(df))]
+
+def _frame(df: pd.DataFrame, pos: np.ndarray) -> pd.DataFrame:
+    """Linhas pos com as colunas exportadas (link da foto remontado do ID)."""
+    cols = export_columns(df)
+    bloco = df.iloc[pos, [df.columns.get_loc(c) for c in cols if c in df.columns]]
+    if FOTO_COL in cols and FOTO_COL not in df.columns:
+        bloco = bloco.assign(**{FOTO_COL: photo_links(df, pos)})
+    return bloco[cols].rename(columns=EXPORT_NAMES)
+
+def iter_chunks(df: pd.DataFrame, sel: np.ndarray, chunk_rows: int = CHUNK_ROWS):
+    """Blocos (já com os nomes de saída) das linhas em sel."""
+    for ini in range(0, len(sel), chunk_rows):
+        yield _frame(df, sel[ini:ini + chunk_rows])
+
+def _spool():
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+
+def _plain(v):
+    """Valor Python simples: ausentes viram None e escalares numpy, nativos."""
+    if v is None or v is pd.NA or v is pd.NaT:
+        return None
+    if isinstance(v, (float, np.floating)):
+        return None if math.isnan(v) else float(v)
+    if isinstance(v, np.integer):
+        return int(v)
+    if isinstance(v, np.bool_):
+        return bool(v)
+    return v
+
+def _json_value(v):
+    v = _plain(v)
+    return v.isoformat() if isinstance(v, (datetime, date)) else v
+
+def _xlsx_value(v):
+    v = _plain(v)
+    # o Excel não guarda fuso: datas vão no horário local em que foram lidas
+    if isinstance(v, datetime) and v.tzinfo is not None:
+        return v.replace(tzinfo=None)
+    return v
+
+# =============================
+# Escritores
+# =============================
+def write_csv(df: pd.DataFrame, sel: np.ndarray, out):
+    texto = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    primeiro = True
+    for bloco in iter_chunks(df, sel):
+        bloco.to_csv(texto, header=primeiro, index=False)
+        primeiro = False
+    if primeiro:
+        _frame(df, sel[:0]).to_csv(texto, index=False)
+    texto.flush()
+    texto.detach()
+
+def _arrow_schema(df: pd.DataFrame) -> pa.Schema:
+    campos = []
+    vazio = _frame(df, np.empty(0, dtype=np.int64))
+    for c in vazio.columns:
+        s = vazio[c]
+        if s.dtype == object:
+            s = s.astype("string")
+        t = pa.Array.from_pandas(s).type
+        if pa.types.is_dictionary(t):
+            t = t.value_type
+        if pa.types.is_large_string(t) or pa.types.is_null(t):
+            t = pa.string()
+        campos.append(pa.field(c, t))
+    return pa.schema(campos)
+
+def write_parquet(df: pd.DataFrame, sel: np.ndarray, out):
+    schema = _arrow_schema(df)
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        for bloco in iter_chunks(df, sel):
+            colunas = []
+            for campo in schema:
+                s = bloco[campo.name]
+                if s.dtype == object:
+                    s = s.astype("string")
+                colunas.append(pa.Array.from_pandas(s).cast(campo.type))
+            writer.write_table(pa.Table.from_arrays(colunas, schema=schema))
+
+def write_geojson(df: pd.DataFrame, sel: np.ndarray, out):
+    out.write(b'{"type": "FeatureCollection", "features": [\n')
+    primeiro = True
+    for bloco in iter_chunks(df, sel):
+        lat = bloco["Latitude"].to_numpy(dtype=float) if "Latitude" in bloco else None
+        lon = bloco["Longitude"].to_numpy(dtype=float) if "Longitude" in bloco else None
+        props_cols = [c for c in bloco.columns if c not in ("Latitude", "Longitude")]
+        valores = bloco[props_cols].to_numpy(dtype=object)
+        linhas = []
+        for i, row in enumerate(valores):
+            geom = None
+            if lat is not None and np.isfinite(lat[i]) and np.isfinite(lon[i]):
+                geom = {"type": "Point", "coordinates": [float(lon[i]), float(lat[i])]}
+            feature = {
+                "type": "Feature",
+                "geometry": geom,
+                "properties": {c: _json_value(v) for c, v in zip(props_cols, row)},
+            }
+            linhas.append(("" if primeiro else ",\n") + json.dumps(feature, ensure_ascii=False))
+            primeiro = False
+        out.write("".join(linhas).encode("utf-8"))
+    out.write(b"\n]}\n")
+
+def write_xlsx(df: pd.DataFrame, sel: np.ndarray, out):
+    # modo write_only grava as linhas em sequência, sem manter a planilha em memória
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Unidades")
+    ws.append([EXPORT_NAMES.get(c, c) for c in export_columns(df)])
+    for bloco in iter_chunks(df, sel):
+        for row in bloco.to_numpy(dtype=object):
+            ws.append([_xlsx_value(v) for v in row])
+    wb.save(out)
+
+WRITERS = {
+    "CSV": write_csv,
+    "XLSX": write_xlsx,
+    "GeoJSON": write_geojson,
+    "Parquet": write_parquet,
+}
+
+def export_filtered(df: pd.DataFrame, sel: np.ndarray, formato: str) -> bytes:
+    """Conteúdo do arquivo com as linhas de sel no formato pedido."""
+    with _spool() as out:
+        WRITERS[formato](df, sel, out)
+        out.seek(0)
+        return out.read()
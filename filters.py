@@ -0,0 +1,175 @@
+"""Estado dos filtros e cache dos resultados filtrados.
+
+O estado dos filtros é normalizado em uma chave canônica (seleções
+ordenadas, busca em minúsculas), que também vai para os parâmetros da URL.
+Para cada (versão do dataset, chave) o resultado — posições selecionadas,
+KPIs e posições com divergência — fica em um cache LRU compartilhado entre as
+sessões, limitado pelo total de bytes guardados.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from metrics import REGISTRY
+from pipeline import alert_positions, filter_positions
+from ranking import divergence_scores
+
+# =============================
+# Estado canônico dos filtros
+# =============================
+@dataclass(frozen=True)
+class FilterState:
+    anos: tuple = ()
+    meses: tuple = ()
+    ocorrencias: tuple = ()
+    busca: str = ""
+
+    @classmethod
+    def normalized(cls, anos=None, meses=None, ocorrencias=None, busca=""):
+        return cls(
+            anos=tuple(sorted({int(a) for a in anos or ()})),
+            meses=tuple(sorted({str(m) for m in meses or ()})),
+            ocorrencias=tuple(sorted({str(o) for o in ocorrencias or ()})),
+            busca=(busca or "").strip().lower(),
+        )
+
+    def to_query_params(self) -> dict:
+        params = {}
+        if self.anos:
+            params["ano"] = ",".join(map(str, self.anos))
+        if self.meses:
+            params["mes"] = ",".join(self.meses)
+        if self.ocorrencias:
+            params["ocorr"] = "|".join(self.ocorrencias)
+        if self.busca:
+            params["q"] = self.busca
+        return params
+
+    @classmethod
+    def from_query_params(cls, params) -> "FilterState":
+        def partes(nome, sep):
+            v = params.get(nome) or ""
+            return [p for p in v.split(sep) if p]
+        anos = []
+        for a in partes("ano", ","):
+            try:
+                anos.append(int(a))
+            except ValueError:
+                pass
+        return cls.normalized(
+            anos=anos,
+            meses=partes("mes", ","),
+            ocorrencias=partes("ocorr", "|"),
+            busca=params.get("q") or "",
+        )
+
+# =============================
+# Resultado de um filtro
+# =============================
+KPI_COLS = {
+    "viveiros_total": "Atual Viveiros Total",
+    "viveiros_cheio": "Atual Viveiros cheio",
+    "area": "Atual Área (ha).1",
+}
+
+def compute_kpis(df: pd.DataFrame, sel: np.ndarray) -> dict:
+    kpis = {"unidades": int(len(sel))}
+    for nome, col in KPI_COLS.items():
+        kpis[nome] = (
+            float(np.nansum(df[col].to_numpy(dtype=float)[sel])) if col in df.columns else 0.0
+        )
+    return kpis
+
+@dataclass(frozen=True)
+class FilterResult:
+    sel: np.ndarray
+    sel_alerta: np.ndarray
+    kpis: dict = field(default_factory=dict)
+    scores: np.ndarray = None  # pontuação de cada posição de sel_alerta (ranking.py)
+
+    @property
+    def nbytes(self) -> int:
+        extra = self.scores.nbytes if self.scores is not None else 0
+        return self.sel.nbytes + self.sel_alerta.nbytes + extra + sys.getsizeof(self.kpis)
+
+def compute_filter_result(df: pd.DataFrame, state: FilterState, escalas: dict = None) -> FilterResult:
+    sel = filter_positions(
+        df,
+        anos=state.anos,
+        meses=state.meses,
+        ocorrencias=state.ocorrencias,
+        busca=state.busca,
+    )
+    sel.setflags(write=False)
+    sel_alerta = alert_positions(df, sel)
+    sel_alerta.setflags(write=False)
+    scores = divergence_scores(df, sel_alerta, escalas)
+    scores.setflags(write=False)
+    return FilterResult(sel=sel, sel_alerta=sel_alerta, kpis=compute_kpis(df, sel), scores=scores)
+
+# =============================
+# Cache LRU
+# =============================
+CACHE_REQUESTS = REGISTRY.counter(
+    "viveiros_filter_cache_requests_total", "Consultas ao cache de filtros, por resultado.", ["resultado"]
+)
+CACHE_BYTES = REGISTRY.gauge("viveiros_filter_cache_bytes", "Bytes guardados no cache de filtros.")
+CACHE_ENTRIES = REGISTRY.gauge("viveiros_filter_cache_entries", "Combinações no cache de filtros.")
+FILTER_SECONDS = REGISTRY.histogram(
+    "viveiros_filter_seconds", "Duração do cálculo de um filtro fora do cache."
+)
+
+class FilterResultCache:
+    """LRU de FilterResult por (versão, FilterState), limitado em bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, version: str, state: FilterState, df: pd.DataFrame,
+                       escalas: dict = None) -> FilterResult:
+        chave = (version, state)
+        with self._lock:
+            res = self._itens.get(chave)
+            if res is not None:
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                CACHE_REQUESTS.inc(resultado="acerto")
+                return res
+            self.misses += 1
+        CACHE_REQUESTS.inc(resultado="falta")
+
+        ini = time.perf_counter()
+        res = compute_filter_result(df, state, escalas)
+        FILTER_SECONDS.observe(time.perf_counter() - ini)
+
+        with self._lock:
+            if chave not in self._itens:
+                self._itens[chave] = res
+                self.bytes += res.nbytes
+                while self.bytes > self.max_bytes and len(self._itens) > 1:
+                    _, antigo = self._itens.popitem(last=False)
+                    self.bytes -= antigo.nbytes
+                CACHE_BYTES.set(self.bytes)
+                CACHE_ENTRIES.set(len(self._itens))
+        return res
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._itens),
+                "bytes": self.bytes,
+                "acertos": self.hits,
+                "faltas": self.misses,
+                "taxa_acerto": self.hits / total if total else 0.0,
+            }
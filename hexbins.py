@@ -0,0 +1,162 @@
+"""Agregação das unidades em hexágonos, para a visão regional do mapa.
+
+As coordenadas limpas (_lat_wgs84/_lon_wgs84) vão para uma projeção
+equiretangular em torno da latitude mediana do dataset e cada unidade
+recebe o hexágono (coordenadas axiais q, r; vértice para cima) de cada
+resolução, tudo vetorizado. A grade é montada uma vez por versão; para cada
+filtro os totais por célula saem de bincount sobre as posições selecionadas.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from filters import KPI_COLS
+
+# tamanho do hexágono: distância do centro a um vértice
+HEX_RESOLUCOES = {
+    "Regional (25 km)": 25_000.0,
+    "Municipal (10 km)": 10_000.0,
+    "Local (2 km)": 2_000.0,
+}
+HEX_RESOLUCAO_PADRAO = "Municipal (10 km)"
+
+# colunas de aggregate_hex que podem colorir os hexágonos
+HEX_METRICAS = ["Unidades", "Viveiros (atual)", "Área (ha) atual", "Taxa de divergência"]
+# do mais claro ao mais escuro, uma cor por classe
+HEX_CORES = ["#eff3ff", "#bdd7e7", "#6baed6", "#3182bd", "#08519c"]
+
+_M_POR_GRAU_LAT = 110_574.0
+_M_POR_GRAU_LON = 111_320.0
+_RAIZ3 = math.sqrt(3.0)
+
+# =============================
+# Grade por versão
+# =============================
+def _projeta(lat, lon, lat0: float):
+    return lon * _M_POR_GRAU_LON * math.cos(math.radians(lat0)), lat * _M_POR_GRAU_LAT
+
+def _desprojeta(x, y, lat0: float):
+    return y / _M_POR_GRAU_LAT, x / (_M_POR_GRAU_LON * math.cos(math.radians(lat0)))
+
+def hex_axial(x: np.ndarray, y: np.ndarray, tamanho: float):
+    """Hexágono (q, r) de cada ponto projetado, por arredondamento cúbico."""
+    qf = (_RAIZ3 / 3.0 * x - y / 3.0) / tamanho
+    rf = (2.0 / 3.0 * y) / tamanho
+    sf = -qf - rf
+    q, r, s = np.rint(qf), np.rint(rf), np.rint(sf)
+    dq, dr, ds = np.abs(q - qf), np.abs(r - rf), np.abs(s - sf)
+    ajusta_q = (dq > dr) & (dq > ds)
+    ajusta_r = ~ajusta_q & (dr > ds)
+    q = np.where(ajusta_q, -r - s, q)
+    r = np.where(ajusta_r, -q - s, r)
+    return q.astype(np.int64), r.astype(np.int64)
+
+def hex_center(q, r, tamanho: float):
+    return tamanho * _RAIZ3 * (q + r / 2.0), tamanho * 1.5 * r
+
+def build_hex_grid(lat: np.ndarray, lon: np.ndarray, resolucoes: dict = HEX_RESOLUCOES) -> dict:
+    """Hexágono de cada linha (-1 sem coordenada) em todas as resoluções."""
+    n = len(lat)
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    lat0 = float(np.median(lat[valid])) if valid.any() else 0.0
+    x, y = _projeta(lat[valid], lon[valid], lat0)
+    pos_validas = np.flatnonzero(valid)
+
+    grade = {"lat0": lat0, "tamanho": dict(resolucoes), "cell": {}, "q": {}, "r": {}}
+    for nome, tamanho in resolucoes.items():
+        q, r = hex_axial(x, y, tamanho)
+        chaves, inv = np.unique(np.column_stack([q, r]), axis=0, return_inverse=True)
+        cell = np.full(n, -1, dtype=np.int64)
+        cell[pos_validas] = inv.ravel()
+        grade["cell"][nome] = cell
+        grade["q"][nome] = chaves[:, 0] if len(chaves) else np.empty(0, dtype=np.int64)
+        grade["r"][nome] = chaves[:, 1] if len(chaves) else np.empty(0, dtype=np.int64)
+    return grade
+
+# =============================
+# Estatísticas por célula
+# =============================
+def aggregate_hex(grade: dict, nome: str, df: pd.DataFrame, sel: np.ndarray,
+                  sel_alerta: np.ndarray) -> pd.DataFrame:
+    """Contagem, somas e taxa de divergência de cada hexágono com unidades em sel."""
+    ncells = len(grade["q"][nome])
+    inv = grade["cell"][nome][sel]
+    ok = inv >= 0
+    inv, pos = inv[ok], np.asarray(sel)[ok]
+
+    cont = np.bincount(inv, minlength=ncells)
+    keep = np.flatnonzero(cont)
+
+    def soma(col):
+        if col not in df.columns:
+            return np.zeros(len(keep))
+        v = np.nan_to_num(df[col].to_numpy(dtype=float, na_value=np.nan)[pos])
+        return np.bincount(inv, weights=v, minlength=ncells)[keep]
+
+    divergente = np.zeros(len(df), dtype=bool)
+    divergente[sel_alerta] = True
+    n_div = np.bincount(inv, weights=divergente[pos], minlength=ncells)[keep]
+
+    q, r = grade["q"][nome][keep], grade["r"][nome][keep]
+    lat, lon = _desprojeta(*hex_center(q, r, grade["tamanho"][nome]), grade["lat0"])
+    return pd.DataFrame({
+        "Hexágono": [f"{a},{b}" for a, b in zip(q, r)],
+        "Latitude": lat,
+        "Longitude": lon,
+        "Unidades": cont[keep],
+        "Viveiros (atual)": soma(KPI_COLS["viveiros_total"]),
+        "Viveiros cheios (atual)": soma(KPI_COLS["viveiros_cheio"]),
+        "Área (ha) atual": soma(KPI_COLS["area"]),
+        "Divergentes": n_div.astype(np.int64),
+        "Taxa de divergência": n_div / cont[keep],
+        "_q": q,
+        "_r": r,
+    })
+
+def color_classes(valores: np.ndarray, ncores: int = len(HEX_CORES)):
+    """Limites por quantis e a classe (0..ncores-1) de cada valor."""
+    v = np.asarray(valores, dtype=float)
+    if not len(v):
+        return np.zeros(2), np.empty(0, dtype=np.int64)
+    limites = np.unique(np.quantile(v, np.linspace(0, 1, ncores + 1)))
+    if len(limites) < 2:
+        limites = np.array([limites[0], limites[0] + 1.0])
+    classe = np.clip(np.searchsorted(limites, v, side="right") - 1, 0, len(limites) - 2)
+    return limites, classe
+
+def hex_geojson(agg: pd.DataFrame, grade: dict, nome: str, metrica: str):
+    """FeatureCollection dos hexágonos (cor da classe de metrica em _cor),
+    com os limites e as cores das classes para a legenda."""
+    tamanho, lat0 = grade["tamanho"][nome], grade["lat0"]
+    limites, classe = color_classes(agg[metrica].to_numpy())
+    # índice das cores espalhado pelas classes existentes
+    cores = [HEX_CORES[round(i * (len(HEX_CORES) - 1) / max(len(limites) - 2, 1))]
+             for i in range(len(limites) - 1)]
+
+    angulos = np.radians(30.0 + 60.0 * np.arange(7))
+    dx, dy = tamanho * np.cos(angulos), tamanho * np.sin(angulos)
+    cx, cy = hex_center(agg["_q"].to_numpy(), agg["_r"].to_numpy(), tamanho)
+    vlat, vlon = _desprojeta(cx[:, None] + dx, cy[:, None] + dy, lat0)
+
+    props = agg.drop(columns=["_q", "_r", "Latitude", "Longitude"])
+    features = []
+    for i, linha in enumerate(props.itertuples(index=False)):
+        p = dict(zip(props.columns, linha))
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [np.column_stack([vlon[i], vlat[i]]).round(6).tolist()],
+            },
+            "properties": {
+                "Hexágono": p["Hexágono"],
+                "Unidades": int(p["Unidades"]),
+                "Viveiros (atual)": round(float(p["Viveiros (atual)"]), 1),
+                "Área (ha) atual": round(float(p["Área (ha) atual"]), 2),
+                "Divergentes": int(p["Divergentes"]),
+                "Taxa de divergência": f"{p['Taxa de divergência']:.0%}",
+                "_cor": cores[int(classe[i])],
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}, limites, cores
@@ -0,0 +1,373 @@
+"""Teste de carga do painel com várias sessões simultâneas.
+
+Roda o app.py sem navegador pela API de testes do Streamlit (AppTest), com
+um servidor HTTP local no lugar da exportação CSV do Google Sheets e das
+miniaturas do Drive. Cada sessão repete um roteiro de interações realistas
+(ligar/desligar o filtro de ano, digitar uma busca, clicar no mapa, trocar o
+tipo de divergência) e o relatório traz:
+
+- latência de cada rerun (p50/p95/máx, geral e por interação);
+- pico de memória residente (RSS) do processo;
+- tempo por etapa (carga, preparo, filtros, anomalias, mapa, gráficos,
+  tabelas), somado entre as sessões.
+
+As sessões dividem o mesmo processo, como num servidor real: o dataset, o
+cache de filtros e os caches do Streamlit são compartilhados.
+
+O componente do mapa não responde a cliques no AppTest; o clique é simulado
+devolvendo last_object_clicked (como o st_folium faria) a partir de
+st.session_state["_loadtest_clique"].
+
+Uso:
+    python loadtest.py --sessoes 8 --rodadas 5
+    python loadtest.py --linhas 20000 --sessoes 16 --json resultado.json
+    python loadtest.py --csv planilha.csv
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+APP_PATH = Path(__file__).with_name("app.py")
+CLIQUE_KEY = "_loadtest_clique"
+
+OCORRENCIAS = ["Regular", "Abandonado", "Ampliado", "Sem acesso"]
+INTERACOES = ["ano", "busca", "mapa", "divergencia"]
+
+# =============================
+# Dados e servidor local
+# =============================
+def synthetic_sheet(n: int, seed: int = 0) -> pd.DataFrame:
+    """Planilha sintética no formato da exportação (texto, decimais com vírgula)."""
+    rng = np.random.default_rng(seed)
+
+    def decimal(v, casas=2):
+        return [f"{x:.{casas}f}".replace(".", ",") for x in v]
+
+    ano = rng.integers(2023, 2026, n)
+    mes = rng.integers(1, 13, n)
+    lat = -5.0 + rng.uniform(-1.5, 1.5, n)
+    lon = -39.5 + rng.uniform(-1.5, 1.5, n)
+    return pd.DataFrame({
+        "CÓDIGO": [f"V{i:06d}" for i in range(n)],
+        "Nome": [f"Produtor {i % 997}" for i in range(n)],
+        "Ocorrências": rng.choice(OCORRENCIAS, n),
+        "Nº Viveiros total": rng.integers(1, 11, n).astype(str),
+        "Atual Viveiros Total": rng.integers(1, 11, n).astype(str),
+        "Nº Viveiros cheio": rng.integers(0, 6, n).astype(str),
+        "Atual Viveiros cheio": rng.integers(0, 6, n).astype(str),
+        "Área (ha).1": decimal(rng.uniform(0.1, 3, n)),
+        "Atual Área (ha).1": decimal(rng.uniform(0.1, 3, n)),
+        "Prof. Média  (m)": "1,5",
+        "Atual Profun.": rng.choice(["1,5", "1,2"], n),
+        "Lati": decimal(lat, 6),
+        "Long": decimal(lon, 6),
+        "Link Foto": [f"https://drive.google.com/file/d/loadtest{i:08d}/view" for i in range(n)],
+        "Data": [f"{a}/{m:02d}/04 11:22:03.951+00" for a, m in zip(ano, mes)],
+        "Data Filtro": "",
+    })
+
+class _Handler(BaseHTTPRequestHandler):
+    """Responde a exportação CSV da planilha e, para o resto, uma imagem mínima."""
+
+    csv_bytes = b""
+
+    def do_GET(self):
+        if "/export" in self.path:
+            corpo, tipo = self.csv_bytes, "text/csv; charset=utf-8"
+        else:
+            corpo, tipo = b"\xff\xd8\xff\xd9", "image/jpeg"
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, *args):
+        pass
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def start_server(csv_bytes: bytes) -> ThreadingHTTPServer:
+    handler = type("Handler", (_Handler,), {"csv_bytes": csv_bytes})
+    server = _Server(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, name="loadtest-http", daemon=True).start()
+    return server
+
+# =============================
+# Tempo por etapa
+# =============================
+class StageTimer:
+    """Acumula a duração das chamadas de cada etapa, de todas as threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.duracoes = defaultdict(list)
+
+    def wrap(self, etapa: str, fn):
+        @wraps(fn)
+        def medido(*args, **kwargs):
+            ini = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - ini
+                with self._lock:
+                    self.duracoes[etapa].append(dt)
+        return medido
+
+    def patch(self, modulo, nome: str, etapa: str):
+        setattr(modulo, nome, self.wrap(etapa, getattr(modulo, nome)))
+
+def instrument(timer: StageTimer):
+    """Mede as etapas do painel trocando as funções pelos nomes que o app usa.
+
+    Precisa rodar depois que as variáveis de ambiente foram definidas (os
+    módulos leem a configuração ao serem importados).
+    """
+    import streamlit as st
+    import streamlit_folium
+
+    import anomalies
+    import charts
+    import dataset_store
+    import filters
+    import sources
+
+    timer.patch(sources, "load_from_gsheet_csv", "carga")
+    for nome in ("prepare_dataset", "prepare_incremental", "prepare_chunks"):
+        timer.patch(dataset_store, nome, "preparo")
+    timer.patch(filters, "compute_filter_result", "filtros")
+    timer.patch(anomalies, "detect_anomalies", "anomalias")
+    # gráficos de ocorrências: montagem da especificação (cache por versão e
+    # filtro) e envio; altair_chart sobra para a tendência do histórico
+    timer.patch(charts.ChartSpecCache, "get_or_build", "graficos_spec")
+    timer.patch(st, "vega_lite_chart", "graficos")
+    timer.patch(st, "altair_chart", "graficos")
+    timer.patch(st, "dataframe", "tabelas")
+
+    st_folium = streamlit_folium.st_folium
+
+    def st_folium_com_clique(*args, **kwargs):
+        dados = st_folium(*args, **kwargs)
+        clique = st.session_state.get(CLIQUE_KEY)
+        if clique:
+            dados = dict(dados or {})
+            dados["last_object_clicked"] = clique
+            dados["last_clicked"] = clique
+        return dados
+
+    streamlit_folium.st_folium = timer.wrap("mapa", st_folium_com_clique)
+
+# =============================
+# Sessões
+# =============================
+def _widget(lista, trecho: str):
+    for w in lista:
+        if trecho in w.label:
+            return w
+    return None
+
+def interact(at, acao: str, rng: random.Random, coords: np.ndarray) -> bool:
+    """Aplica uma interação na sessão; False se o widget não está na tela."""
+    if acao == "ano":
+        w = _widget(at.toggle, "Filtrar Ano")
+        if w is None:
+            return False
+        w.set_value(not w.value)
+    elif acao == "busca":
+        w = _widget(at.text_input, "Buscar")
+        if w is None:
+            return False
+        w.input("" if w.value else f"Produtor {rng.randrange(100)}")
+    elif acao == "mapa":
+        lat, lon = coords[rng.randrange(len(coords))]
+        at.session_state[CLIQUE_KEY] = {"lat": float(lat), "lng": float(lon)}
+    elif acao == "divergencia":
+        w = _widget(at.radio, "Filtrar divergências")
+        if w is None:
+            return False
+        w.set_value(rng.choice([o for o in w.options if o != w.value]))
+    return True
+
+def run_session(n: int, rodadas: int, coords: np.ndarray, timeout: float, seed: int) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed + n)
+    medidas = defaultdict(list)
+    erros = []
+
+    def rerun(acao):
+        ini = time.perf_counter()
+        at.run(timeout=timeout)
+        medidas[acao].append(time.perf_counter() - ini)
+        erros.extend(f"sessão {n}, {acao}: {e.message}" for e in at.exception)
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=timeout)
+    rerun("inicial")
+    for _ in range(rodadas):
+        for acao in rng.sample(INTERACOES, len(INTERACOES)):
+            if interact(at, acao, rng, coords):
+                rerun(acao)
+    return {"medidas": medidas, "erros": erros}
+
+def run_load(sessoes: int, rodadas: int, coords: np.ndarray, timeout: float, seed: int):
+    resultados = [None] * sessoes
+
+    def alvo(i):
+        try:
+            resultados[i] = run_session(i, rodadas, coords, timeout, seed)
+        except Exception as e:
+            resultados[i] = {"medidas": {}, "erros": [f"sessão {i}: {e!r}"]}
+
+    threads = [
+        threading.Thread(target=alvo, args=(i,), name=f"loadtest-sessao-{i}")
+        for i in range(sessoes)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return resultados
+
+# =============================
+# Relatório
+# =============================
+def _percentis(valores) -> dict:
+    v = np.asarray(valores, dtype=float) * 1000
+    if not len(v):
+        return {"n": 0}
+    return {
+        "n": int(len(v)),
+        "p50_ms": float(np.percentile(v, 50)),
+        "p95_ms": float(np.percentile(v, 95)),
+        "max_ms": float(v.max()),
+        "total_s": float(v.sum() / 1000),
+    }
+
+def peak_rss_mb() -> float:
+    # ru_maxrss vem em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def summarize(resultados, timer: StageTimer, duracao_s: float, args) -> dict:
+    por_acao = defaultdict(list)
+    erros = []
+    for r in resultados:
+        for acao, v in r["medidas"].items():
+            por_acao[acao].extend(v)
+        erros.extend(r["erros"])
+    reruns = [x for acao, v in por_acao.items() if acao != "inicial" for x in v]
+    return {
+        "sessoes": args.sessoes,
+        "rodadas": args.rodadas,
+        "linhas": args.linhas,
+        "duracao_s": duracao_s,
+        "reruns_por_s": len(reruns) / duracao_s if duracao_s else 0.0,
+        "rerun": _percentis(reruns),
+        "por_interacao": {acao: _percentis(v) for acao, v in sorted(por_acao.items())},
+        "etapas": {etapa: _percentis(v) for etapa, v in sorted(timer.duracoes.items())},
+        "pico_rss_mb": peak_rss_mb(),
+        "erros": erros,
+    }
+
+def print_summary(res: dict):
+    def linha(nome, p):
+        if not p["n"]:
+            return f"  {nome:<14} —"
+        return (
+            f"  {nome:<14} n={p['n']:<5} p50={p['p50_ms']:8.1f} ms  p95={p['p95_ms']:8.1f} ms  "
+            f"máx={p['max_ms']:8.1f} ms  total={p['total_s']:7.2f} s"
+        )
+
+    print(
+        f"{res['sessoes']} sessões × {res['rodadas']} rodadas, {res['linhas']} linhas: "
+        f"{res['duracao_s']:.1f} s, {res['reruns_por_s']:.2f} reruns/s"
+    )
+    print("Reruns (após a carga inicial):")
+    print(linha("todos", res["rerun"]))
+    print("Por interação:")
+    for acao, p in res["por_interacao"].items():
+        print(linha(acao, p))
+    print("Por etapa (somado entre as sessões):")
+    for etapa, p in res["etapas"].items():
+        print(linha(etapa, p))
+    print(f"Pico de RSS: {res['pico_rss_mb']:.0f} MB")
+    if res["erros"]:
+        print(f"{len(res['erros'])} erros:")
+        for e in res["erros"][:20]:
+            print(f"  {e}")
+
+# =============================
+# Execução
+# =============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga do painel com sessões simultâneas.")
+    parser.add_argument("--sessoes", type=int, default=4, help="sessões simultâneas")
+    parser.add_argument("--rodadas", type=int, default=3, help="repetições do roteiro por sessão")
+    parser.add_argument("--linhas", type=int, default=5000, help="linhas da planilha sintética")
+    parser.add_argument("--csv", help="serve este CSV no lugar da planilha sintética")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300.0, help="limite por rerun (s)")
+    parser.add_argument("--json", help="grava o resultado neste arquivo")
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        csv_bytes = Path(args.csv).read_bytes()
+        planilha = pd.read_csv(args.csv)
+        args.linhas = len(planilha)
+    else:
+        planilha = synthetic_sheet(args.linhas, args.seed)
+        csv_bytes = planilha.to_csv(index=False).encode("utf-8")
+
+    # alvos dos cliques no mapa: coordenadas da planilha que parecem lat/long
+    coords = np.empty((0, 2))
+    if {"Lati", "Long"} <= set(planilha.columns):
+        coords = np.column_stack([
+            pd.to_numeric(planilha[c].astype(str).str.replace(",", "."), errors="coerce")
+            for c in ("Lati", "Long")
+        ])
+        coords = coords[np.isfinite(coords).all(axis=1) & (np.abs(coords) <= 180).all(axis=1)]
+    if not len(coords):
+        coords = np.array([[-5.0, -39.5]])
+
+    server = start_server(csv_bytes)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    tmp = tempfile.TemporaryDirectory(prefix="viveiros-loadtest-")
+    os.environ.update({
+        "VIVEIROS_FONTE": "gsheets",
+        "VIVEIROS_SHEETS_BASE_URL": base_url,
+        "VIVEIROS_DRIVE_BASE_URL": base_url,
+        "VIVEIROS_SNAPSHOT_DIR": os.path.join(tmp.name, "snapshots"),
+        "VIVEIROS_MAPA_CACHE_DIR": os.path.join(tmp.name, "mapas"),
+    })
+
+    timer = StageTimer()
+    instrument(timer)
+
+    ini = time.perf_counter()
+    resultados = run_load(args.sessoes, args.rodadas, coords, args.timeout, args.seed)
+    duracao = time.perf_counter() - ini
+    server.shutdown()
+
+    res = summarize(resultados, timer, duracao, args)
+    print_summary(res)
+    if args.json:
+        Path(args.json).write_text(json.dumps(res, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.cleanup()
+    return 1 if res["erros"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
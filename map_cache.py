@@ -0,0 +1,174 @@
+"""Mapas pré-renderizados em disco, por versão do dataset e filtro.
+
+O HTML completo do mapa (camadas de fundo, marcadores, anomalias, hexágonos,
+legenda) de cada (versão, FilterState, MapOptions) é gravado comprimido em
+VIVEIROS_MAPA_CACHE_DIR. A atualização em segundo plano renderiza de antemão o
+filtro padrão e os mais usados, e a primeira exibição do mapa numa sessão nova
+vira a leitura de um arquivo. O diretório é limitado em bytes: passando do
+limite, saem os arquivos usados há mais tempo (mtime, renovado a cada leitura).
+"""
+import gzip
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+from anomalies import DIST_PADRAO_M
+from filters import FilterState
+from hexbins import HEX_METRICAS, HEX_RESOLUCAO_PADRAO
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+MAPA_CACHE_DIR = os.environ.get("VIVEIROS_MAPA_CACHE_DIR", "mapas")
+SUFIXO = ".html.gz"
+
+ARTIFACT_REQUESTS = REGISTRY.counter(
+    "viveiros_map_artifact_requests_total", "Consultas aos mapas pré-renderizados, por resultado.",
+    ["resultado"],
+)
+ARTIFACT_BYTES = REGISTRY.gauge("viveiros_map_artifact_bytes", "Bytes dos mapas pré-renderizados em disco.")
+ARTIFACT_FILES = REGISTRY.gauge("viveiros_map_artifact_files", "Mapas pré-renderizados em disco.")
+ARTIFACT_BUILD_SECONDS = REGISTRY.histogram(
+    "viveiros_map_artifact_build_seconds", "Duração da renderização de um mapa para o disco."
+)
+
+# =============================
+# Opções do mapa
+# =============================
+@dataclass(frozen=True)
+class MapOptions:
+    """Controles do painel que mudam o HTML do mapa (padrões = os da tela)."""
+    modo_viewport: bool = False
+    agrupar_zoom: bool = True
+    dist_anomalia: float = DIST_PADRAO_M
+    hex_resolucao: str = HEX_RESOLUCAO_PADRAO
+    hex_metrica: str = HEX_METRICAS[0]
+
+def artifact_key(version: str, filtros: FilterState, opcoes: MapOptions) -> str:
+    """Nome do arquivo: versão legível + hash do filtro e das opções."""
+    h = hashlib.sha256(repr((filtros, opcoes)).encode("utf-8")).hexdigest()[:24]
+    return f"{re.sub(r'[^0-9A-Za-z_.-]', '_', str(version))}-{h}"
+
+# =============================
+# Cache em disco
+# =============================
+class MapArtifactCache:
+    """HTML de mapas em gzip, um arquivo por chave, limitado em bytes."""
+
+    def __init__(self, root=MAPA_CACHE_DIR, max_bytes: int = 256 * 1024**2):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._usos = Counter()
+        self._construindo = set()
+        # {nome: bytes} dos arquivos existentes (o diretório sobrevive ao processo)
+        self._tamanhos = {p.name: p.stat().st_size for p in self.root.glob(f"*{SUFIXO}")}
+        ARTIFACT_BYTES.set_function(lambda: sum(self._tamanhos.values()))
+        ARTIFACT_FILES.set_function(lambda: len(self._tamanhos))
+
+    def _path(self, chave: str) -> Path:
+        return self.root / f"{chave}{SUFIXO}"
+
+    def get(self, chave: str):
+        """HTML guardado para a chave, ou None."""
+        path = self._path(chave)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                html = f.read()
+            os.utime(path)  # leitura renova a posição na ordem de remoção
+        except FileNotFoundError:
+            # removido por outro processo com o mesmo diretório
+            with self._lock:
+                self._tamanhos.pop(path.name, None)
+            ARTIFACT_REQUESTS.inc(resultado="falta")
+            return None
+        except (OSError, EOFError):
+            ARTIFACT_REQUESTS.inc(resultado="falta")
+            return None
+        ARTIFACT_REQUESTS.inc(resultado="acerto")
+        return html
+
+    def put(self, chave: str, html: str):
+        """Grava de forma atômica (temporário + rename) e aplica o limite."""
+        path = self._path(chave)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                f.write(html.encode("utf-8"))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        with self._lock:
+            self._tamanhos[path.name] = path.stat().st_size
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            total = sum(self._tamanhos.values())
+            if total <= self.max_bytes:
+                return
+            def mtime(nome):
+                try:
+                    return (self.root / nome).stat().st_mtime
+                except FileNotFoundError:
+                    return 0.0
+            for nome in sorted(self._tamanhos, key=mtime):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    (self.root / nome).unlink()
+                except FileNotFoundError:
+                    pass
+                total -= self._tamanhos.pop(nome)
+
+    # =============================
+    # Uso e pré-renderização
+    # =============================
+    def record_use(self, filtros: FilterState, opcoes: MapOptions):
+        with self._lock:
+            self._usos[(filtros, opcoes)] += 1
+
+    def most_used(self, n: int) -> list:
+        """Os n pares (FilterState, MapOptions) mais pedidos neste processo."""
+        with self._lock:
+            return [estado for estado, _ in self._usos.most_common(n)]
+
+    def build(self, version: str, estados, construir):
+        """Renderiza e grava os estados que ainda não estão em disco.
+
+        construir(filtros, opcoes) devolve o HTML do mapa. Cada chave é
+        renderizada por uma thread só, mesmo com pedidos simultâneos.
+        """
+        for filtros, opcoes in dict.fromkeys(estados):
+            chave = artifact_key(version, filtros, opcoes)
+            with self._lock:
+                if chave in self._construindo or f"{chave}{SUFIXO}" in self._tamanhos:
+                    continue
+                self._construindo.add(chave)
+            try:
+                ini = time.perf_counter()
+                html = construir(filtros, opcoes)
+                ARTIFACT_BUILD_SECONDS.observe(time.perf_counter() - ini)
+                self.put(chave, html)
+            except Exception:
+                log.exception("Falha ao pré-renderizar o mapa %s", chave)
+            finally:
+                with self._lock:
+                    self._construindo.discard(chave)
+
+    def build_async(self, version: str, estados, construir) -> threading.Thread:
+        t = threading.Thread(
+            target=self.build, args=(version, list(estados), construir),
+            name="viveiros-mapas", daemon=True,
+        )
+        t.start()
+        return t
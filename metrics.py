@@ -0,0 +1,261 @@
+"""Métricas de operação do painel no formato texto do Prometheus.
+
+Contadores, medidores (gauges) e histogramas de latência ficam num registro
+do processo (REGISTRY), alimentado pela carga, preparo, filtros e mapa. A
+exportação é escolhida pela variável VIVEIROS_METRICAS:
+
+    arquivo:/caminho/viveiros.prom   grava o arquivo a cada VIVEIROS_METRICAS_S
+                                     segundos (para o textfile collector)
+    porta:9108                       serve GET /metrics nessa porta (localhost;
+                                     porta:0.0.0.0:9108 para outra interface)
+
+Sem a variável, as métricas são coletadas mas não exportadas.
+"""
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_BYTES = tuple(16 * 1024 * 4**i for i in range(9))  # 16 KB a 1 GB
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(nomes, valores, extra: str = "") -> str:
+    partes = [f'{n}="{_escape(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+def _num(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+# =============================
+# Tipos de métrica
+# =============================
+class _Metric:
+    tipo = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._valores = {}
+        self._fn = None
+
+    def _chave(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: rótulos esperados {self.labelnames}, recebidos {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def value(self, **labels) -> float:
+        chave = self._chave(labels)
+        with self._lock:
+            return self._valores.get(chave, 0.0)
+
+    def set_function(self, fn):
+        """Valor lido na hora da exportação: fn() -> número (sem rótulos)
+        ou {tupla de rótulos: número}."""
+        self._fn = fn
+
+    def _amostras(self):
+        if self._fn is not None:
+            try:
+                v = self._fn()
+            except Exception:
+                log.exception("Falha ao ler a métrica %s", self.name)
+                return []
+            return list(v.items()) if isinstance(v, dict) else [((), v)]
+        with self._lock:
+            return list(self._valores.items())
+
+    def render(self) -> list:
+        linhas = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.tipo}"]
+        for chave, v in self._amostras():
+            linhas.append(f"{self.name}{_labels(self.labelnames, chave)} {_num(v)}")
+        return linhas
+
+class Counter(_Metric):
+    tipo = "counter"
+
+    def inc(self, valor: float = 1.0, **labels):
+        if valor < 0:
+            raise ValueError("Contador só aumenta")
+        chave = self._chave(labels)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0.0) + valor
+
+class Gauge(_Metric):
+    tipo = "gauge"
+
+    def set(self, valor: float, **labels):
+        chave = self._chave(labels)
+        with self._lock:
+            self._valores[chave] = float(valor)
+
+    def inc(self, valor: float = 1.0, **labels):
+        chave = self._chave(labels)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0.0) + valor
+
+class Histogram(_Metric):
+    tipo = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=BUCKETS_SEGUNDOS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor: float, **labels):
+        chave = self._chave(labels)
+        i = bisect_left(self.buckets, valor)
+        with self._lock:
+            contagens, soma = self._valores.get(chave, ([0] * (len(self.buckets) + 1), 0.0))
+            contagens[i] += 1
+            self._valores[chave] = (contagens, soma + valor)
+
+    @contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco em segundos."""
+        ini = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - ini, **labels)
+
+    def render(self) -> list:
+        linhas = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.tipo}"]
+        with self._lock:
+            itens = [(k, (list(c), s)) for k, (c, s) in self._valores.items()]
+        for chave, (contagens, soma) in itens:
+            acumulado = 0
+            for limite, n in zip((*self.buckets, math.inf), contagens):
+                acumulado += n
+                le = 'le="' + _num(limite) + '"'
+                linhas.append(f"{self.name}_bucket{_labels(self.labelnames, chave, le)} {acumulado}")
+            linhas.append(f"{self.name}_sum{_labels(self.labelnames, chave)} {_num(soma)}")
+            linhas.append(f"{self.name}_count{_labels(self.labelnames, chave)} {acumulado}")
+        return linhas
+
+# =============================
+# Registro
+# =============================
+class Registry:
+    """Métricas do processo, por nome. Pedir de novo um nome devolve a mesma
+    métrica (o script do app é reexecutado a cada rerun)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metricas = {}
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            m = self._metricas.get(name)
+            if m is None:
+                m = self._metricas[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(m, cls):
+                raise ValueError(f"Métrica {name} já registrada como {m.tipo}")
+            return m
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames=()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=BUCKETS_SEGUNDOS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for m in metricas:
+            linhas.extend(m.render())
+        return "\n".join(linhas) + "\n"
+
+REGISTRY = Registry()
+
+# =============================
+# Exportação
+# =============================
+def write_textfile(path, registry: Registry = REGISTRY):
+    """Grava as métricas de forma atômica (arquivo temporário + rename)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(registry.render())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _handler(registry: Registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            corpo = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+    return MetricsHandler
+
+def serve(port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _handler(registry))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="viveiros-metricas-http", daemon=True).start()
+    return server
+
+def start_textfile_writer(path, interval_s: float, registry: Registry = REGISTRY) -> threading.Thread:
+    def loop():
+        while True:
+            try:
+                write_textfile(path, registry)
+            except Exception:
+                log.exception("Falha ao gravar as métricas em %s", path)
+            time.sleep(interval_s)
+
+    t = threading.Thread(target=loop, name="viveiros-metricas-arquivo", daemon=True)
+    t.start()
+    return t
+
+def start_exporter(spec: str = None, registry: Registry = REGISTRY):
+    """Inicia a exportação descrita em spec (ou em VIVEIROS_METRICAS).
+
+    Devolve uma descrição do destino, ou None sem exportação configurada.
+    """
+    spec = (spec if spec is not None else os.environ.get("VIVEIROS_METRICAS", "")).strip()
+    if not spec:
+        return None
+    tipo, _, alvo = spec.partition(":")
+    tipo = tipo.lower()
+    if tipo == "arquivo":
+        intervalo = float(os.environ.get("VIVEIROS_METRICAS_S", "15"))
+        start_textfile_writer(alvo, intervalo, registry)
+        return f"arquivo {alvo} (a cada {intervalo:g} s)"
+    if tipo == "porta":
+        host, _, porta = alvo.rpartition(":")
+        server = serve(int(porta), host or "127.0.0.1", registry)
+        return f"http://{server.server_address[0]}:{server.server_address[1]}/metrics"
+    raise ValueError(f"Exportação de métricas desconhecida: {spec}")
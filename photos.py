@@ -0,0 +1,230 @@
+"""Links de fotos do Google Drive: normalização e validação assíncrona.
+
+Os links distintos (por ID de arquivo do Drive) são verificados em paralelo
+com asyncio, limitando as conexões simultâneas e a taxa de requisições por
+host. O resultado fica em cache por ID com validade (TTL), para a galeria
+pular links quebrados sem consultar a rede a cada execução.
+
+A URL base do Drive é configurável (VIVEIROS_DRIVE_BASE_URL), o que permite
+testar contra um servidor HTTP local.
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+DRIVE_BASE_URL = os.environ.get("VIVEIROS_DRIVE_BASE_URL", "https://drive.google.com")
+
+FOTO_OK = "ok"
+FOTO_PRIVADA = "sem permissão"
+FOTO_QUEBRADA = "não encontrada"
+FOTO_INVALIDA = "não é imagem"
+FOTO_SEM_LINK = "sem link"
+FOTO_RUINS = {FOTO_PRIVADA, FOTO_QUEBRADA, FOTO_INVALIDA}
+
+# =============================
+# Links do Drive
+# =============================
+def gdrive_extract_id(url: str):
+    if not isinstance(url, str):
+        return None
+    url = url.strip()
+    m = re.search(r"/d/([a-zA-Z0-9_-]{10,})", url)
+    if m:
+        return m.group(1)
+    m = re.search(r"[?&]id=([a-zA-Z0-9_-]{10,})", url)
+    if m:
+        return m.group(1)
+    return None
+
+# =============================
+# Coluna de fotos no dataset preparado
+# =============================
+# Links do Drive ficam só pelo ID do arquivo (_foto_id); os demais links, em
+# _foto_outro. photo_links remonta a coluna original quando ela é exibida ou
+# exportada.
+FOTO_COL = "Link Foto"
+FOTO_ID_COL = "_foto_id"
+FOTO_OUTRO_COL = "_foto_outro"
+DRIVE_FILE_URL = "https://drive.google.com/file/d/{}/view"
+
+def split_photo_links(links: pd.Series):
+    """(IDs do Drive, demais links) de cada linha, como object com None."""
+    codigos, distintos = pd.factorize(links, use_na_sentinel=True)
+    textos = [v.strip() if isinstance(v, str) else None for v in distintos]
+    # extraído uma vez por link distinto; o None do fim é o das linhas sem link
+    ids = np.array([gdrive_extract_id(v) for v in textos] + [None], dtype=object)
+    outros = np.array(
+        [v if v and i is None else None for v, i in zip(textos, ids)] + [None], dtype=object
+    )
+    return ids[codigos], outros[codigos]
+
+def has_photos(df: pd.DataFrame) -> bool:
+    return FOTO_ID_COL in df.columns or FOTO_COL in df.columns
+
+def _coluna(df: pd.DataFrame, col: str, pos) -> np.ndarray:
+    s = df[col] if pos is None else df[col].iloc[pos]
+    return s.to_numpy(dtype=object, na_value=None)
+
+def photo_ids(df: pd.DataFrame, pos=None) -> np.ndarray:
+    """ID do arquivo do Drive de cada linha (None fora do Drive ou sem foto)."""
+    if FOTO_ID_COL in df.columns:
+        return _coluna(df, FOTO_ID_COL, pos)
+    if FOTO_COL in df.columns:
+        return split_photo_links(pd.Series(_coluna(df, FOTO_COL, pos), dtype=object))[0]
+    return np.full(len(df) if pos is None else len(pos), None, dtype=object)
+
+def photo_links(df: pd.DataFrame, pos=None) -> np.ndarray:
+    """Link da foto de cada linha (None sem foto); Drive no formato /file/d/<ID>/view."""
+    if FOTO_ID_COL not in df.columns:
+        if FOTO_COL in df.columns:
+            return _coluna(df, FOTO_COL, pos)
+        return np.full(len(df) if pos is None else len(pos), None, dtype=object)
+    ids = _coluna(df, FOTO_ID_COL, pos)
+    links = (
+        np.array(_coluna(df, FOTO_OUTRO_COL, pos), dtype=object) if FOTO_OUTRO_COL in df.columns
+        else np.full(len(ids), None, dtype=object)
+    )
+    tem_id = np.flatnonzero(pd.notna(ids))
+    links[tem_id] = [DRIVE_FILE_URL.format(i) for i in ids[tem_id]]
+    return links
+
+def drive_image_urls(file_id: str, base_url: str = DRIVE_BASE_URL):
+    thumb = f"{base_url}/thumbnail?id={file_id}&sz=w450"
+    big = f"{base_url}/thumbnail?id={file_id}&sz=w2048"
+    return thumb, big
+
+# =============================
+# Cache de situação por arquivo
+# =============================
+class PhotoStatusCache:
+    """Situação de cada ID de arquivo, válida por ttl_s segundos."""
+
+    def __init__(self, ttl_s: float = 6 * 3600):
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._dados = {}
+
+    def get(self, file_id: str):
+        with self._lock:
+            item = self._dados.get(file_id)
+        if item is None or time.monotonic() - item[1] > self.ttl_s:
+            return None
+        return item[0]
+
+    def set(self, file_id: str, status: str):
+        with self._lock:
+            self._dados[file_id] = (status, time.monotonic())
+
+    def is_bad(self, file_id: str) -> bool:
+        return self.get(file_id) in FOTO_RUINS
+
+    def missing(self, file_ids):
+        """IDs sem situação conhecida ou com situação vencida."""
+        return [f for f in file_ids if self.get(f) is None]
+
+# =============================
+# Validação assíncrona
+# =============================
+class _HostRateLimiter:
+    """Intervalo mínimo entre requisições ao mesmo host."""
+
+    def __init__(self, por_segundo: float):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self._proximo = {}
+        self._locks = {}
+
+    async def wait(self, host: str):
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            agora = time.monotonic()
+            espera = self._proximo.get(host, agora) - agora
+            if espera > 0:
+                await asyncio.sleep(espera)
+            self._proximo[host] = max(agora, self._proximo.get(host, agora)) + self.intervalo
+
+def _fetch_status(url: str, timeout: float) -> str:
+    req = Request(url, headers={"User-Agent": "viveiros-monitoramento"})
+    try:
+        with urlopen(req, timeout=timeout) as resp:
+            tipo = resp.headers.get("Content-Type", "")
+            resp.read(1)
+            return FOTO_OK if tipo.startswith("image/") else FOTO_INVALIDA
+    except HTTPError as e:
+        if e.code in (401, 403):
+            return FOTO_PRIVADA
+        if e.code in (404, 410):
+            return FOTO_QUEBRADA
+        raise
+
+async def validate_links(file_ids, cache: PhotoStatusCache, base_url: str = DRIVE_BASE_URL,
+                         max_conexoes: int = 8, por_host_rps: float = 5.0,
+                         timeout: float = 10.0) -> dict:
+    """Verifica os IDs ainda sem situação em cache e devolve {id: situação}.
+
+    Falhas de rede (timeout, 5xx) não entram no cache e são tentadas de novo
+    na próxima validação.
+    """
+    pendentes = cache.missing(dict.fromkeys(file_ids))
+    limiter = _HostRateLimiter(por_host_rps)
+    loop = asyncio.get_running_loop()
+    resultado = {}
+
+    with ThreadPoolExecutor(max_workers=max_conexoes, thread_name_prefix="fotos") as pool:
+        sem = asyncio.Semaphore(max_conexoes)
+
+        async def checar(fid):
+            url = drive_image_urls(fid, base_url)[0]
+            async with sem:
+                await limiter.wait(urlsplit(url).netloc)
+                try:
+                    status = await loop.run_in_executor(pool, _fetch_status, url, timeout)
+                except (HTTPError, URLError, OSError) as e:
+                    log.warning("Falha ao verificar a foto %s: %s", fid, e)
+                    return
+            cache.set(fid, status)
+            resultado[fid] = status
+
+        await asyncio.gather(*(checar(f) for f in pendentes))
+    return resultado
+
+def validate_links_sync(file_ids, cache: PhotoStatusCache, **kwargs) -> dict:
+    """validate_links para quem não está dentro de um loop asyncio."""
+    return asyncio.run(validate_links(file_ids, cache, **kwargs))
+
+def photo_file_ids(df: pd.DataFrame):
+    """IDs distintos do Drive presentes na coluna de fotos."""
+    return [f for f in dict.fromkeys(photo_ids(df)) if f]
+
+def photo_report(df: pd.DataFrame, sel: np.ndarray, cache: PhotoStatusCache) -> pd.DataFrame:
+    """Unidades de sel sem foto ou com link do Drive que não abre."""
+    col = FOTO_COL
+    if not has_photos(df):
+        return pd.DataFrame(columns=["CÓDIGO", "Nome", col, "Situação"])
+    links = photo_links(df, sel)
+    ids = photo_ids(df, sel)
+    situacoes = []
+    for link, fid in zip(links, ids):
+        if not isinstance(link, str) or not link.strip():
+            situacoes.append(FOTO_SEM_LINK)
+            continue
+        # links fora do Drive não são verificados
+        situacoes.append(None if fid is None else cache.get(fid))
+    situacoes = np.array(situacoes, dtype=object)
+    ruim = np.isin(situacoes, list(FOTO_RUINS | {FOTO_SEM_LINK}))
+    cols = [c for c in ("CÓDIGO", "Nome") if c in df.columns]
+    out = df.iloc[sel[ruim]][cols].copy()
+    out[col] = links[ruim]
+    out["Situação"] = situacoes[ruim]
+    return out.reset_index(drop=True)
@@ -0,0 +1,516 @@
+"""Carga e preparação dos dados de viveiros.
+
+Nada aqui depende do Streamlit: as mesmas funções rodam na sessão, no
+worker de atualização em segundo plano e em scripts.
+"""
+import math
+import os
+import re
+import hashlib
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from pyproj import Transformer
+
+from photos import FOTO_COL, FOTO_ID_COL, FOTO_OUTRO_COL, split_photo_links
+
+TZ = ZoneInfo("America/Fortaleza")
+
+# Seleções do dataset compartilhado não copiam dados até serem alteradas.
+# Vale para o processo todo, por isso é ligado uma vez, na importação; o
+# painel, o worker e os scripts contam com o mesmo comportamento.
+pd.set_option("mode.copy_on_write", True)
+
+# =============================
+# Fonte dos dados
+# =============================
+SHEET_ID = "1pMMSJUPCpWmG2weFcEhI5T0hQNY5VVDNjjUxB5i0GoI"
+GID = "2073960790"
+SEP = ","
+# trocável para apontar a um servidor local (ex.: loadtest.py)
+SHEETS_BASE_URL = os.environ.get("VIVEIROS_SHEETS_BASE_URL", "https://docs.google.com")
+
+def load_from_gsheet_csv(sheet_id: str, gid: str = "0", sep: str = ",", **read_csv_kwargs):
+    """CSV exportado da planilha (read_csv_kwargs: usecols, chunksize, dtype...)."""
+    url = f"{SHEETS_BASE_URL}/spreadsheets/d/{sheet_id}/export?format=csv&gid={gid}"
+    return pd.read_csv(url, sep=sep, **read_csv_kwargs)
+
+def version_from_hashes(columns, hashes) -> str:
+    """Versão a partir dos hashes por linha, na ordem (podem vir em blocos)."""
+    sha = hashlib.sha1("|".join(map(str, columns)).encode())
+    for h in hashes:
+        sha.update(np.ascontiguousarray(h).tobytes())
+    return sha.hexdigest()[:12]
+
+def compute_dataset_version(raw: pd.DataFrame) -> str:
+    """Identificador da versão dos dados: hash do conteúdo bruto da planilha."""
+    h = pd.util.hash_pandas_object(raw, index=False).to_numpy()
+    return version_from_hashes(raw.columns, [h])
+
+# =============================
+# Conversões
+# =============================
+def to_number(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return np.nan
+    s = str(v).strip()
+    if s == "":
+        return np.nan
+    if "," in s and s.count(",") == 1 and s.count(".") <= 1:
+        s = s.replace(".", "").replace(",", ".")
+    else:
+        s = s.replace(",", ".")
+    try:
+        return float(s)
+    except Exception:
+        try:
+            return float(s.replace(" ", ""))
+        except Exception:
+            return np.nan
+
+def code_text(v) -> str:
+    """Texto de um CÓDIGO: sem espaços nas pontas e, se veio como número
+    inteiro (101.0 de uma coluna numérica com célula vazia), sem o ".0"."""
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return ""
+    if isinstance(v, (float, np.floating)) and float(v).is_integer():
+        return str(int(v))
+    return str(v).strip()
+
+def code_texts(s: pd.Series) -> pd.Series:
+    """code_text de cada valor, como string (ausentes ficam <NA>)."""
+    return s.astype(object).map(code_text, na_action="ignore").replace("", None).astype("string")
+
+def parse_data_filtro(v):
+    """Converte string tipo 2025/11/04 11:22:03.951+00 em datetime no fuso de Fortaleza."""
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return pd.NaT
+    s = str(v).strip()
+    if s == "" or s.lower() in ("nan", "nat", "none"):
+        return pd.NaT
+
+    # normaliza separador
+    s = s.replace("/", "-")
+
+    # garante timezone no formato +HH:MM (se vier só +00, vira +00:00)
+    m = re.search(r"\+\d{2}(:\d{2})?$", s)
+    if m:
+        tz_part = m.group(0)
+        if ":" not in tz_part:
+            s = s.replace(tz_part, tz_part + ":00")
+
+    try:
+        dt = datetime.strptime(s, "%Y-%m-%d %H:%M:%S.%f%z")
+        return dt.astimezone(TZ)
+    except Exception:
+        pass
+
+    try:
+        dt = pd.to_datetime(s, errors="coerce", utc=True)
+        if pd.isna(dt):
+            return pd.NaT
+        if dt.tzinfo is None:
+            dt = dt.tz_localize("UTC")
+        return dt.tz_convert(TZ)
+    except Exception:
+        return pd.NaT
+
+# =============================
+# Normalização de coordenadas
+# =============================
+# Retângulo do Ceará com folga; fora dele o ponto é sinalizado.
+GEO_LIMITES = {"south": -8.2, "west": -41.8, "north": -2.4, "east": -36.9}
+CRS_UTM_24S = "EPSG:31984"  # SIRGAS 2000 / UTM zona 24S
+CRS_WGS84 = "EPSG:4326"
+
+GEO_OK = "ok"
+GEO_INVERTIDA = "lat/long invertidas"
+GEO_SINAL = "sinal corrigido"
+GEO_UTM = "UTM reprojetada"
+GEO_FORA = "fora da área"
+GEO_VAZIA = "sem coordenada"
+
+@lru_cache(maxsize=1)
+def get_utm_transformer():
+    return Transformer.from_crs(CRS_UTM_24S, CRS_WGS84, always_xy=True)
+
+def _dentro_limites(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    return (
+        (lat >= GEO_LIMITES["south"]) & (lat <= GEO_LIMITES["north"]) &
+        (lon >= GEO_LIMITES["west"]) & (lon <= GEO_LIMITES["east"])
+    )
+
+def normalize_coordinates(lat: np.ndarray, lon: np.ndarray):
+    """Limpa Lati/Long em lote.
+
+    Na ordem: aceita pontos já dentro do estado; troca lat/long invertidas;
+    corrige sinal esquecido; reprojeta valores em metros (UTM 24S, em qualquer
+    ordem) para WGS84. O que continuar fora dos limites fica NaN e sinalizado.
+    Retorna (lat, lon, status).
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    n = len(lat)
+    out_lat = np.full(n, np.nan)
+    out_lon = np.full(n, np.nan)
+    status = np.full(n, GEO_FORA, dtype=object)
+
+    finito = np.isfinite(lat) & np.isfinite(lon)
+    status[~finito] = GEO_VAZIA
+    pendente = finito.copy()
+
+    def aceita(mask, la, lo, rotulo):
+        ok = pendente & mask & _dentro_limites(la, lo)
+        out_lat[ok] = la[ok]
+        out_lon[ok] = lo[ok]
+        status[ok] = rotulo
+        pendente[ok] = False
+
+    with np.errstate(invalid="ignore"):
+        aceita(finito, lat, lon, GEO_OK)
+        aceita(finito, lon, lat, GEO_INVERTIDA)
+        aceita(finito, -np.abs(lat), -np.abs(lon), GEO_SINAL)
+        aceita(finito, -np.abs(lon), -np.abs(lat), GEO_SINAL)
+
+        # UTM: norte ~ 9.1–9.8 milhões, leste ~ 100–900 mil (em qualquer ordem)
+        grande, pequeno = np.maximum(lat, lon), np.minimum(lat, lon)
+        utm = pendente & (grande > 8.5e6) & (grande < 1.0e7) & (pequeno > 1.0e5) & (pequeno < 1.0e6)
+        if utm.any():
+            lon_utm, lat_utm = get_utm_transformer().transform(pequeno[utm], grande[utm])
+            la = np.full(n, np.nan)
+            lo = np.full(n, np.nan)
+            la[utm] = lat_utm
+            lo[utm] = lon_utm
+            aceita(utm, la, lo, GEO_UTM)
+
+    return out_lat, out_lon, status
+
+# =============================
+# Preparação
+# =============================
+NUMERIC_COLS_CSV = [
+    "Nº Viveiros total",
+    "Atual Viveiros Total",
+    "Nº Viveiros cheio",
+    "Atual Viveiros cheio",
+    "Área (ha).1",
+    "Atual Área (ha).1",
+    "Prof. Média  (m)",
+    "Atual Profun.",
+    "Lati",
+    "Long",
+]
+
+# diferença = valor atual - valor original
+DIFF_COLS = {
+    "diff_viv_total": ("Nº Viveiros total", "Atual Viveiros Total"),
+    "diff_viv_cheio": ("Nº Viveiros cheio", "Atual Viveiros cheio"),
+    "diff_area": ("Área (ha).1", "Atual Área (ha).1"),
+    "diff_prof": ("Prof. Média  (m)", "Atual Profun."),
+}
+
+MESES_MAP = {
+    1: "Jan", 2: "Fev", 3: "Mar", 4: "Abr",
+    5: "Mai", 6: "Jun", 7: "Jul", 8: "Ago",
+    9: "Set", 10: "Out", 11: "Nov", 12: "Dez",
+}
+
+# colunas da planilha usadas pelo painel (projeção nas fontes de dados)
+SOURCE_COLUMNS = [
+    "CÓDIGO", "Nome", "Ocorrências",
+    *NUMERIC_COLS_CSV,
+    "Data", "Data Filtro", "Link Foto",
+]
+
+def prepare_dataset(raw: pd.DataFrame, compact: bool = True) -> pd.DataFrame:
+    """Aplica ao CSV bruto todas as conversões que não dependem dos filtros.
+
+    Com compact=False devolve os tipos genéricos (usado no relatório de memória).
+    """
+    # Substitui NaN por None
+    df = raw.replace({np.nan: None}).reset_index(drop=True)
+
+    # Tratamento global de números vindos do CSV
+    for col in NUMERIC_COLS_CSV:
+        if col in df.columns:
+            df[col] = df[col].apply(to_number)
+
+    # Coordenadas limpas (WGS84) para mapa, calor e clique
+    if "Lati" in df.columns and "Long" in df.columns:
+        geo_lat, geo_lon, geo_status = normalize_coordinates(
+            df["Lati"].to_numpy(dtype=float),
+            df["Long"].to_numpy(dtype=float),
+        )
+        df["_lat_wgs84"] = geo_lat
+        df["_lon_wgs84"] = geo_lon
+        df["_geo_status"] = geo_status
+
+    # Datas para filtros: usa diretamente a coluna "Data"
+    if "Data" in df.columns:
+        df["_Data_dt"] = df["Data"].apply(parse_data_filtro)
+        df["Ano_filtro"] = df["_Data_dt"].dt.year
+        df["Mes_filtro_num"] = df["_Data_dt"].dt.month
+        df["Mes_filtro"] = df["Mes_filtro_num"].map(MESES_MAP)
+    else:
+        df["_Data_dt"] = pd.NaT
+        df["Ano_filtro"] = None
+        df["Mes_filtro"] = None
+
+    # Fotos: link do Drive guardado só pelo ID do arquivo (ver photos.photo_links)
+    if FOTO_COL in df.columns:
+        df[FOTO_ID_COL], df[FOTO_OUTRO_COL] = split_photo_links(df.pop(FOTO_COL))
+
+    # Divergências entre dados originais e atuais
+    diffs = []
+    for nome, (orig, atual) in DIFF_COLS.items():
+        if orig in df.columns and atual in df.columns:
+            df[nome] = df[atual] - df[orig]
+            diffs.append(df[nome].to_numpy(dtype=float))
+    if diffs:
+        d = np.column_stack(diffs)
+        with np.errstate(invalid="ignore"):
+            pos = (d > 0).any(axis=1)
+            neg = (d < 0).any(axis=1)
+    else:
+        pos = neg = np.zeros(len(df), dtype=bool)
+    df["_divergente"] = pos | neg
+    df["Tipo Divergência"] = np.select(
+        [pos & ~neg, neg & ~pos, pos & neg], ["Positiva", "Negativa", "Mista"], default="Zero"
+    )
+
+    return compact_dataset(df) if compact else df
+
+# =============================
+# Compactação de tipos
+# =============================
+CATEGORY_COLS = ["Ocorrências", "Mes_filtro", "Tipo Divergência", "_geo_status"]
+SMALL_INT_COLS = {"Ano_filtro": "Int16", "Mes_filtro_num": "Int8"}
+# medidas com poucas casas decimais; coordenadas ficam em float64
+FLOAT32_COLS = [c for c in NUMERIC_COLS_CSV if c not in ("Lati", "Long")] + list(DIFF_COLS)
+# texto com poucos valores distintos vira categoria; o resto, string Arrow
+CATEGORY_MAX_RATIO = 0.5
+
+def _compact_object(s: pd.Series) -> pd.Series:
+    tipo = pd.api.types.infer_dtype(s, skipna=True)
+    if tipo in ("floating", "integer", "mixed-integer-float"):
+        return pd.to_numeric(s, errors="coerce")
+    if tipo in ("string", "empty"):
+        if len(s) and s.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(s):
+            return s.astype("category")
+        return s.astype("string[pyarrow]")
+    return s
+
+def compact_dataset(df: pd.DataFrame) -> pd.DataFrame:
+    """Troca os tipos genéricos (object/float64) por tipos compactos."""
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if col in CATEGORY_COLS:
+            s = s.astype("category")
+        elif col in SMALL_INT_COLS:
+            s = pd.to_numeric(s, errors="coerce").astype(SMALL_INT_COLS[col])
+        elif col in FLOAT32_COLS:
+            s = s.astype("float32")
+        elif s.dtype == object:
+            s = _compact_object(s)
+        out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Bytes por coluna antes e depois da compactação."""
+    return _memory_table(before.dtypes, before.memory_usage(deep=True, index=False), after)
+
+def refresh_memory_report(report: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """O mesmo relatório com o lado compactado medido de novo em after (o lado
+    "antes" continua o da preparação em que foi medido)."""
+    return _memory_table(report["Tipo antes"], report["Bytes antes"], after)
+
+def _memory_table(tipos_antes: pd.Series, bytes_antes: pd.Series, after: pd.DataFrame) -> pd.DataFrame:
+    depois = after.memory_usage(deep=True, index=False)
+    rep = pd.DataFrame({
+        "Tipo antes": tipos_antes.astype(str),
+        "Bytes antes": bytes_antes,
+        "Tipo depois": after.dtypes.reindex(tipos_antes.index).astype(str),
+        "Bytes depois": depois.reindex(tipos_antes.index),
+    })
+    rep["Redução (x)"] = (rep["Bytes antes"] / rep["Bytes depois"]).round(1)
+    rep.index.name = "Coluna"
+    return rep.sort_values("Bytes antes", ascending=False)
+
+def prepare_incremental(prev_df: pd.DataFrame, raw: pd.DataFrame,
+                        reuse_new: np.ndarray, reuse_old: np.ndarray) -> pd.DataFrame:
+    """Prepara só as linhas que mudaram, reaproveitando o resto de prev_df.
+
+    reuse_new/reuse_old são posições pareadas (linha igual na versão nova e na
+    anterior). As demais linhas de raw passam por prepare_dataset; o resultado
+    sai na ordem de raw e compactado.
+    """
+    mudou = np.ones(len(raw), dtype=bool)
+    mudou[reuse_new] = False
+    pos_novas = np.flatnonzero(mudou)
+
+    mantidas = prev_df.iloc[reuse_old]
+    mantidas.index = reuse_new
+
+    if len(pos_novas) == 0:
+        # nada a preparar (e prepare_dataset não aceita frame vazio)
+        combinado = mantidas
+    else:
+        novas = prepare_dataset(raw.iloc[pos_novas], compact=False)
+        novas.index = pos_novas
+        if len(mantidas) == 0:
+            combinado = novas
+        else:
+            # categorias/strings Arrow voltam a object para concatenar com as linhas novas
+            combinado = pd.concat(
+                [mantidas.astype({c: object for c in mantidas.columns
+                                  if not pd.api.types.is_numeric_dtype(mantidas[c])
+                                  and not pd.api.types.is_datetime64_any_dtype(mantidas[c])}),
+                 novas[mantidas.columns]],
+                copy=False,
+            )
+    return compact_dataset(combinado.sort_index().reset_index(drop=True))
+
+# =============================
+# Preparo em blocos
+# =============================
+def _ratio_rule(s: pd.Series) -> pd.Series:
+    """Mesma escolha de _compact_object entre categoria e string Arrow."""
+    poucos = len(s) and s.nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(s)
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s if poucos else s.astype("string[pyarrow]")
+    return s.astype("category") if poucos else s
+
+def _concat_column(col: str, parts) -> pd.Series:
+    """Junta os pedaços já compactados de uma coluna, unificando os tipos.
+
+    Para texto, categoria ou string Arrow é decidido de novo com os valores
+    distintos da coluna inteira, como em compact_dataset.
+    """
+    if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+        s = pd.Series(union_categoricals(parts, ignore_order=True))
+        return s if col in CATEGORY_COLS else _ratio_rule(s)
+    tipos = {p.dtype for p in parts}
+    if len(tipos) == 1:
+        s = pd.concat(parts, ignore_index=True)
+        if s.dtype == "string[pyarrow]":
+            # cada bloco escolheu pelas suas contagens; vale a da planilha inteira
+            return _ratio_rule(s)
+        return s
+    datas = [p.dtype for p in parts if pd.api.types.is_datetime64_any_dtype(p.dtype)]
+    if datas:
+        # bloco sem nenhuma data válida sai sem fuso; vira NaT do tipo dos demais
+        alvo = next((d for d in datas if getattr(d, "tz", None) is not None), datas[0])
+        parts = [p if p.dtype == alvo else pd.Series(pd.NaT, index=p.index, dtype=alvo) for p in parts]
+        return pd.concat(parts, ignore_index=True)
+    if all(pd.api.types.is_numeric_dtype(p.dtype) for p in parts):
+        return pd.concat(parts, ignore_index=True)
+    s = pd.concat([p.astype("string[pyarrow]") for p in parts], ignore_index=True)
+    return s.astype("category") if col in CATEGORY_COLS else _ratio_rule(s)
+
+def prepare_chunks(chunks, on_chunk=None, reuse=None):
+    """Prepara e compacta o CSV bloco a bloco.
+
+    Cada bloco bruto é convertido e compactado antes do próximo ser lido, de
+    modo que o pico de memória depende do tamanho do bloco, não da planilha.
+    on_chunk(raw) recebe cada bloco bruto (hash de versão, por exemplo).
+
+    reuse=(prev_df, prev_hashes, candidatas, colunas): candidatas[i] é a linha
+    de prev_df que deve ser igual à linha i da planilha (-1 = nenhuma). Ela só
+    é reaproveitada se o bloco tiver as colunas brutas de prev_df e o hash da
+    linha lida agora for prev_hashes[candidatas[i]] (a planilha pode mudar
+    entre duas leituras); as demais são preparadas.
+    Nesse modo não há tipos genéricos da planilha inteira e o relatório de
+    memória volta None.
+
+    Retorna (df, relatório de memória).
+    """
+    partes = []
+    tipos_antes = None
+    bytes_antes = None
+    inicio = 0
+    for raw in chunks:
+        if on_chunk is not None:
+            on_chunk(raw)
+        fim = inicio + len(raw)
+        if reuse is not None:
+            prev_df, prev_hashes, candidatas, colunas = reuse
+            old = np.full(len(raw), -1, dtype=np.int64)
+            old[:max(0, min(fim, len(candidatas)) - inicio)] = candidatas[inicio:fim]
+            h = pd.util.hash_pandas_object(raw, index=False).to_numpy()
+            igual = np.flatnonzero(old >= 0) if tuple(raw.columns) == tuple(colunas) else old[:0]
+            igual = igual[prev_hashes[old[igual]] == h[igual]]
+            partes.append(prepare_incremental(prev_df, raw, igual, old[igual]))
+            inicio = fim
+            del raw
+            continue
+        inicio = fim
+        preparado = prepare_dataset(raw, compact=False)
+        uso = preparado.memory_usage(deep=True, index=False)
+        if tipos_antes is None:
+            tipos_antes = preparado.dtypes
+            bytes_antes = uso
+        else:
+            bytes_antes = bytes_antes.add(uso, fill_value=0)
+        partes.append(compact_dataset(preparado))
+        del preparado, raw
+
+    if not partes:
+        return pd.DataFrame(), None
+    colunas = list(partes[0].columns)
+    df = pd.DataFrame({c: _concat_column(c, [p[c] for p in partes]) for c in colunas})
+    if tipos_antes is None:
+        return df, None
+    return df, _memory_table(tipos_antes, bytes_antes.reindex(tipos_antes.index), df)
+
+# =============================
+# Filtros e divergências
+# =============================
+# rótulos de exibição das colunas diff_*
+DELTA_LABELS = {
+    "diff_viv_total": "Δ Viveiros Total",
+    "diff_viv_cheio": "Δ Viveiros Cheio",
+    "diff_area": "Δ Área (ha)",
+    "diff_prof": "Δ Profundidade (m)",
+}
+
+def filter_positions(df: pd.DataFrame, anos=None, meses=None, ocorrencias=None,
+                     busca: str = "") -> np.ndarray:
+    """Posições das linhas que atendem aos filtros (vazio = sem filtro)."""
+    filtro = np.ones(len(df), dtype=bool)
+    if anos and "Ano_filtro" in df.columns:
+        filtro &= df["Ano_filtro"].isin(anos).to_numpy()
+    if meses and "Mes_filtro" in df.columns:
+        filtro &= df["Mes_filtro"].isin(meses).to_numpy()
+    if ocorrencias and "Ocorrências" in df.columns:
+        filtro &= df["Ocorrências"].isin(ocorrencias).to_numpy()
+    if busca:
+        txt = busca.strip().lower()
+        achou = np.zeros(len(df), dtype=bool)
+        for col in ("CÓDIGO", "Nome"):
+            if col in df.columns:
+                achou |= _contains(df[col], txt)
+        filtro &= achou
+    return np.flatnonzero(filtro)
+
+def _contains(s: pd.Series, txt: str) -> np.ndarray:
+    """Linhas cujo texto (em minúsculas) contém txt; categorias são testadas
+    uma vez por valor distinto."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        cats = code_texts(pd.Series(s.cat.categories)).str.lower()
+        ok = cats.str.contains(txt, regex=False).to_numpy(dtype=bool, na_value=False)
+        # código -1 (ausente) cai no False do fim
+        return np.append(ok, False)[s.cat.codes.to_numpy()]
+    if not pd.api.types.is_string_dtype(s.dtype) or s.dtype == object:
+        s = code_texts(s)
+    return s.str.lower().str.contains(txt, regex=False).to_numpy(dtype=bool, na_value=False)
+
+def alert_positions(df: pd.DataFrame, sel: np.ndarray) -> np.ndarray:
+    """Posições de sel com divergência entre valores originais e atuais."""
+    if "_divergente" not in df.columns:
+        return sel[:0]
+    return sel[df["_divergente"].to_numpy()[sel]]
@@ -0,0 +1,98 @@
+"""Ranking das divergências mais graves.
+
+Para cada métrica (viveiros total, viveiros cheios, área e profundidade) a
+divergência é medida de duas formas:
+
+- relativa: |Δ| / |valor original| (perder metade dos viveiros pesa 0,5);
+- absoluta: |Δ| / escala típica da métrica (mediana de |original| no dataset).
+
+As duas, limitadas a 1, são combinadas por PESO_RELATIVO e somadas com os
+pesos de METRIC_WEIGHTS numa pontuação entre 0 e 1. As K piores saem por
+seleção parcial (argpartition), sem ordenar todas as unidades divergentes.
+"""
+import numpy as np
+import pandas as pd
+
+from pipeline import DIFF_COLS
+
+METRIC_WEIGHTS = {
+    "diff_viv_total": 1.0,
+    "diff_viv_cheio": 1.0,
+    "diff_area": 1.0,
+    "diff_prof": 0.5,
+}
+PESO_RELATIVO = 0.7
+
+def metric_scales(df: pd.DataFrame) -> dict:
+    """Escala típica de cada métrica: mediana de |valor original| > 0."""
+    escalas = {}
+    for nome, (orig, _) in DIFF_COLS.items():
+        if orig not in df.columns:
+            continue
+        v = np.abs(df[orig].to_numpy(dtype=float, na_value=np.nan))
+        v = v[np.isfinite(v) & (v > 0)]
+        escalas[nome] = float(np.median(v)) if len(v) else 1.0
+    return escalas
+
+def metric_components(df: pd.DataFrame, pos: np.ndarray, escalas: dict) -> pd.DataFrame:
+    """Variação relativa e absoluta normalizada de cada métrica, nas posições pos."""
+    partes = {}
+    for nome, (orig, _) in DIFF_COLS.items():
+        if nome not in df.columns or nome not in escalas:
+            continue
+        delta = np.abs(df[nome].to_numpy(dtype=float, na_value=np.nan)[pos])
+        base = np.abs(df[orig].to_numpy(dtype=float, na_value=np.nan)[pos])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rel = np.where(base > 0, delta / base, np.where(delta > 0, 1.0, 0.0))
+        partes[(nome, "rel")] = np.nan_to_num(np.minimum(rel, 1.0))
+        partes[(nome, "abs")] = np.nan_to_num(np.minimum(delta / escalas[nome], 1.0))
+    return pd.DataFrame(partes)
+
+def divergence_scores(df: pd.DataFrame, pos: np.ndarray, escalas: dict = None) -> np.ndarray:
+    """Pontuação (0 a 1) de cada posição em pos."""
+    if escalas is None:
+        escalas = metric_scales(df)
+    comp = metric_components(df, pos, escalas)
+    score = np.zeros(len(pos), dtype=float)
+    peso_total = 0.0
+    for nome, peso in METRIC_WEIGHTS.items():
+        if (nome, "rel") not in comp:
+            continue
+        parcela = PESO_RELATIVO * comp[(nome, "rel")] + (1 - PESO_RELATIVO) * comp[(nome, "abs")]
+        score += peso * parcela.to_numpy()
+        peso_total += peso
+    return score / peso_total if peso_total else score
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices das k maiores pontuações, da maior para a menor."""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def score_breakdown(df: pd.DataFrame, p: int, escalas: dict) -> pd.DataFrame:
+    """Detalhe da pontuação de uma unidade (posição p), métrica a métrica."""
+    comp = metric_components(df, np.array([p]), escalas)
+    peso_total = sum(METRIC_WEIGHTS.get(n, 0.0) for n, tipo in comp.columns if tipo == "rel") or 1.0
+    linhas = []
+    for nome, (orig, atual) in DIFF_COLS.items():
+        if (nome, "rel") not in comp:
+            continue
+        rel = comp[(nome, "rel")].iloc[0]
+        abs_ = comp[(nome, "abs")].iloc[0]
+        linhas.append({
+            "Métrica": nome,
+            "Original": df[orig].iloc[p],
+            "Atual": df[atual].iloc[p],
+            "Δ": df[nome].iloc[p],
+            "Variação relativa": rel,
+            "Variação absoluta (escala)": abs_,
+            "Peso": METRIC_WEIGHTS.get(nome, 0.0),
+            "Contribuição": METRIC_WEIGHTS.get(nome, 0.0)
+            * (PESO_RELATIVO * rel + (1 - PESO_RELATIVO) * abs_) / peso_total,
+        })
+    return pd.DataFrame(linhas)
@@ -0,0 +1,287 @@
+"""Relatórios de inspeção em lote, sem Streamlit.
+
+Roda a mesma carga, preparação, filtros e alertas do painel e gera, para cada
+combinação de filtros (geral, cada ano, cada tipo de ocorrência e cada região),
+uma pasta com KPIs, tabela de alertas, mapa folium estático e gráficos.
+
+As combinações são processadas em paralelo. O dataset preparado é gravado
+uma vez em Arrow IPC sem compressão e cada processo o abre mapeado em memória
+(as colunas apontam para as páginas do arquivo, compartilhadas entre os
+processos). Cada tarefa converte para pandas só as colunas dos filtros e,
+depois, as colunas do relatório nas linhas selecionadas.
+
+Uso:
+    python report.py --saida relatorios
+    python report.py --csv planilha.csv --processos 4
+    python report.py --fonte parquet:planilha.parquet
+"""
+import argparse
+import html
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import altair as alt
+import folium
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from charts import (
+    configure, occurrence_chart, occurrence_counts, occurrence_year_chart, occurrence_year_counts,
+)
+from filters import KPI_COLS, compute_kpis
+from pipeline import (
+    TZ, DELTA_LABELS, SOURCE_COLUMNS, alert_positions, filter_positions, prepare_dataset,
+)
+from sources import CsvSource, source_from_config
+
+REGIAO_COL = os.environ.get("VIVEIROS_REGIAO_COL", "Região")
+DATASET_FILE = "_dataset.arrow"
+
+COLS_ALERTA = [
+    "CÓDIGO", "Nome",
+    "Nº Viveiros total", "Atual Viveiros Total", "diff_viv_total",
+    "Nº Viveiros cheio", "Atual Viveiros cheio", "diff_viv_cheio",
+    "Área (ha).1", "Atual Área (ha).1", "diff_area",
+    "Prof. Média  (m)", "Atual Profun.", "diff_prof",
+    "Tipo Divergência",
+]
+# colunas lidas pelas combinações de filtros (além da coluna de região)
+COLS_FILTRO = ["Ano_filtro", "Ocorrências"]
+# colunas lidas pelos KPIs, alertas, mapa e gráficos
+COLS_RELATORIO = list(dict.fromkeys([
+    *COLS_ALERTA, *KPI_COLS.values(), *COLS_FILTRO,
+    "_lat_wgs84", "_lon_wgs84", "_divergente",
+]))
+
+# tabela Arrow do processo de trabalho, mapeada uma vez pelo initializer
+_tabela = None
+
+# =============================
+# Dataset compartilhado
+# =============================
+def share_dataset(df: pd.DataFrame, path: Path) -> Path:
+    """Grava o dataset preparado em Arrow IPC sem compressão (lido sem cópia via mmap)."""
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(str(path), "wb") as f, pa.ipc.new_file(f, tabela.schema) as w:
+        w.write_table(tabela)
+    return path
+
+def _init_worker(path: str):
+    global _tabela
+    _tabela = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+def _columns(tabela: pa.Table, cols, pos: np.ndarray = None) -> pd.DataFrame:
+    """As colunas de cols presentes na tabela, em pandas; com pos, só essas linhas."""
+    t = tabela.select([c for c in dict.fromkeys(cols) if c in tabela.column_names])
+    if pos is not None:
+        t = t.take(pa.array(pos, type=pa.int64()))
+    return t.to_pandas()
+
+# =============================
+# Combinações de filtros
+# =============================
+def _slug(texto) -> str:
+    t = unicodedata.normalize("NFKD", str(texto)).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", t.lower()).strip("-") or "vazio"
+
+def _valores(df: pd.DataFrame, col: str):
+    if col not in df.columns:
+        return []
+    return sorted(v for v in pd.unique(df[col].dropna()))
+
+def report_combinations(df: pd.DataFrame, regiao_col: str = REGIAO_COL):
+    """Lista de (nome, filtros) com o geral, cada ano, ocorrência e região."""
+    combos = [("geral", {})]
+    combos += [(f"ano-{int(a)}", {"anos": [a]}) for a in _valores(df, "Ano_filtro")]
+    combos += [(f"ocorrencia-{_slug(o)}", {"ocorrencias": [o]}) for o in _valores(df, "Ocorrências")]
+    combos += [(f"regiao-{_slug(r)}", {"regiao": r}) for r in _valores(df, regiao_col)]
+    return combos
+
+def _positions(df: pd.DataFrame, filtros: dict, regiao_col: str) -> np.ndarray:
+    filtros = dict(filtros)
+    regiao = filtros.pop("regiao", None)
+    sel = filter_positions(df, **filtros)
+    if regiao is not None:
+        sel = sel[(df[regiao_col].to_numpy()[sel] == regiao)]
+    return sel
+
+# =============================
+# Renderização
+# =============================
+def _fmt_br(v: float, casas: int) -> str:
+    return f"{v:,.{casas}f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+def render_kpis(df: pd.DataFrame, sel: np.ndarray) -> str:
+    totais = compute_kpis(df, sel)
+    kpis = [
+        ("Unidades de viveiros", str(totais["unidades"])),
+        ("Viveiros cadastrados", _fmt_br(totais["viveiros_total"], 0)),
+        ("Viveiros cheios", _fmt_br(totais["viveiros_cheio"], 0)),
+        ("Área total atual", _fmt_br(totais["area"], 1) + " ha"),
+    ]
+    cards = "".join(
+        f'<div class="kpi"><div class="kpi-label">{html.escape(k)}</div>'
+        f'<div class="kpi-value">{v}</div></div>'
+        for k, v in kpis
+    )
+    return f'<div class="kpis">{cards}</div>'
+
+def render_alert_table(df: pd.DataFrame, sel_alerta: np.ndarray) -> str:
+    if len(sel_alerta) == 0:
+        return "<p>Nenhuma divergência relevante encontrada.</p>"
+    cols = [c for c in COLS_ALERTA if c in df.columns]
+    tabela = df.iloc[sel_alerta][cols].rename(columns=DELTA_LABELS)
+    return tabela.to_html(index=False, na_rep="-", float_format=lambda v: f"{v:.2f}", border=0)
+
+def render_map(df: pd.DataFrame, sel: np.ndarray, path: Path):
+    fmap = folium.Map(location=[-5.0, -39.5], zoom_start=7, control_scale=True)
+    if "_lat_wgs84" in df.columns and "_lon_wgs84" in df.columns:
+        lat = df["_lat_wgs84"].to_numpy(dtype=float)[sel]
+        lon = df["_lon_wgs84"].to_numpy(dtype=float)[sel]
+        ok = np.isfinite(lat) & np.isfinite(lon)
+        codigos = df["CÓDIGO"].to_numpy(dtype=object)[sel] if "CÓDIGO" in df.columns else [""] * len(sel)
+        divergente = (
+            df["_divergente"].to_numpy()[sel] if "_divergente" in df.columns
+            else np.zeros(len(sel), dtype=bool)
+        )
+        for i in np.flatnonzero(ok):
+            folium.CircleMarker(
+                location=[lat[i], lon[i]],
+                radius=5,
+                color="#e74c3c" if divergente[i] else "#0984e3",
+                fill=True,
+                fill_opacity=0.8,
+                tooltip=html.escape(str(codigos[i])),
+            ).add_to(fmap)
+        if ok.any():
+            fmap.fit_bounds([[lat[ok].min(), lon[ok].min()], [lat[ok].max(), lon[ok].max()]])
+    fmap.save(str(path))
+
+def render_charts(df: pd.DataFrame, sel: np.ndarray, path: Path) -> bool:
+    if "Ocorrências" not in df.columns:
+        return False
+    por_ocorr = occurrence_counts(df, sel)
+    por_ocorr = por_ocorr[por_ocorr["contagem"] > 0]
+    if por_ocorr.empty:
+        return False
+    graficos = [occurrence_chart(por_ocorr).properties(width=350)]
+    if "Ano_filtro" in df.columns:
+        por_ano = occurrence_year_counts(df, sel)
+        if not por_ano.empty:
+            graficos.append(occurrence_year_chart(por_ano).properties(width=350))
+    configure(alt.hconcat(*graficos)).save(str(path))
+    return True
+
+PAGINA = """<!doctype html>
+<html lang="pt-BR"><head><meta charset="utf-8"><title>{titulo}</title>
+<style>
+body {{ font-family: "Segoe UI", sans-serif; margin: 2rem; color: #2d3436; }}
+.kpis {{ display: flex; gap: 1rem; margin-bottom: 2rem; }}
+.kpi {{ flex: 1; padding: 1rem; border-radius: 12px; background: #f8f9fa; border-top: 4px solid #0984e3; }}
+.kpi-label {{ font-size: 0.8rem; text-transform: uppercase; color: #636e72; }}
+.kpi-value {{ font-size: 1.8rem; font-weight: 800; }}
+table {{ border-collapse: collapse; font-size: 0.85rem; }}
+th, td {{ padding: 4px 8px; border-bottom: 1px solid #dfe6e9; }}
+iframe {{ width: 100%; border: 0; }}
+</style></head><body>
+<h1>🐟 {titulo}</h1>
+<p>Gerado em {gerado}</p>
+{kpis}
+<h2>🚨 Alertas de divergência ({n_alertas})</h2>
+{alertas}
+<h2>🗺️ Mapa</h2>
+<iframe src="mapa.html" height="520"></iframe>
+{graficos}
+</body></html>
+"""
+
+def render_report(nome: str, filtros: dict, saida: str, regiao_col: str = REGIAO_COL):
+    """Gera a pasta do relatório de uma combinação. Roda no processo de trabalho."""
+    pasta = Path(saida) / nome
+    pasta.mkdir(parents=True, exist_ok=True)
+
+    pos = _positions(_columns(_tabela, [*COLS_FILTRO, regiao_col]), filtros, regiao_col)
+    # daqui em diante df tem só as linhas da combinação, na ordem de pos
+    df = _columns(_tabela, COLS_RELATORIO, pos)
+    sel = np.arange(len(df))
+    sel_alerta = alert_positions(df, sel)
+
+    render_map(df, sel, pasta / "mapa.html")
+    tem_graficos = render_charts(df, sel, pasta / "graficos.html")
+
+    pagina = PAGINA.format(
+        titulo=html.escape(f"Relatório de viveiros – {nome}"),
+        gerado=datetime.now(TZ).strftime("%d/%m/%Y %H:%M"),
+        kpis=render_kpis(df, sel),
+        n_alertas=len(sel_alerta),
+        alertas=render_alert_table(df, sel_alerta),
+        graficos=(
+            '<h2>📊 Gráficos</h2><iframe src="graficos.html" height="420"></iframe>'
+            if tem_graficos else ""
+        ),
+    )
+    (pasta / "index.html").write_text(pagina, encoding="utf-8")
+    return nome, len(sel), len(sel_alerta)
+
+# =============================
+# Linha de comando
+# =============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera relatórios de inspeção dos viveiros em lote.")
+    parser.add_argument("--saida", default="relatorios", help="pasta de destino")
+    parser.add_argument("--fonte", help="fonte dos dados, no formato de VIVEIROS_FONTE")
+    parser.add_argument("--csv", help="atalho para --fonte csv:<arquivo>")
+    parser.add_argument("--processos", type=int, default=os.cpu_count(), help="processos em paralelo")
+    parser.add_argument("--regiao-col", default=REGIAO_COL, help="coluna usada para separar por região")
+    args = parser.parse_args(argv)
+
+    saida = Path(args.saida)
+    saida.mkdir(parents=True, exist_ok=True)
+
+    fonte = CsvSource(args.csv) if args.csv else source_from_config(args.fonte)
+    raw = fonte.load(columns=[*SOURCE_COLUMNS, args.regiao_col])
+    df = prepare_dataset(raw)
+    dataset_path = share_dataset(df, saida / DATASET_FILE)
+
+    combos = report_combinations(df, args.regiao_col)
+    if args.regiao_col not in df.columns:
+        print(f"Coluna '{args.regiao_col}' não encontrada: relatórios por região ignorados.")
+
+    resultados = []
+    with ProcessPoolExecutor(
+        max_workers=args.processos,
+        initializer=_init_worker,
+        initargs=(str(dataset_path),),
+    ) as pool:
+        tarefas = [
+            pool.submit(render_report, nome, filtros, str(saida), args.regiao_col)
+            for nome, filtros in combos
+        ]
+        for t in as_completed(tarefas):
+            nome, n, n_alertas = t.result()
+            resultados.append((nome, n, n_alertas))
+            print(f"{nome}: {n} unidades, {n_alertas} alertas")
+
+    ordem = {nome: i for i, (nome, _) in enumerate(combos)}
+    linhas = "".join(
+        f'<tr><td><a href="{nome}/index.html">{html.escape(nome)}</a></td><td>{n}</td><td>{a}</td></tr>'
+        for nome, n, a in sorted(resultados, key=lambda r: ordem[r[0]])
+    )
+    (saida / "index.html").write_text(
+        '<!doctype html><html lang="pt-BR"><head><meta charset="utf-8">'
+        "<title>Relatórios de viveiros</title></head><body>"
+        "<h1>🐟 Relatórios de viveiros</h1>"
+        "<table><tr><th>Relatório</th><th>Unidades</th><th>Alertas</th></tr>"
+        f"{linhas}</table></body></html>",
+        encoding="utf-8",
+    )
+    os.remove(dataset_path)
+    print(f"{len(resultados)} relatórios em {saida}")
+
+if __name__ == "__main__":
+    main()
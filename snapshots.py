@@ -0,0 +1,170 @@
+"""Histórico das versões da planilha em Parquet.
+
+Cada versão publicada vira um arquivo compactado em
+<raiz>/fetch_date=AAAA-MM-DD/<HHMMSS>_<versão>.parquet. As consultas leem só
+as partições e colunas necessárias, sem carregar o histórico inteiro.
+"""
+import os
+import threading
+from datetime import date, datetime
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from photos import FOTO_COL, FOTO_ID_COL, FOTO_OUTRO_COL, photo_links
+from pipeline import TZ, code_text, code_texts
+
+SNAPSHOT_DIR = os.environ.get("VIVEIROS_SNAPSHOT_DIR", "snapshots")
+PARTITION_KEY = "fetch_date"
+
+# o histórico guarda o link da foto remontado, não as colunas auxiliares
+_NAO_GUARDAR = {FOTO_ID_COL, FOTO_OUTRO_COL}
+
+# {raiz: {versão: arquivo}}, montado com uma varredura e mantido a cada gravação
+_indices = {}
+_indices_lock = threading.Lock()
+
+def _partition_dir(root, dia: date) -> Path:
+    return Path(root) / f"{PARTITION_KEY}={dia.isoformat()}"
+
+def list_snapshots(root=SNAPSHOT_DIR, until: date = None):
+    """Arquivos de snapshot em ordem cronológica, opcionalmente até uma data."""
+    root = Path(root)
+    if not root.exists():
+        return []
+    arquivos = []
+    for part in sorted(root.glob(f"{PARTITION_KEY}=*")):
+        dia = date.fromisoformat(part.name.split("=", 1)[1])
+        if until is not None and dia > until:
+            break
+        arquivos.extend(sorted(part.glob("*.parquet")))
+    return arquivos
+
+def _version_of(path: Path) -> str:
+    return path.stem.split("_", 1)[1]
+
+def _version_index(root) -> dict:
+    chave = str(Path(root).resolve())
+    with _indices_lock:
+        if chave not in _indices:
+            _indices[chave] = {_version_of(p): p for p in list_snapshots(root)}
+        return _indices[chave]
+
+def _snapshot_time(path: Path) -> datetime:
+    dia = date.fromisoformat(path.parent.name.split("=", 1)[1])
+    hora = datetime.strptime(path.stem.split("_", 1)[0], "%H%M%S").time()
+    return datetime.combine(dia, hora, tzinfo=TZ)
+
+def _to_arrow(df: pd.DataFrame) -> pa.Table:
+    """Tabela Arrow com esquema estável entre versões.
+
+    Categorias são gravadas como texto (o Parquet já codifica por dicionário)
+    e colunas object mistas viram texto, para que todas as versões tenham os
+    mesmos tipos e possam ser lidas como um único dataset. CÓDIGO é sempre
+    texto, mesmo quando a planilha tem só códigos numéricos.
+    """
+    cols = {}
+    for c in df.columns:
+        if c in _NAO_GUARDAR:
+            continue
+        s = df[c]
+        if c == "CÓDIGO":
+            s = code_texts(s)
+        elif s.dtype == object:
+            s = s.astype("string")
+        cols[c] = s
+    if FOTO_ID_COL in df.columns:
+        cols[FOTO_COL] = pd.Series(photo_links(df), index=df.index, dtype="string")
+    tabela = pa.Table.from_pandas(pd.DataFrame(cols), preserve_index=False)
+    def tipo_estavel(t):
+        if pa.types.is_dictionary(t):
+            t = t.value_type
+        return pa.string() if pa.types.is_large_string(t) else t
+
+    schema = pa.schema([f.with_type(tipo_estavel(f.type)) for f in tabela.schema])
+    return tabela.cast(schema)
+
+def write_snapshot(df: pd.DataFrame, version: str, fetched_at: datetime,
+                   root=SNAPSHOT_DIR) -> Path:
+    """Grava a versão, se ainda não estiver no histórico. Retorna o arquivo."""
+    indice = _version_index(root)
+    existente = indice.get(version)
+    if existente is not None and existente.exists():
+        return existente
+
+    local = fetched_at.astimezone(TZ)
+    part = _partition_dir(root, local.date())
+    part.mkdir(parents=True, exist_ok=True)
+    path = part / f"{local:%H%M%S}_{version}.parquet"
+
+    tabela = _to_arrow(df)
+    tabela = tabela.append_column("_version", pa.array([version] * len(df), pa.string()))
+    tabela = tabela.append_column(
+        "_fetched_at", pa.array([pd.Timestamp(fetched_at)] * len(df), pa.timestamp("us", tz=str(TZ)))
+    )
+    tmp = path.with_suffix(".parquet.tmp")
+    pq.write_table(tabela, tmp, compression="zstd")
+    os.replace(tmp, path)
+    with _indices_lock:
+        indice[version] = path
+    return path
+
+def read_as_of(when, columns=None, root=SNAPSHOT_DIR) -> pd.DataFrame:
+    """Estado da planilha na data/hora when (última versão obtida até então)."""
+    if isinstance(when, datetime):
+        limite = when if when.tzinfo else when.replace(tzinfo=TZ)
+        dia = limite.astimezone(TZ).date()
+    else:
+        limite = None
+        dia = when
+    candidatos = list_snapshots(root, until=dia)
+    if limite is not None:
+        candidatos = [p for p in candidatos if _snapshot_time(p) <= limite]
+    if not candidatos:
+        return pd.DataFrame(columns=columns or [])
+    return pq.read_table(candidatos[-1], columns=columns).to_pandas()
+
+def _dataset(root):
+    return ds.dataset(
+        root,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([(PARTITION_KEY, pa.date32())]), flavor="hive"),
+    )
+
+def divergence_over_time(start: date = None, end: date = None, root=SNAPSHOT_DIR) -> pd.DataFrame:
+    """Quantidade de unidades e de divergências em cada versão do histórico."""
+    if not list_snapshots(root):
+        return pd.DataFrame(columns=["_fetched_at", "_version", "unidades", "divergencias"])
+    filtro = None
+    if start is not None:
+        filtro = pc.field(PARTITION_KEY) >= pa.scalar(start)
+    if end is not None:
+        fim = pc.field(PARTITION_KEY) <= pa.scalar(end)
+        filtro = fim if filtro is None else filtro & fim
+    tabela = _dataset(root).to_table(
+        columns=["_fetched_at", "_version", "_divergente"], filter=filtro
+    )
+    agg = tabela.group_by(["_fetched_at", "_version"]).aggregate([
+        ("_divergente", "count"),
+        ("_divergente", "sum"),
+    ])
+    out = agg.to_pandas().rename(columns={
+        "_divergente_count": "unidades",
+        "_divergente_sum": "divergencias",
+    })
+    return out.sort_values("_fetched_at").reset_index(drop=True)
+
+def unit_history(codigo: str, columns, root=SNAPSHOT_DIR) -> pd.DataFrame:
+    """Valores de uma unidade (por CÓDIGO) em todas as versões do histórico."""
+    if not list_snapshots(root):
+        return pd.DataFrame(columns=["_fetched_at", "_version", *columns])
+    # snapshots antigos podem ter CÓDIGO numérico: compara como texto
+    tabela = _dataset(root).to_table(
+        columns=["_fetched_at", "_version", *columns],
+        filter=pc.field("CÓDIGO").cast(pa.string()) == pa.scalar(code_text(codigo)),
+    )
+    return tabela.to_pandas().sort_values("_fetched_at").reset_index(drop=True)
@@ -0,0 +1,145 @@
+"""Fontes dos dados brutos da planilha.
+
+Todas devolvem o mesmo formato (um DataFrame com as colunas da planilha) e
+alimentam o mesmo preparo em pipeline.prepare_dataset. A fonte é escolhida
+pela variável VIVEIROS_FONTE:
+
+    gsheets                          planilha pública do Google Sheets (padrão)
+    csv:/caminho/planilha.csv        CSV local
+    parquet:/caminho/planilha.parquet
+    sqlite:/caminho/banco.db#tabela
+
+Com columns, só as colunas pedidas (e existentes) são carregadas. Parquet é
+lido mapeado em memória e SQLite seleciona só essas colunas na consulta.
+
+iter_chunks lê a fonte em blocos de chunk_rows linhas, para o preparo em
+blocos (pipeline.prepare_chunks). Os CSVs são lidos sempre como texto, inteiros
+ou em blocos: o tipo de uma coluna não depende de quais linhas caíram no bloco
+e as duas leituras da mesma planilha dão a mesma versão (hash do conteúdo).
+"""
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from pipeline import SHEET_ID, GID, SEP, load_from_gsheet_csv
+
+class DataSource:
+    name = "fonte"
+
+    def load(self, columns=None) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def iter_chunks(self, columns=None, chunk_rows: int = 50_000):
+        yield self.load(columns)
+
+    def describe(self) -> str:
+        return self.name
+
+def _usecols(columns):
+    if columns is None:
+        return None
+    wanted = set(columns)
+    return lambda c: c in wanted
+
+class GoogleSheetsSource(DataSource):
+    name = "Google Sheets"
+
+    def __init__(self, sheet_id: str = SHEET_ID, gid: str = GID, sep: str = SEP):
+        self.sheet_id = sheet_id
+        self.gid = gid
+        self.sep = sep
+
+    def load(self, columns=None) -> pd.DataFrame:
+        # a exportação baixa a planilha inteira; a projeção só evita o parse do resto
+        return load_from_gsheet_csv(
+            self.sheet_id, self.gid, sep=self.sep, usecols=_usecols(columns), dtype=str
+        )
+
+    def iter_chunks(self, columns=None, chunk_rows: int = 50_000):
+        with load_from_gsheet_csv(
+            self.sheet_id, self.gid, sep=self.sep, usecols=_usecols(columns),
+            dtype=str, chunksize=chunk_rows,
+        ) as leitor:
+            yield from leitor
+
+class CsvSource(DataSource):
+    def __init__(self, path: str, sep: str = SEP):
+        self.path = path
+        self.sep = sep
+        self.name = f"CSV local ({os.path.basename(path)})"
+
+    def load(self, columns=None) -> pd.DataFrame:
+        return pd.read_csv(self.path, sep=self.sep, usecols=_usecols(columns), dtype=str)
+
+    def iter_chunks(self, columns=None, chunk_rows: int = 50_000):
+        with pd.read_csv(
+            self.path, sep=self.sep, usecols=_usecols(columns), dtype=str, chunksize=chunk_rows
+        ) as leitor:
+            yield from leitor
+
+class ParquetSource(DataSource):
+    def __init__(self, path: str):
+        self.path = path
+        self.name = f"Parquet local ({os.path.basename(path)})"
+
+    def _columns(self, columns):
+        if columns is None:
+            return None
+        # na ordem do arquivo, como no CSV
+        wanted = set(columns)
+        return [c for c in pq.read_schema(self.path).names if c in wanted]
+
+    def load(self, columns=None) -> pd.DataFrame:
+        return pq.read_table(self.path, columns=self._columns(columns), memory_map=True).to_pandas()
+
+    def iter_chunks(self, columns=None, chunk_rows: int = 50_000):
+        arquivo = pq.ParquetFile(self.path, memory_map=True)
+        for lote in arquivo.iter_batches(batch_size=chunk_rows, columns=self._columns(columns)):
+            yield lote.to_pandas()
+
+class SQLiteSource(DataSource):
+    def __init__(self, path: str, table: str):
+        self.path = path
+        self.table = table
+        self.name = f"SQLite ({os.path.basename(path)}#{table})"
+
+    def _query(self, con, columns) -> str:
+        tabela = '"' + self.table.replace('"', '""') + '"'
+        if columns is None:
+            return f"SELECT * FROM {tabela}"
+        wanted = set(columns)
+        cols = [r[1] for r in con.execute(f"PRAGMA table_info({tabela})") if r[1] in wanted]
+        selecao = ", ".join('"' + c.replace('"', '""') + '"' for c in cols) or "*"
+        return f"SELECT {selecao} FROM {tabela}"
+
+    def _connect(self):
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def load(self, columns=None) -> pd.DataFrame:
+        with closing(self._connect()) as con:
+            return pd.read_sql_query(self._query(con, columns), con)
+
+    def iter_chunks(self, columns=None, chunk_rows: int = 50_000):
+        with closing(self._connect()) as con:
+            yield from pd.read_sql_query(self._query(con, columns), con, chunksize=chunk_rows)
+
+def source_from_config(spec: str = None) -> DataSource:
+    """Cria a fonte descrita em spec (ou em VIVEIROS_FONTE)."""
+    spec = (spec if spec is not None else os.environ.get("VIVEIROS_FONTE", "gsheets")).strip()
+    tipo, _, alvo = spec.partition(":")
+    tipo = tipo.lower()
+    if tipo in ("", "gsheets"):
+        return GoogleSheetsSource()
+    if tipo == "csv":
+        return CsvSource(alvo)
+    if tipo == "parquet":
+        return ParquetSource(alvo)
+    if tipo == "sqlite":
+        caminho, _, tabela = alvo.partition("#")
+        if not tabela:
+            raise ValueError("Fonte sqlite precisa da tabela: sqlite:/caminho/banco.db#tabela")
+        return SQLiteSource(caminho, tabela)
+    raise ValueError(f"Fonte de dados desconhecida: {spec}")
@@ -0,0 +1,53 @@
+"""Planilha pequena, no formato da exportação, compartilhada pelos testes."""
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from pipeline import compact_dataset, prepare_dataset  # noqa: E402
+
+
+def planilha() -> pd.DataFrame:
+    """Seis unidades: divergentes e não, com foto do Drive, outro link e sem
+    foto, coordenada em UTM, lat/long trocadas e sem coordenada."""
+    return pd.DataFrame({
+        "CÓDIGO": ["V001", "V002", "V003", "V004", "V005", "V006"],
+        "Nome": ["Ana", "Bruno", "Carla", "Davi", "Elis", "Ana"],
+        "Ocorrências": ["Regular", "Ampliado", "Regular", "Abandonado", "Regular", "Sem acesso"],
+        "Nº Viveiros total": ["4", "2", "3", "5", "1", "2"],
+        "Atual Viveiros Total": ["4", "6", "1", "5", "1", "2"],
+        "Nº Viveiros cheio": ["2", "1", "1", "3", "0", "1"],
+        "Atual Viveiros cheio": ["2", "3", "0", "3", "0", "1"],
+        "Área (ha).1": ["1,50", "0,80", "1,00", "2,00", "0,30", "0,70"],
+        "Atual Área (ha).1": ["1,50", "1,60", "0,50", "2,00", "0,30", "0,70"],
+        "Prof. Média  (m)": ["1,5", "1,5", "1,5", "1,5", "1,5", "1,5"],
+        "Atual Profun.": ["1,5", "1,8", "1,2", "1,5", "1,5", "1,5"],
+        "Lati": ["-5,100000", "-5,200000", "9436000", "-39,300000", "", "-5,400000"],
+        "Long": ["-39,100000", "-39,200000", "500000", "-5,300000", "", "-39,400000"],
+        "Link Foto": [
+            "https://drive.google.com/file/d/1AbCdEfGhIjKlMnOp/view",
+            "https://example.com/foto.jpg",
+            "",
+            "https://drive.google.com/open?id=1QrStUvWxYz012345",
+            "",
+            "https://drive.google.com/file/d/1AbCdEfGhIjKlMnOp/view",
+        ],
+        "Data": [
+            "2024/03/04 11:22:03.951+00", "2024/07/04 11:22:03.951+00", "2025/01/10 08:00:00.000+00",
+            "2023/11/20 09:30:00.000+00", "2025/05/02 10:00:00.000+00", "2024/03/15 14:00:00.000+00",
+        ],
+        "Data Filtro": "",
+    })
+
+
+@pytest.fixture
+def raw_sheet() -> pd.DataFrame:
+    return planilha()
+
+
+@pytest.fixture
+def dataset() -> pd.DataFrame:
+    return compact_dataset(prepare_dataset(planilha()))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from anomalies import _metros, near_pairs, robust_outliers
+
+
+def _pares_forca_bruta(lat, lon, dist_m):
+    ok = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+    x, y = _metros(lat[ok], lon[ok])
+    pares = set()
+    for a in range(len(ok)):
+        for b in range(a + 1, len(ok)):
+            if np.hypot(x[a] - x[b], y[a] - y[b]) <= dist_m:
+                pares.add((int(ok[a]), int(ok[b])))
+    return pares
+
+
+def test_near_pairs_igual_a_forca_bruta():
+    rng = np.random.default_rng(1)
+    lat = -5.0 + rng.random(400) * 0.01
+    lon = -39.0 + rng.random(400) * 0.01
+    lat[[10, 20]] = np.nan
+    i, j, d = near_pairs(lat, lon, 30.0)
+    assert (i < j).all() and (d <= 30.0).all()
+    assert set(zip(i.tolist(), j.tolist())) == _pares_forca_bruta(lat, lon, 30.0)
+
+
+def test_near_pairs_identicas_e_distantes():
+    lat = np.array([-5.0, -5.0, -5.1, np.nan])
+    lon = np.array([-39.0, -39.0, -39.1, -39.0])
+    i, j, d = near_pairs(lat, lon, 30.0)
+    assert (i.tolist(), j.tolist(), d.tolist()) == ([0], [1], [0.0])
+
+
+def test_near_pairs_sem_pontos_suficientes():
+    for lat, lon, dist in [([], [], 30.0), ([-5.0], [-39.0], 30.0), ([-5.0, -5.0], [-39.0, -39.0], 0)]:
+        i, j, d = near_pairs(np.array(lat, dtype=float), np.array(lon, dtype=float), dist)
+        assert len(i) == len(j) == len(d) == 0
+
+
+def test_robust_outliers_por_grupo():
+    valores = np.array([1.0, 1.1, 0.9, 1.0, 1.05, 10.0, 100.0, 101.0, 99.0, 100.5, 100.2])
+    grupos = np.array(["a"] * 6 + ["b"] * 5)
+    pos, escore, mediana = robust_outliers(valores, grupos)
+    # 10 é atípico em "a"; os valores perto de 100 são normais em "b"
+    assert pos.tolist() == [5]
+    assert escore[0] > 3.5 and mediana[0] == pytest.approx(1.025)
+
+
+def test_robust_outliers_grupo_pequeno_ou_sem_dispersao():
+    pequeno = robust_outliers(np.array([1.0, 1.0, 50.0]), np.array(["a"] * 3))
+    constante = robust_outliers(np.array([2.0] * 6 + [9.0]), np.array(["a"] * 7))
+    assert len(pequeno[0]) == 0 and len(constante[0]) == 0
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from changes import RowHasher, build_changeset, match_rows, row_hashes
+from pipeline import SOURCE_COLUMNS, compact_dataset, prepare_dataset
+
+
+def _versao_nova(raw: pd.DataFrame) -> pd.DataFrame:
+    """V002 alterada, V005 removida e V007 incluída."""
+    novo = raw.copy()
+    novo.loc[1, "Atual Viveiros Total"] = "7"
+    novo = novo.drop(index=4)
+    return pd.concat([novo, raw.iloc[[0]].assign(CÓDIGO="V007")], ignore_index=True)
+
+
+def test_match_rows_classifica_as_linhas(raw_sheet):
+    novo = _versao_nova(raw_sheet)
+    iguais_new, iguais_old, mod_new, mod_old, novos, removidos = match_rows(
+        row_hashes(raw_sheet), row_hashes(novo)
+    )
+    assert novo["CÓDIGO"].iloc[iguais_new].tolist() == ["V001", "V003", "V004", "V006"]
+    assert raw_sheet["CÓDIGO"].iloc[iguais_old].tolist() == ["V001", "V003", "V004", "V006"]
+    assert novo["CÓDIGO"].iloc[mod_new].tolist() == ["V002"]
+    assert raw_sheet["CÓDIGO"].iloc[mod_old].tolist() == ["V002"]
+    assert novo["CÓDIGO"].iloc[novos].tolist() == ["V007"]
+    assert raw_sheet["CÓDIGO"].iloc[removidos].tolist() == ["V005"]
+
+
+def test_match_rows_codigos_repetidos(raw_sheet):
+    raw = raw_sheet.assign(CÓDIGO=["V001", "V001", None, "V004", "V005", "V006"])
+    novo = raw.copy()
+    novo.loc[1, "Nome"] = "Outro"
+    iguais_new, _, mod_new, mod_old, novos, removidos = match_rows(row_hashes(raw), row_hashes(novo))
+    # a segunda V001 casa com a segunda, pela ordem de ocorrência
+    assert mod_new.tolist() == [1] and mod_old.tolist() == [1]
+    assert iguais_new.tolist() == [0, 2, 3, 4, 5]
+    assert len(novos) == 0 and len(removidos) == 0
+
+
+def test_build_changeset_nao_lista_linha_sem_codigo(raw_sheet):
+    raw = raw_sheet.assign(CÓDIGO=["V001", "V002", None, "V004", "V005", "V006"])
+    novo = raw.drop(index=2).reset_index(drop=True)
+    df = compact_dataset(prepare_dataset(raw))
+    cs = build_changeset("v1", row_hashes(raw), row_hashes(novo), df,
+                         compact_dataset(prepare_dataset(novo)), SOURCE_COLUMNS)
+    assert cs.removidos == []
+
+
+def test_row_hashes_codigo_numerico_como_texto():
+    raw = pd.DataFrame({"CÓDIGO": [101.0, np.nan], "Nome": ["a", "b"]})
+    chaves = row_hashes(raw).index.get_level_values(0)
+    assert chaves[0] == "101"
+
+
+def test_row_hasher_em_blocos_igual_ao_inteiro(raw_sheet):
+    hasher = RowHasher()
+    hasher.update(raw_sheet.iloc[:4])
+    hasher.update(raw_sheet.iloc[4:])
+    pd.testing.assert_series_equal(hasher.row_hashes(), row_hashes(raw_sheet))
+
+
+def test_build_changeset(raw_sheet):
+    novo = _versao_nova(raw_sheet)
+    old_df = compact_dataset(prepare_dataset(raw_sheet))
+    new_df = compact_dataset(prepare_dataset(novo))
+    cs = build_changeset("v1", row_hashes(raw_sheet), row_hashes(novo), old_df, new_df, SOURCE_COLUMNS)
+
+    assert cs.previous_version == "v1"
+    assert (cs.novos, cs.removidos, cs.modificados) == (["V007"], ["V005"], ["V002"])
+    assert cs.total == 3
+    assert cs.deltas[["CÓDIGO", "Campo"]].values.tolist() == [["V002", "Atual Viveiros Total"]]
+    assert (cs.deltas["Antes"].iloc[0], cs.deltas["Depois"].iloc[0]) == (6, 7)
+
+
+def test_build_changeset_sem_mudancas(raw_sheet, dataset):
+    h = row_hashes(raw_sheet)
+    cs = build_changeset("v1", h, h, dataset, dataset, SOURCE_COLUMNS)
+    assert cs.total == 0 and cs.deltas.empty
@@ -0,0 +1,58 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from openpyxl import load_workbook
+from streamlit.runtime.download_data_util import convert_data_to_bytes_and_infer_mime
+
+from export import WRITERS, export_columns, export_filtered
+
+
+@pytest.mark.parametrize("formato", sorted(WRITERS))
+def test_export_aceito_pelo_download_button(dataset, formato):
+    """O st.download_button chama o partial e passa o resultado por esta função."""
+    conteudo = export_filtered(dataset, np.arange(len(dataset)), formato)
+    dados, _ = convert_data_to_bytes_and_infer_mime(conteudo, RuntimeError("tipo não aceito"))
+    assert dados == conteudo and len(dados) > 0
+
+
+def test_csv_so_linhas_de_sel_com_link_remontado(dataset):
+    sel = np.array([3, 0])
+    csv = pd.read_csv(io.BytesIO(export_filtered(dataset, sel, "CSV")), encoding="utf-8-sig")
+    assert csv["CÓDIGO"].tolist() == ["V004", "V001"]
+    assert csv["Link Foto"].tolist() == [
+        "https://drive.google.com/file/d/1QrStUvWxYz012345/view",
+        "https://drive.google.com/file/d/1AbCdEfGhIjKlMnOp/view",
+    ]
+    assert "Latitude" in csv.columns and "_lat_wgs84" not in csv.columns
+
+
+def test_csv_vazio_tem_cabecalho(dataset):
+    csv = pd.read_csv(io.BytesIO(export_filtered(dataset, np.arange(0), "CSV")), encoding="utf-8-sig")
+    assert len(csv) == 0 and "CÓDIGO" in csv.columns
+
+
+def test_parquet_mantem_colunas_e_linhas(dataset):
+    sel = np.array([1, 2, 4])
+    tabela = pq.read_table(io.BytesIO(export_filtered(dataset, sel, "Parquet")))
+    assert tabela.num_rows == 3
+    assert tabela.column("CÓDIGO").to_pylist() == ["V002", "V003", "V005"]
+    assert tabela.column("Link Foto").to_pylist() == ["https://example.com/foto.jpg", None, None]
+
+
+def test_geojson_sem_coordenada_vira_geometria_nula(dataset):
+    geo = json.loads(export_filtered(dataset, np.arange(len(dataset)), "GeoJSON"))
+    geometrias = {f["properties"]["CÓDIGO"]: f["geometry"] for f in geo["features"]}
+    assert len(geometrias) == len(dataset) and geometrias["V005"] is None
+    lon, lat = geometrias["V001"]["coordinates"]
+    assert (lat, lon) == pytest.approx((-5.1, -39.1))
+
+
+def test_xlsx_uma_linha_por_unidade(dataset):
+    wb = load_workbook(io.BytesIO(export_filtered(dataset, np.arange(len(dataset)), "XLSX")))
+    linhas = list(wb.active.values)
+    assert len(linhas) == len(dataset) + 1
+    assert len(linhas[0]) == len(export_columns(dataset))
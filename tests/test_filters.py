@@ -0,0 +1,30 @@
+import pytest
+
+from filters import FilterState
+
+
+@pytest.mark.parametrize("estado", [
+    FilterState(),
+    FilterState.normalized(anos=[2025, 2024], meses=["Mar", "Jan"]),
+    FilterState.normalized(ocorrencias=["Sem acesso", "Ampliado, parcial"], busca="  Ana "),
+    FilterState.normalized(anos=[2024], meses=["Jul"], ocorrencias=["Regular"], busca="v00"),
+])
+def test_query_params_ida_e_volta(estado):
+    assert FilterState.from_query_params(estado.to_query_params()) == estado
+
+
+def test_normalized_e_canonico():
+    a = FilterState.normalized(anos=["2024", 2023, 2024], ocorrencias={"B", "A"}, busca=" Ana ")
+    b = FilterState.normalized(anos=[2023, 2024], ocorrencias=["A", "B"], busca="ana")
+    assert a == b and hash(a) == hash(b)
+    assert a.anos == (2023, 2024) and a.busca == "ana"
+
+
+def test_from_query_params_ignora_lixo():
+    estado = FilterState.from_query_params({"ano": "2024,abc,,2023", "ocorr": "|Regular|"})
+    assert estado == FilterState.normalized(anos=[2023, 2024], ocorrencias=["Regular"])
+
+
+def test_estado_vazio_sem_parametros():
+    assert FilterState().to_query_params() == {}
+    assert FilterState.from_query_params({}) == FilterState()
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from changes import match_rows, row_hashes
+from pipeline import (
+    GEO_FORA, GEO_INVERTIDA, GEO_OK, GEO_SINAL, GEO_UTM, GEO_VAZIA,
+    compact_dataset, normalize_coordinates, prepare_dataset, prepare_incremental,
+)
+
+
+@pytest.mark.parametrize("lat, lon, status", [
+    (-5.1, -39.1, GEO_OK),
+    (-39.1, -5.1, GEO_INVERTIDA),
+    (5.1, 39.1, GEO_SINAL),
+    (9436000.0, 500000.0, GEO_UTM),
+    (500000.0, 9436000.0, GEO_UTM),
+    (-23.5, -46.6, GEO_FORA),
+    (np.nan, -39.1, GEO_VAZIA),
+])
+def test_normalize_coordinates_status(lat, lon, status):
+    out_lat, out_lon, out_status = normalize_coordinates(np.array([lat]), np.array([lon]))
+    assert out_status[0] == status
+    if status in (GEO_FORA, GEO_VAZIA):
+        assert np.isnan(out_lat[0]) and np.isnan(out_lon[0])
+    else:
+        assert -8.2 <= out_lat[0] <= -2.4 and -41.8 <= out_lon[0] <= -36.9
+
+
+def test_normalize_coordinates_utm_no_meridiano_central():
+    # leste 500 000 m cai exatamente no meridiano central da zona 24 (39° O)
+    lat, lon, _ = normalize_coordinates(np.array([9436000.0]), np.array([500000.0]))
+    assert lon[0] == pytest.approx(-39.0, abs=1e-6)
+    assert lat[0] == pytest.approx(-5.1, abs=0.01)
+
+
+def test_prepare_dataset_status_da_planilha(dataset):
+    assert dataset["_geo_status"].astype(str).tolist() == [
+        GEO_OK, GEO_OK, GEO_UTM, GEO_INVERTIDA, GEO_VAZIA, GEO_OK,
+    ]
+
+
+def test_prepare_incremental_igual_ao_preparo_completo(raw_sheet, dataset):
+    novo = raw_sheet.copy()
+    novo.loc[1, "Atual Viveiros Total"] = "9"
+    novo = pd.concat([novo.drop(index=4), novo.iloc[[0]].assign(CÓDIGO="V007")], ignore_index=True)
+
+    iguais_new, iguais_old, *_ = match_rows(row_hashes(raw_sheet), row_hashes(novo))
+    inc = prepare_incremental(dataset, novo, iguais_new, iguais_old)
+
+    esperado = compact_dataset(prepare_dataset(novo))
+    pd.testing.assert_frame_equal(inc, esperado[inc.columns], check_categorical=False)
+
+
+def test_prepare_incremental_sem_linhas_novas(raw_sheet, dataset):
+    # versão que só remove linhas: nada passa por prepare_dataset
+    novo = raw_sheet.drop(index=[2, 3]).reset_index(drop=True)
+    iguais_new, iguais_old, *_ = match_rows(row_hashes(raw_sheet), row_hashes(novo))
+    inc = prepare_incremental(dataset, novo, iguais_new, iguais_old)
+    assert inc["CÓDIGO"].astype(str).tolist() == ["V001", "V002", "V005", "V006"]
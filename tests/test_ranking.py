@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from ranking import divergence_scores, metric_scales, top_k
+
+
+def test_divergence_scores_entre_0_e_1(dataset):
+    scores = divergence_scores(dataset, np.arange(len(dataset)))
+    assert scores.shape == (len(dataset),)
+    assert ((scores >= 0) & (scores <= 1)).all()
+
+
+def test_divergence_scores_sem_divergencia_zero(dataset):
+    # V001, V004, V005 e V006 não mudaram nada
+    scores = divergence_scores(dataset, np.array([0, 3, 4, 5]))
+    assert scores.tolist() == [0.0, 0.0, 0.0, 0.0]
+
+
+def test_divergence_scores_ordem_das_posicoes(dataset):
+    escalas = metric_scales(dataset)
+    todas = divergence_scores(dataset, np.arange(len(dataset)), escalas)
+    pos = np.array([2, 1])
+    assert divergence_scores(dataset, pos, escalas).tolist() == todas[pos].tolist()
+    # V002 triplicou os viveiros; V003 perdeu parte: as duas pontuam
+    assert todas[1] > 0 and todas[2] > 0
+
+
+def test_divergence_scores_limitado_a_1(dataset):
+    df = dataset.copy()
+    df.loc[0, "Atual Viveiros Total"] = 4000
+    df.loc[0, "diff_viv_total"] = 3996
+    assert divergence_scores(df, np.array([0]))[0] <= 1.0
+
+
+@pytest.mark.parametrize("k", [1, 3, 5, 10])
+def test_top_k_igual_a_ordenacao_completa(k):
+    rng = np.random.default_rng(0)
+    scores = rng.random(50)
+    esperado = np.argsort(-scores, kind="stable")[:k]
+    assert top_k(scores, k).tolist() == esperado.tolist()
+
+
+def test_top_k_bordas():
+    assert top_k(np.array([0.5, 0.9]), 0).tolist() == []
+    assert top_k(np.array([]), 3).tolist() == []
+    assert top_k(np.array([0.1, 0.9, 0.5]), 10).tolist() == [1, 2, 0]
+
+
+def test_top_k_empate_estavel():
+    assert top_k(np.array([0.5, 0.5, 0.5]), 3).tolist() == [0, 1, 2]
@@ -0,0 +1,46 @@
+from datetime import date, datetime
+
+from pipeline import TZ
+from snapshots import list_snapshots, read_as_of, write_snapshot
+
+
+def _grava(df, root, versao, quando):
+    return write_snapshot(df, versao, datetime.fromisoformat(quando).replace(tzinfo=TZ), root=root)
+
+
+def test_read_as_of_ultima_versao_ate_a_data(dataset, tmp_path):
+    _grava(dataset, tmp_path, "v1", "2025-03-01 08:00:00")
+    alterado = dataset.copy()
+    alterado.loc[0, "Nome"] = "Alterado"
+    _grava(alterado, tmp_path, "v2", "2025-03-01 15:00:00")
+    _grava(alterado.iloc[:2], tmp_path, "v3", "2025-03-03 09:00:00")
+
+    assert read_as_of(date(2025, 3, 1), root=tmp_path)["_version"].iloc[0] == "v2"
+    assert read_as_of(date(2025, 3, 2), root=tmp_path)["_version"].iloc[0] == "v2"
+    assert len(read_as_of(date(2025, 3, 3), root=tmp_path)) == 2
+
+    manha = read_as_of(datetime(2025, 3, 1, 12, 0, tzinfo=TZ), root=tmp_path)
+    assert manha["_version"].iloc[0] == "v1" and manha["Nome"].iloc[0] == "Ana"
+    # datetime sem fuso é lido no fuso da planilha
+    assert read_as_of(datetime(2025, 3, 1, 15, 0), root=tmp_path)["_version"].iloc[0] == "v2"
+
+
+def test_read_as_of_antes_do_primeiro_snapshot(dataset, tmp_path):
+    _grava(dataset, tmp_path, "v1", "2025-03-01 08:00:00")
+    vazio = read_as_of(date(2025, 2, 28), columns=["CÓDIGO", "Nome"], root=tmp_path)
+    assert vazio.empty and list(vazio.columns) == ["CÓDIGO", "Nome"]
+    assert read_as_of(date(2025, 3, 1), root=tmp_path / "nao-existe").empty
+
+
+def test_read_as_of_colunas_e_link_remontado(dataset, tmp_path):
+    _grava(dataset, tmp_path, "v1", "2025-03-01 08:00:00")
+    df = read_as_of(date(2025, 3, 1), columns=["CÓDIGO", "Link Foto"], root=tmp_path)
+    assert list(df.columns) == ["CÓDIGO", "Link Foto"]
+    assert df["CÓDIGO"].tolist() == ["V001", "V002", "V003", "V004", "V005", "V006"]
+    assert df["Link Foto"].iloc[1] == "https://example.com/foto.jpg"
+
+
+def test_write_snapshot_nao_repete_versao(dataset, tmp_path):
+    primeiro = _grava(dataset, tmp_path, "v1", "2025-03-01 08:00:00")
+    assert _grava(dataset, tmp_path, "v1", "2025-03-02 08:00:00") == primeiro
+    assert list_snapshots(tmp_path) == [primeiro]
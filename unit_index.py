@@ -0,0 +1,55 @@
+"""Índice das unidades de uma versão do dataset.
+
+Montado uma vez por versão, leva de CÓDIGO às posições da unidade e de ID de
+arquivo do Drive às unidades que usam aquela foto, em consultas de dicionário
+(sem busca de texto nem varredura da tabela).
+"""
+import numpy as np
+import pandas as pd
+
+from photos import has_photos, photo_ids
+from pipeline import code_text, code_texts
+
+_VAZIO = np.empty(0, dtype=np.int64)
+
+def normalize_code(v) -> str:
+    """Chave de busca de um CÓDIGO: code_text (101.0 vira "101") em maiúsculas."""
+    return code_text(v).upper()
+
+def _agrupa(chaves: np.ndarray, validas: np.ndarray) -> dict:
+    """{chave: posições} das linhas válidas."""
+    pos = np.flatnonzero(validas)
+    grupos = pd.Series(pos).groupby(chaves[pos], sort=False).indices
+    return {k: pos[i] for k, i in grupos.items()}
+
+class UnitIndex:
+    def __init__(self, por_codigo: dict, por_arquivo: dict, linhas: int):
+        self.por_codigo = por_codigo
+        self.por_arquivo = por_arquivo
+        self.linhas = linhas
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> "UnitIndex":
+        n = len(df)
+        por_codigo = {}
+        if "CÓDIGO" in df.columns:
+            # mesma normalização de normalize_code, vetorizada
+            codigos = code_texts(df["CÓDIGO"]).str.upper().fillna("").to_numpy(dtype=object)
+            por_codigo = _agrupa(codigos, codigos != "")
+
+        por_arquivo = {}
+        if has_photos(df):
+            ids = photo_ids(df)
+            por_arquivo = _agrupa(ids, pd.notna(ids))
+        return cls(por_codigo, por_arquivo, n)
+
+    def positions(self, codigo) -> np.ndarray:
+        """Posições das linhas com este CÓDIGO (vazio se não existir)."""
+        return self.por_codigo.get(normalize_code(codigo), _VAZIO)
+
+    def units_for_file(self, file_id: str) -> np.ndarray:
+        """Posições das unidades cuja foto aponta para este arquivo do Drive."""
+        return self.por_arquivo.get(file_id, _VAZIO)
+
+    def __len__(self):
+        return len(self.por_codigo)